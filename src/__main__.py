@@ -7,12 +7,23 @@ import spacy
 from mongoengine import disconnect
 
 from src.models.location_inference import infer_users_from_file
-from src.tasks.csv import read_csv
-from src.tasks.histories import get_users_histories
-from src.tasks.praw import extract_praw, validate_praw
-from src.tasks.spacy import add_spacy_to_mongo
+from src.tasks.csv import CSV_CHUNK_SIZE, N_WORKERS, import_csv, import_csv_dir, read_csv
+from src.dedupe import PidFilter
+from src.parse_store import PARSE_STORES
+from src.pushshift import PUSHSHIFT_URL, RATE_LIMIT_PER_MINUTE, PushshiftClient, TokenBucket
+from src.schema import User
+from src.history_queue import HistoryQueue
+from src.tasks.histories import N_WORKERS as HISTORY_WORKERS
+from src.tasks.histories import (drain_history_queue, get_users_histories,
+                                 get_users_histories_concurrent, refresh_users_histories)
+from src.tasks.praw import (extract_praw_sharded, parse_date, register_subreddits,
+                            update_subreddits, validate_praw)
+from src.tasks.spacy import (N_PROCESS, SPACY_BATCH_SIZE, add_location_ents, add_spacy_to_mongo,
+                             count_stale_posts, run_spacy_shards)
 from src.utils import (
+    BULK_BATCH_SIZE,
     PROJ_DIR,
+    ROOT_DIR,
     SUBR_NAMES,
     connect_to_mongo,
     get_praw,
@@ -31,9 +42,19 @@ def gen_args() -> argparse.ArgumentParser:
     query_praw.add_argument("--startdate", help="The start date for Praw scraping", type=str)
     query_praw.add_argument("--enddate", help="The end date for Praw scraping", type=str)
     query_praw.add_argument("--limit", help="The number of Praw objects to limit querying", type=int)
+    query_praw.add_argument(
+        "--windows",
+        help="Backfill the date range as this many concurrently fetched, checkpointed windows",
+        type=int,
+    )
 
     csv = parser.add_argument_group("CSV Parsing")
     csv.add_argument("--csv", help="The csv filepath to parse from", type=str)
+    csv.add_argument(
+        "--csvdir",
+        help="Import every csv file in this directory that is new or changed since the last run",
+        type=str,
+    )
     csv.add_argument(
         "--posttype", help="If data to parse is " + "submissions (s) or comments (c)"
     )
@@ -46,13 +67,82 @@ def gen_args() -> argparse.ArgumentParser:
     )
     tasks.add_argument(
         "--update",
-        help="Insert all posts for all subreddits from the last posted date",
+        help="Insert all posts for all registered subreddits from their last posted date",
         action="store_true",
     )
+    tasks.add_argument(
+        "--addsubr",
+        help="Add subreddits to the registry kept up to date by --update, from --startdate if new.",
+        nargs="+",
+    )
     tasks.add_argument(
         "--histories", help="Retrieve full posting history for all users.", action="store_true"
     )
+    tasks.add_argument(
+        "--refresh-histories",
+        help="Retrieve only the posts made since each fetched user's history was last retrieved.",
+        action="store_true",
+    )
+    tasks.add_argument(
+        "--queued-histories",
+        help="Retrieve full posting histories for new users waiting in the history queue.",
+        action="store_true",
+    )
+    tasks.add_argument(
+        "--workers",
+        help="The number of workers for updating, retrieving histories, importing csvs and "
+        "running spacy.",
+        type=int,
+    )
+    tasks.add_argument(
+        "--ratelimit",
+        help="The max number of Pushshift requests per minute shared by all workers.",
+        type=int,
+        default=RATE_LIMIT_PER_MINUTE,
+    )
+    tasks.add_argument(
+        "--api-base",
+        help="The Pushshift base url to query, e.g. a local fake server for benchmarks.",
+        type=str,
+    )
+    tasks.add_argument(
+        "--pidfilter",
+        help="Skip converting already stored posts using the bloom filter persisted at this path.",
+        type=str,
+    )
     tasks.add_argument("--spacy", help="Run spacy on all new documents.", action="store_true")
+    tasks.add_argument(
+        "--spacy-shards",
+        help="Run spacy as one of any number of workers leasing this many pid-range shards.",
+        type=int,
+    )
+    tasks.add_argument(
+        "--parse-store",
+        help="Keep spacy parses in this store rather than on their posts; disk stores write "
+        "to PARSE_DIR.",
+        choices=sorted(PARSE_STORES),
+    )
+    tasks.add_argument(
+        "--spacy-verify",
+        help="Also re-parse posts whose text changed since they were parsed, hashing every post.",
+        action="store_true",
+    )
+    tasks.add_argument(
+        "--spacy-dry-run",
+        help="Report how many posts --spacy would parse, without parsing any.",
+        action="store_true",
+    )
+    tasks.add_argument(
+        "--location-ents",
+        help="Find the entities of posts without them, running NER only on posts naming a place "
+        "in the gazetteer, and report the skip rate and recall.",
+        action="store_true",
+    )
+    tasks.add_argument(
+        "--batchsize",
+        help="Stream and write posts to mongo in unordered bulk batches of this size.",
+        type=int,
+    )
 
     location_inference = parser.add_argument_group("Location Inference")
     location_inference.add_argument(
@@ -71,9 +161,13 @@ def main() -> None:
 
     # initialize data
     praw = get_praw()
-    psaw = get_psaw(praw)
+    psaw = get_psaw(praw, args.api_base)
     nlp = spacy.load("en_core_web_sm")
+    client = PushshiftClient(
+        args.api_base or PUSHSHIFT_URL, limiter=TokenBucket(args.ratelimit / 60)
+    )
     connect_to_mongo()
+    pid_filter = PidFilter.load_or_build(args.pidfilter) if args.pidfilter else None
 
     # retrieve the last date stored in mongo
     if args.lastdate and args.subr:
@@ -82,42 +176,125 @@ def main() -> None:
         print("Most recent date in the database:", date)
 
     # retrieve data from praw if valid fields given
-    if args.subr:
+    if args.subr and args.windows:
+        print("Backfilling posts from Reddit in parallel windows .....")
+        checkpoint_fp = os.path.join(ROOT_DIR, "cache", f"backfill-{args.subr}.jsonl")
+        end_date = parse_date(args.enddate) if args.enddate else None
+        extract_praw_sharded(
+            client,
+            args.subr,
+            parse_date(args.startdate),
+            end_date,
+            args.windows,
+            checkpoint_fp,
+            args.batchsize or BULK_BATCH_SIZE,
+            pid_filter,
+        )
+    elif args.subr:
         print("Retrieving limited posts from Reddit .....")
         praw_data = validate_praw(psaw, args.subr, args.startdate, args.enddate, args.limit)
         print(f"{len(praw_data)} posts from Reddit retrieved.")
-        posts_to_mongo(praw_data)
+        posts_to_mongo(praw_data, args.batchsize)
 
     # retrieve data from csv if valid fields given
     if args.csv:
         print("Retrieving data from csv .....")
-        posts = read_csv(args.csv, args.posttype)
-        posts_to_mongo(posts)
+        if args.batchsize:
+            import_csv(args.csv, args.posttype, args.batchsize)
+        else:
+            posts = read_csv(args.csv, args.posttype)
+            posts_to_mongo(posts)
+
+    # import all new or changed csv files in a directory
+    if args.csvdir:
+        print("Importing data from csv directory .....")
+        import_csv_dir(
+            args.csvdir,
+            args.posttype,
+            args.workers or N_WORKERS,
+            chunksize=args.batchsize or CSV_CHUNK_SIZE,
+        )
+
+    # register new subreddits with the updater
+    if args.addsubr:
+        start_date = parse_date(args.startdate) if args.startdate else None
+        register_subreddits(args.addsubr, start_date)
 
     # add all recent posts to database
     if args.update:
         print("Retrieving all new posts from Reddit .....")
-        for subr_name in SUBR_NAMES:
-            print(f"\tGetting posts from subreddit: {subr_name}")
-            start_date = last_date(subr_name)
-            posts = extract_praw(psaw, subr_name, start_date)
-            posts_to_mongo(posts)
+        register_subreddits(SUBR_NAMES)
+        batch_size = args.batchsize or BULK_BATCH_SIZE
+        if args.workers:
+            update_subreddits(client, args.workers, batch_size, pid_filter)
+        else:
+            update_subreddits(psaw, batch_size=batch_size, pid_filter=pid_filter)
 
     if args.histories:
         print("Retrieving user histories .....")
         users_fp = os.path.join(PROJ_DIR, "..", "clutter", "users.csv")
-        users = pd.read_csv(users_fp, squeeze=True, header=None).tolist()
-        get_users_histories(users, psaw, users_fp)
+        journal_fp = os.path.join(PROJ_DIR, "..", "clutter", "users-completed.jsonl")
+        users = pd.read_csv(users_fp, squeeze=True, header=None).astype(str).tolist()
+        if args.workers:
+            get_users_histories_concurrent(
+                users, client, args.workers, args.batchsize or BULK_BATCH_SIZE, journal_fp,
+                pid_filter
+            )
+        else:
+            get_users_histories(users, psaw, journal_fp, pid_filter)
+
+    # fetch the new posts of every user whose history was fetched before
+    if args.refresh_histories:
+        print("Refreshing user histories .....")
+        users = [u.username for u in User.objects(history_datetime__ne=None).only("username")]
+        refresh_users_histories(
+            users,
+            client,
+            args.workers or HISTORY_WORKERS,
+            args.batchsize or BULK_BATCH_SIZE,
+            pid_filter,
+        )
+
+    # backfill the histories of users first seen during ingestion
+    if args.queued_histories:
+        print("Retrieving queued user histories .....")
+        drain_history_queue(
+            client,
+            args.workers or HISTORY_WORKERS,
+            args.batchsize or BULK_BATCH_SIZE,
+            pid_filter=pid_filter,
+        )
+        print(f"History queue: {HistoryQueue().counts()}")
 
     # add spacy to docs without spacy
     if args.spacy:
         print("Updating documents with spacy .....")
-        add_spacy_to_mongo(nlp)
+        batch_size, n_process = args.batchsize or SPACY_BATCH_SIZE, args.workers or N_PROCESS
+        store = PARSE_STORES[args.parse_store]() if args.parse_store else None
+        if args.spacy_dry_run:
+            print(f"Posts to parse: {count_stale_posts(nlp, args.spacy_verify)}")
+        elif args.spacy_shards:
+            run_spacy_shards(nlp, args.spacy_shards, batch_size, n_process, store=store,
+                             verify=args.spacy_verify)
+        else:
+            add_spacy_to_mongo(nlp, batch_size, n_process, verify=args.spacy_verify, store=store)
+        if store is not None:
+            store.close()
+
+    # find the entities of posts that could name a place
+    if args.location_ents:
+        print("Finding location entities .....")
+        add_location_ents(nlp, batch_size=args.batchsize or SPACY_BATCH_SIZE,
+                          n_process=args.workers or N_PROCESS)
 
     if args.location_inference:
         usernames_fp = args.location_inference
         infer_users_from_file(usernames_fp)
 
+    if pid_filter is not None:
+        print(f"Pid filter: {pid_filter}")
+        pid_filter.save(args.pidfilter)
+
     disconnect()
     print("Program completed.")
 
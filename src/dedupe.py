@@ -0,0 +1,133 @@
+"""A pre-conversion filter that drops posts which are already stored."""
+import hashlib
+import math
+import os
+import struct
+import threading
+from typing import Any, Callable, List, Optional
+
+from src.schema import Post
+
+BLOOM_ERROR_RATE = 0.001
+MIN_CAPACITY = 1000000
+HEADER = struct.Struct("<QQQ")
+
+
+class BloomFilter:
+    """A fixed size bloom filter over strings."""
+
+    def __init__(self, n_bits: int, n_hashes: int, n_items: int = 0,
+                 bits: Optional[bytearray] = None):
+        self.n_bits = n_bits
+        self.n_hashes = n_hashes
+        self.n_items = n_items
+        self.bits = bits if bits is not None else bytearray((n_bits + 7) // 8)
+
+    @classmethod
+    def for_capacity(cls, capacity: int, error_rate: float = BLOOM_ERROR_RATE) -> "BloomFilter":
+        """Create a filter sized to hold the given number of items at the given error rate."""
+        n_bits = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        n_hashes = max(1, round(n_bits / capacity * math.log(2)))
+        return cls(n_bits, n_hashes)
+
+    def _indexes(self, key: str) -> List[int]:
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1, h2 = struct.unpack("<QQ", digest)
+        return [(h1 + i * h2) % self.n_bits for i in range(self.n_hashes)]
+
+    def add(self, key: str) -> None:
+        """Add a key to the filter."""
+        for idx in self._indexes(key):
+            self.bits[idx >> 3] |= 1 << (idx & 7)
+        self.n_items += 1
+
+    def __contains__(self, key: str) -> bool:
+        return all(self.bits[idx >> 3] & (1 << (idx & 7)) for idx in self._indexes(key))
+
+    def save(self, path: str) -> None:
+        """Atomically write the filter to the given file."""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as bloom_file:
+            bloom_file.write(HEADER.pack(self.n_bits, self.n_hashes, self.n_items))
+            bloom_file.write(self.bits)
+            bloom_file.flush()
+            os.fsync(bloom_file.fileno())
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "BloomFilter":
+        """Read a filter written by save."""
+        with open(path, "rb") as bloom_file:
+            n_bits, n_hashes, n_items = HEADER.unpack(bloom_file.read(HEADER.size))
+            return cls(n_bits, n_hashes, n_items, bytearray(bloom_file.read()))
+
+
+class PidFilter:
+    """
+    Drops raw submissions/comments whose pids are already stored.
+
+    Pids the bloom filter has never seen are new without touching mongo. The
+    pids it may have seen are confirmed with one $in query per batch, so a
+    false positive costs a lookup but never drops a new post. Counters track
+    how much conversion work the filter saves.
+    """
+
+    def __init__(self, bloom: BloomFilter):
+        self.bloom = bloom
+        self.lock = threading.Lock()
+        self.n_checked = 0
+        self.n_skipped = 0
+        self.n_false_positives = 0
+
+    @classmethod
+    def from_mongo(cls, error_rate: float = BLOOM_ERROR_RATE) -> "PidFilter":
+        """Build a filter holding every pid in the Post collection."""
+        collection = Post._get_collection()
+        capacity = max(MIN_CAPACITY, 2 * collection.estimated_document_count())
+        bloom = BloomFilter.for_capacity(capacity, error_rate)
+        for doc in collection.find({}, {"pid": 1, "_id": 0}).batch_size(10000):
+            bloom.add(doc["pid"])
+        return cls(bloom)
+
+    @classmethod
+    def load_or_build(cls, path: str) -> "PidFilter":
+        """Load a persisted filter, building it from mongo if there is none."""
+        if os.path.exists(path):
+            return cls(BloomFilter.load(path))
+        return cls.from_mongo()
+
+    def save(self, path: str) -> None:
+        """Persist the filter's pids, including any added since it was loaded."""
+        with self.lock:
+            self.bloom.save(path)
+
+    def filter_new(self, items: List[Any], get_pid: Callable[[Any], str] = lambda s: s.id
+                   ) -> List[Any]:
+        """Return only the items whose pids are not already stored."""
+        pids = [get_pid(item) for item in items]
+        with self.lock:
+            maybe_stored = [pid for pid in pids if pid in self.bloom]
+
+        stored = set()
+        if maybe_stored:
+            cursor = Post._get_collection().find({"pid": {"$in": maybe_stored}}, {"pid": 1})
+            stored = {doc["pid"] for doc in cursor}
+
+        new_items = [item for item, pid in zip(items, pids) if pid not in stored]
+        with self.lock:
+            # the new pids are about to be written, later batches can skip them
+            for pid in set(pids) - stored:
+                self.bloom.add(pid)
+            self.n_checked += len(items)
+            self.n_skipped += len(items) - len(new_items)
+            self.n_false_positives += len(set(maybe_stored) - stored)
+        return new_items
+
+    @property
+    def hit_rate(self) -> float:
+        """The fraction of checked posts that were skipped as already stored."""
+        return self.n_skipped / self.n_checked if self.n_checked else 0.0
+
+    def __str__(self) -> str:
+        return (f"{self.n_skipped} of {self.n_checked} posts already stored "
+                f"({self.hit_rate:.1%} hit rate, {self.n_false_positives} false positives)")
@@ -0,0 +1,134 @@
+"""Encode field values straight to the raw documents mongoengine would store."""
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Tuple, Type
+
+from bson import ObjectId
+from mongoengine import (BooleanField, DateTimeField, Document, FloatField, IntField,
+                         ReferenceField, StringField)
+from mongoengine.base import BaseField
+from mongoengine.errors import FieldDoesNotExist, ValidationError
+
+# field types whose values can be stored as is when they already have the right python type
+PLAIN_TYPES = {
+    StringField: str,
+    IntField: int,
+    FloatField: float,
+    BooleanField: bool,
+    DateTimeField: datetime,
+}
+
+
+def _generic_encoder(field: BaseField) -> Callable[[Any], Any]:
+    """Convert a value the way Document construction, validate and to_mongo would."""
+
+    def encode(value: Any) -> Any:
+        value = field.to_python(value)
+        field.validate(value)
+        return field.to_mongo(value)
+
+    return encode
+
+
+def _field_encoder(field: BaseField) -> Callable[[Any], Any]:
+    """Return a function converting a python value to its stored form for the given field."""
+    generic = _generic_encoder(field)
+    constrained = field.choices or field.validation or any(
+        getattr(field, attr, None) is not None
+        for attr in ("max_length", "min_length", "regex", "min_value", "max_value")
+    )
+
+    plain_type = PLAIN_TYPES.get(type(field))
+    if plain_type is not None and not constrained:
+        def encode_plain(value: Any) -> Any:
+            # bools are ints, but an IntField stores them as 0/1
+            if isinstance(value, plain_type) and \
+                    (plain_type is bool or not isinstance(value, bool)):
+                return value
+            return generic(value)
+        return encode_plain
+
+    if type(field) is ReferenceField and not field.dbref and not constrained:
+        def encode_reference(value: Any) -> Any:
+            if isinstance(value, ObjectId):
+                return value
+            if isinstance(value, field.document_type):
+                if value.pk is None:
+                    raise ValidationError(
+                        "You can only reference documents once they have been saved to the "
+                        "database", field_name=field.name)
+                return value.pk
+            return generic(value)
+        return encode_reference
+
+    return generic
+
+
+class DocumentEncoder:
+    """
+    Builds raw documents for a Document class without constructing Documents.
+
+    Values are keyed by field name and stored under their db field names with
+    the class's _cls inheritance marker, defaults and required checks applied,
+    so an encoded document matches the one `Document.save()` would store.
+    Values that already have their field's python type are stored as is; all
+    others go through the field's own conversion and validation.
+    """
+
+    def __init__(self, document: Type[Document]):
+        self.document = document
+        self.class_name = document._class_name if document._meta.get("allow_inheritance") \
+            else None
+        self.fields: List[Tuple[str, str, Callable[[Any], Any], Any, bool]] = []
+        for name in document._fields_ordered:
+            if name in ("id", "_cls"):
+                continue
+            field = document._fields[name]
+            self.fields.append(
+                (name, field.db_field, _field_encoder(field), field.default, field.required)
+            )
+        self.id_encoder = _field_encoder(document._fields["id"])
+        self.field_names = {name for name, *_ in self.fields} | {"id"}
+
+    def encode(self, values: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Return the raw document for the given field values.
+
+        :raises FieldDoesNotExist: if a value is given for an undefined field
+        :raises ValidationError: if a required field is missing or a value is invalid
+        """
+        unknown = values.keys() - self.field_names
+        if unknown:
+            raise FieldDoesNotExist(
+                f"The fields {sorted(unknown)} do not exist on the document "
+                f"{self.document.__name__}")
+
+        doc: Dict[str, Any] = {}
+        if self.class_name is not None:
+            doc["_cls"] = self.class_name
+        for name, db_field, encode, default, required in self.fields:
+            value = values.get(name)
+            if value is None and default is not None:
+                value = default() if callable(default) else default
+            if value is None:
+                if required:
+                    raise ValidationError(f"Field is required: {name}", field_name=name)
+                continue
+            doc[db_field] = encode(value)
+        if values.get("id") is not None:
+            doc["_id"] = self.id_encoder(values["id"])
+        return doc
+
+
+_ENCODERS: Dict[Type[Document], DocumentEncoder] = {}
+
+
+def encoder_for(document: Type[Document]) -> DocumentEncoder:
+    """Return the shared encoder for the given Document class."""
+    if document not in _ENCODERS:
+        _ENCODERS[document] = DocumentEncoder(document)
+    return _ENCODERS[document]
+
+
+def encode_document(document: Type[Document], values: Dict[str, Any]) -> Dict[str, Any]:
+    """Return the raw document the given Document class would store for the given values."""
+    return encoder_for(document).encode(values)
@@ -0,0 +1,10 @@
+"""Lookups of the named entities stored on posts, which need no spacy model."""
+from typing import List
+
+from src.schema import Post, User
+
+
+def get_user_ents(user: User, entity_type: str) -> List[str]:
+    """Return all stored entities of the given type in a user's posts, without parsing any."""
+    posts = Post.objects(user=user, ents__label=entity_type).only("ents").as_pymongo()
+    return [e["text"].lower() for p in posts for e in p["ents"] if e["label"] == entity_type]
@@ -0,0 +1,308 @@
+"""
+A local stand-in for the Pushshift search API, for tests and offline benchmarks.
+
+Run it with e.g. `python -m src.fake_pushshift --submissions 100000 --comments 1000000`
+and point the pipeline at it with `--api-base http://127.0.0.1:8080`.
+"""
+import argparse
+import bisect
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+import requests
+
+from src.pushshift import TokenBucket
+
+KINDS = ("submission", "comment")
+MAX_SIZE = 1000
+DEFAULT_SIZE = 100
+UNLIMITED_RATE_PER_MINUTE = 60000
+SYNTH_START = 1514764800  # 2018-01-01
+WORDS = ["dope", "bupe", "sub", "tar", "withdrawal", "clean", "price", "gram", "point", "city",
+         "days", "help", "feel", "plug", "taper", "dose", "script", "pharmacy", "kratom", "nod"]
+SEARCH_PATH = re.compile(r"^/reddit/(submission|comment)/search/?$")
+
+
+class PostIndex:
+    """Records of one kind sorted by created_utc, with an entry per author and subreddit."""
+
+    def __init__(self):
+        self.by_id: Dict[str, Dict[str, Any]] = {}
+        self.lists: Dict[Tuple[str, str], List[Dict[str, Any]]] = {}
+        self.times: Dict[Tuple[str, str], List[int]] = {}
+        self.dirty = False
+
+    def add(self, records: Iterable[Dict[str, Any]]) -> None:
+        """Add records, replacing any stored records with the same id."""
+        for record in records:
+            self.by_id[record["id"]] = record
+        self.dirty = True
+
+    def _rebuild(self) -> None:
+        lists: Dict[Tuple[str, str], List[Dict[str, Any]]] = {("all", ""): []}
+        for record in self.by_id.values():
+            lists[("all", "")].append(record)
+            for field in ("author", "subreddit"):
+                if record.get(field):
+                    lists.setdefault((field, record[field].lower()), []).append(record)
+        for records in lists.values():
+            records.sort(key=lambda r: r["created_utc"])
+        self.lists = lists
+        self.times = {key: [r["created_utc"] for r in records] for key, records in lists.items()}
+        self.dirty = False
+
+    def search(self, params: Dict[str, str]) -> List[Dict[str, Any]]:
+        """Return the records matching pushshift style search params."""
+        if "ids" in params:
+            return [self.by_id[i] for i in params["ids"].split(",") if i in self.by_id]
+        if self.dirty:
+            self._rebuild()
+
+        filters = {f: params[f].lower() for f in ("author", "subreddit") if params.get(f)}
+        key = next(iter(filters.items()), ("all", ""))
+        records, times = self.lists.get(key, []), self.times.get(key, [])
+        lo = bisect.bisect_right(times, int(params["after"])) if "after" in params else 0
+        hi = bisect.bisect_left(times, int(params["before"])) if "before" in params \
+            else len(times)
+        size = min(MAX_SIZE, int(params.get("size", params.get("limit", DEFAULT_SIZE))))
+
+        order = range(lo, hi) if params.get("sort") == "asc" else range(hi - 1, lo - 1, -1)
+        results = []
+        for idx in order:
+            record = records[idx]
+            if all((record.get(f) or "").lower() == v for f, v in filters.items()):
+                results.append(record)
+                if len(results) >= size:
+                    break
+        return results
+
+
+class FakePushshift:
+    """An in-memory store of submissions and comments answering pushshift searches."""
+
+    def __init__(self, records: Optional[Dict[str, List[Dict[str, Any]]]] = None):
+        self.indexes = {kind: PostIndex() for kind in KINDS}
+        self.lock = threading.Lock()
+        for kind, kind_records in (records or {}).items():
+            self.add(kind, kind_records)
+
+    def add(self, kind: str, records: Iterable[Dict[str, Any]]) -> None:
+        """Add records of the given kind."""
+        with self.lock:
+            self.indexes[kind].add(records)
+
+    def search(self, kind: str, params: Dict[str, str]) -> List[Dict[str, Any]]:
+        """Return the records of the given kind matching the search params."""
+        with self.lock:
+            return self.indexes[kind].search(params)
+
+    def __len__(self) -> int:
+        return sum(len(index.by_id) for index in self.indexes.values())
+
+
+class RecordingPushshift(FakePushshift):
+    """Forwards searches to a real pushshift and records every returned record as a fixture."""
+
+    def __init__(self, upstream: str, fixture_fn: str):
+        super().__init__()
+        self.upstream = upstream.rstrip("/")
+        self.fixture_fn = fixture_fn
+        self.session = requests.Session()
+
+    def search(self, kind: str, params: Dict[str, str]) -> List[Dict[str, Any]]:
+        response = self.session.get(f"{self.upstream}/reddit/{kind}/search", params=params,
+                                    timeout=60)
+        response.raise_for_status()
+        records = response.json()["data"]
+        with self.lock:
+            self.indexes[kind].add(records)
+            with open(self.fixture_fn, "a") as fixture_file:
+                for record in records:
+                    fixture_file.write(json.dumps({"kind": kind, **record}) + "\n")
+        return records
+
+
+def load_fixtures(paths: Iterable[str]) -> Dict[str, List[Dict[str, Any]]]:
+    """Read recorded JSON lines fixtures into records keyed by kind."""
+    records: Dict[str, List[Dict[str, Any]]] = {kind: [] for kind in KINDS}
+    for path in paths:
+        with open(path) as fixture_file:
+            for line in fixture_file:
+                if line.strip():
+                    record = json.loads(line)
+                    records[record.pop("kind")].append(record)
+    return records
+
+
+def synthesize(
+    n_submissions: int,
+    n_comments: int,
+    subreddits: Iterable[str] = ("opiates", "heroin"),
+    n_authors: int = 1000,
+    start: int = SYNTH_START,
+    seconds_apart: int = 30,
+    n_words: int = 50,
+    seed: int = 0,
+) -> Dict[str, List[Dict[str, Any]]]:
+    """Generate submissions and comments spread over subreddits and authors."""
+    rand = random.Random(seed)
+    subreddits = list(subreddits)
+
+    def text() -> str:
+        return " ".join(rand.choices(WORDS, k=n_words))
+
+    submissions = [
+        {"id": f"fs{i:x}", "author": f"fake_user{rand.randrange(n_authors)}",
+         "created_utc": start + i * seconds_apart, "subreddit": rand.choice(subreddits),
+         "title": text()[:100], "selftext": text(), "url": f"https://redd.it/fs{i:x}",
+         "num_comments": rand.randrange(50)}
+        for i in range(n_submissions)
+    ]
+    comments = [
+        {"id": f"fc{i:x}", "author": f"fake_user{rand.randrange(n_authors)}",
+         "created_utc": start + i * seconds_apart, "subreddit": rand.choice(subreddits),
+         "body": text(), "parent_id": f"t3_fs{rand.randrange(max(1, n_submissions)):x}"}
+        for i in range(n_comments)
+    ]
+    return {"submission": submissions, "comment": comments}
+
+
+class FakePushshiftHandler(BaseHTTPRequestHandler):
+    """Serves the search and meta endpoints from the server's store."""
+
+    server: "FakePushshiftServer"
+
+    def _send_json(self, status: int, body: Dict[str, Any]) -> None:
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self) -> None:
+        url = urlparse(self.path)
+        if url.path.rstrip("/") == "/meta":
+            rate_limit = self.server.rate_limit_per_minute or UNLIMITED_RATE_PER_MINUTE
+            self._send_json(200, {"server_ratelimit_per_minute": rate_limit})
+            return
+        match = SEARCH_PATH.match(url.path)
+        if match is None:
+            self._send_json(404, {"error": f"Unknown endpoint {url.path}"})
+            return
+
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if self.server.limiter is not None and not self.server.limiter.try_acquire():
+            self._send_json(429, {"error": "Too many requests"})
+            return
+
+        params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        try:
+            data = self.server.store.search(match.group(1), params)
+        except (ValueError, requests.RequestException) as e:
+            self._send_json(400, {"error": str(e)})
+            return
+        self.server.n_requests += 1
+        # psaw pages by the returned size when given a limit
+        self._send_json(200, {"data": data, "metadata": {"size": len(data)}})
+
+    def log_message(self, *args: Any) -> None:
+        pass
+
+
+class FakePushshiftServer(ThreadingHTTPServer):
+    """
+    A threaded HTTP server answering pushshift searches from a store.
+
+    :param store: the records to serve
+    :param latency: seconds added to every search request
+    :param rate_limit_per_minute: if given, searches beyond this rate get 429 responses
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        store: FakePushshift,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency: float = 0.0,
+        rate_limit_per_minute: Optional[int] = None,
+    ):
+        super().__init__((host, port), FakePushshiftHandler)
+        self.store = store
+        self.latency = latency
+        self.rate_limit_per_minute = rate_limit_per_minute
+        self.limiter = TokenBucket(rate_limit_per_minute / 60, capacity=1) \
+            if rate_limit_per_minute else None
+        self.n_requests = 0
+
+    @property
+    def base_url(self) -> str:
+        """The url to pass as a pushshift base url."""
+        host, port = self.server_address[:2]
+        if isinstance(host, bytes):
+            host = host.decode()
+        return f"http://{host}:{port}"
+
+    def __enter__(self) -> "FakePushshiftServer":
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.shutdown()
+        self.server_close()
+
+
+def main() -> None:
+    """Serve fixtures, synthesized records or a recording proxy from the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", help="The host to listen on.", default="127.0.0.1")
+    parser.add_argument("--port", help="The port to listen on.", type=int, default=8080)
+    parser.add_argument("--fixtures", help="JSON lines fixture files to replay.", nargs="+",
+                        default=[])
+    parser.add_argument("--submissions", help="The number of submissions to synthesize.",
+                        type=int, default=0)
+    parser.add_argument("--comments", help="The number of comments to synthesize.",
+                        type=int, default=0)
+    parser.add_argument("--subreddits", help="The subreddits of synthesized posts.", nargs="+",
+                        default=["opiates", "heroin"])
+    parser.add_argument("--authors", help="The number of synthesized authors.", type=int,
+                        default=1000)
+    parser.add_argument("--latency", help="Seconds added to every request.", type=float,
+                        default=0.0)
+    parser.add_argument("--ratelimit", help="Answer requests beyond this many per minute with "
+                        "429 responses.", type=int)
+    parser.add_argument("--record", help="Proxy requests to this pushshift url, recording its "
+                        "responses to the single --fixtures file.", type=str)
+    args = parser.parse_args()
+
+    if args.record:
+        if len(args.fixtures) != 1:
+            parser.error("--record needs exactly one --fixtures file to record to.")
+        store: FakePushshift = RecordingPushshift(args.record, args.fixtures[0])
+    else:
+        store = FakePushshift(load_fixtures(args.fixtures))
+        for kind, records in synthesize(args.submissions, args.comments, args.subreddits,
+                                        args.authors).items():
+            store.add(kind, records)
+
+    server = FakePushshiftServer(store, args.host, args.port, args.latency, args.ratelimit)
+    print(f"Serving {len(store)} records at {server.base_url} .....")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""A multi-pattern matcher flagging texts that could mention a place in the gazetteer."""
+import csv
+import os
+from collections import deque
+from typing import Dict, Iterable, Iterator, List, Set, Tuple
+
+from spacy.lang.en.stop_words import STOP_WORDS
+
+from src.utils import ROOT_DIR
+
+ALIAS_MAP = {
+    'vegas': 'las vegas',
+    'nyc': 'new york city',
+    'l.a.': 'los angeles'
+}
+GAZETTEER_FN = os.path.join(ROOT_DIR, 'resources', 'gazetteer.csv')
+SUBREDDIT_LOCATIONS_FN = os.path.join(ROOT_DIR, 'resources', 'subreddit_location_map.csv')
+GAZETTEER_NAME_COLUMNS = ('neighborhood', 'city', 'county', 'state_full', 'country')
+
+
+class AhoCorasick:
+    """
+    An Aho-Corasick automaton finding every occurrence of many patterns in one pass over a text.
+
+    :param patterns: the strings to find
+    """
+
+    def __init__(self, patterns: Iterable[str]):
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        # the lengths of the patterns ending at each state
+        self.out: List[List[int]] = [[]]
+        for pattern in patterns:
+            if pattern:
+                self._add(pattern)
+        self._link()
+
+    def _add(self, pattern: str) -> None:
+        state = 0
+        for char in pattern:
+            if char not in self.goto[state]:
+                self.goto.append({})
+                self.fail.append(0)
+                self.out.append([])
+                self.goto[state][char] = len(self.goto) - 1
+            state = self.goto[state][char]
+        if len(pattern) not in self.out[state]:
+            self.out[state].append(len(pattern))
+
+    def _link(self) -> None:
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, child in self.goto[state].items():
+                queue.append(child)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(char, 0)
+                self.out[child] = self.out[child] + self.out[self.fail[child]]
+
+    def finditer(self, text: str) -> Iterator[Tuple[int, int]]:
+        """Yield the start and end offsets of every pattern occurrence in a text."""
+        state = 0
+        for idx, char in enumerate(text):
+            while state and char not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(char, 0)
+            for length in self.out[state]:
+                yield idx + 1 - length, idx + 1
+
+
+def _is_word(text: str, start: int, end: int) -> bool:
+    return (start == 0 or not text[start - 1].isalnum()) and \
+        (end == len(text) or not text[end].isalnum())
+
+
+class GazetteerMatcher:
+    """
+    Flags texts that contain a place name as a whole word.
+
+    Names are matched case-insensitively and state codes, e.g. TX, only in
+    upper case, since their lower case forms are mostly common words.
+
+    :param names: the place names to match
+    :param codes: the state codes to match
+    """
+
+    def __init__(self, names: Iterable[str], codes: Iterable[str] = ()):
+        self.names = AhoCorasick({name.lower() for name in names})
+        self.codes = AhoCorasick({code.upper() for code in codes})
+
+    def find(self, text: str) -> Iterator[Tuple[int, int]]:
+        """Yield the offsets of every whole-word place name in a text."""
+        for automaton, searched in ((self.names, text.lower()), (self.codes, text)):
+            for start, end in automaton.finditer(searched):
+                if _is_word(searched, start, end):
+                    yield start, end
+
+    def matches(self, text: str) -> bool:
+        """Check if a text could mention a place."""
+        return next(self.find(text), None) is not None
+
+
+def place_names(
+    gazetteer_fn: str = GAZETTEER_FN, subreddit_locations_fn: str = SUBREDDIT_LOCATIONS_FN
+) -> Tuple[Set[str], Set[str]]:
+    """
+    Return the place names and state codes of the gazetteer, location subreddits and aliases.
+
+    English stop words are left out, as they would flag nearly every text.
+    """
+    names: Set[str] = set(ALIAS_MAP) | set(ALIAS_MAP.values())
+    codes: Set[str] = set()
+    with open(gazetteer_fn) as gazetteer_file:
+        for row in csv.DictReader(gazetteer_file):
+            names.update(row[column] for column in GAZETTEER_NAME_COLUMNS)
+            names.update(row['metro'].split('-'))
+            codes.add(row['state'].strip().upper())
+    with open(subreddit_locations_fn) as locations_file:
+        for row in csv.DictReader(locations_file):
+            names.update(part for part in row['location'].lower().split(','))
+
+    names = {name.strip().lower() for name in names} - STOP_WORDS - {''}
+    return names, codes - {''}
+
+
+def load_matcher(
+    gazetteer_fn: str = GAZETTEER_FN, subreddit_locations_fn: str = SUBREDDIT_LOCATIONS_FN
+) -> GazetteerMatcher:
+    """Build a matcher of the place names in the gazetteer, location subreddits and aliases."""
+    return GazetteerMatcher(*place_names(gazetteer_fn, subreddit_locations_fn))
@@ -0,0 +1,97 @@
+"""A persistent, deduplicated queue of users awaiting a history backfill."""
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, Optional
+
+from pymongo import UpdateOne
+
+from src.encoders import encode_document
+from src.leases import DONE, held_by, lease_next, release
+from src.schema import HistoryTask
+
+LEASE_SECONDS = 3600
+MAX_ATTEMPTS = 3
+
+
+class HistoryQueue:
+    """
+    Queues users for a history backfill in the HistoryTask collection.
+
+    Each username is queued at most once, enforced by the unique username
+    index. Workers lease tasks one at a time and can only complete or fail
+    the tasks they still hold; a lease that is not completed or failed
+    before it expires, e.g. because its worker died, makes the task
+    available to other workers again. Tasks that fail too often, or whose
+    lease expires on their final attempt, are parked as failed rather than
+    retried forever.
+    """
+
+    def __init__(self, lease_seconds: int = LEASE_SECONDS, max_attempts: int = MAX_ATTEMPTS):
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+
+    @property
+    def collection(self):
+        """The underlying pymongo collection."""
+        return HistoryTask._get_collection()
+
+    def enqueue(self, usernames: Iterable[Optional[str]]) -> int:
+        """
+        Queue the given users with a single unordered bulk upsert.
+
+        :returns: the number of users that were not already queued
+        """
+        names = sorted({name for name in usernames if isinstance(name, str)})
+        if not names:
+            return 0
+        now = datetime.utcnow()
+        result = self.collection.bulk_write(
+            [
+                UpdateOne(
+                    {"username": name},
+                    {"$setOnInsert": encode_document(HistoryTask,
+                                                     {"username": name, "created": now})},
+                    upsert=True,
+                )
+                for name in names
+            ],
+            ordered=False,
+        )
+        return result.upserted_count
+
+    def lease(self, worker: str) -> Optional[str]:
+        """Atomically lease the oldest available task, returning its username if there is one."""
+        task = lease_next(self.collection, [("created", 1)], self.lease_seconds, self.max_attempts,
+                          {"worker": worker})
+        return None if task is None else task["username"]
+
+    def leases(self, worker: str, limit: Optional[int] = None) -> Iterator[str]:
+        """Lazily lease tasks until none are available or the limit is reached."""
+        n_leased = 0
+        while limit is None or n_leased < limit:
+            username = self.lease(worker)
+            if username is None:
+                return
+            n_leased += 1
+            yield username
+
+    def complete(self, username: str, worker: str) -> bool:
+        """Mark a user's history as fetched, returning False if the lease was lost."""
+        result = self.collection.update_one(
+            {"username": username, **held_by(worker)},
+            {"$set": {"status": DONE}, "$unset": {"lease_expires": "", "error": ""}},
+        )
+        return result.matched_count == 1
+
+    def fail(self, username: str, worker: str, error: str) -> None:
+        """Release a failed task for a retry, or park it once it is out of attempts."""
+        release(self.collection, {"username": username, **held_by(worker)}, self.max_attempts,
+                error)
+
+    def counts(self) -> Dict[str, int]:
+        """Return the number of tasks in each status."""
+        return {
+            doc["_id"]: doc["count"]
+            for doc in self.collection.aggregate(
+                [{"$group": {"_id": "$status", "count": {"$sum": 1}}}]
+            )
+        }
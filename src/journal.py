@@ -0,0 +1,74 @@
+"""An append-only, fsync'd journal for resuming long running jobs."""
+import json
+import os
+from typing import Any, Dict, Iterator, Optional
+
+
+class Journal:
+    """
+    Records completed work items as JSON lines in an append-only file.
+
+    Each record is appended with a single write and fsync'd before `add`
+    returns, so a crash loses at most the record being written. A torn final
+    line is ignored when the journal is reopened. All records are kept in
+    memory keyed by their key, with the latest record for a key winning.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.records: Dict[str, Dict[str, Any]] = {}
+        is_new = not os.path.exists(path)
+
+        if not is_new:
+            with open(path, "rb") as journal_file:
+                contents = journal_file.read()
+            for line in contents.splitlines():
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                self.records[record.pop("key")] = record
+
+        self.fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        if is_new:
+            # make the new file's directory entry durable too
+            dir_fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+        elif contents and not contents.endswith(b"\n"):
+            # terminate a torn final record so the next one starts on a fresh line
+            os.write(self.fd, b"\n")
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.records
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.records)
+
+    def __enter__(self) -> "Journal":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return the latest record for the given key, if any."""
+        return self.records.get(key)
+
+    def add(self, key: str, **data: Any) -> None:
+        """Durably append a record for the given key."""
+        line = json.dumps({"key": key, **data}, default=str) + "\n"
+        os.write(self.fd, line.encode())
+        os.fsync(self.fd)
+        self.records[key] = data
+
+    def close(self) -> None:
+        """Close the underlying file."""
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
@@ -0,0 +1,82 @@
+"""Leases on tasks held by one worker at a time, shared by the history queue and spacy shards."""
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from pymongo import ReturnDocument
+from pymongo.collection import Collection
+
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+EXPIRED_ERROR = "lease expired on the final attempt"
+
+
+def park_expired(collection: Collection, max_attempts: int) -> int:
+    """
+    Mark the tasks whose lease expired on their final attempt as failed.
+
+    Such a task can no longer be leased, so without this it would stay
+    leased forever, e.g. after its worker died.
+
+    :returns: the number of tasks marked as failed
+    """
+    result = collection.update_many(
+        {"status": LEASED, "lease_expires": {"$lte": datetime.utcnow()},
+         "attempts": {"$gte": max_attempts}},
+        {"$set": {"status": FAILED, "error": EXPIRED_ERROR}, "$unset": {"lease_expires": ""}},
+    )
+    return result.modified_count
+
+
+def held_by(worker: str) -> Dict[str, Any]:
+    """Return a query matching tasks only while a worker still holds their lease."""
+    return {"worker": worker, "status": LEASED, "lease_expires": {"$gt": datetime.utcnow()}}
+
+
+def lease_next(
+    collection: Collection,
+    sort: List[Tuple[str, int]],
+    lease_seconds: int,
+    max_attempts: int,
+    values: Optional[Dict[str, Any]] = None,
+) -> Optional[Dict[str, Any]]:
+    """
+    Atomically lease the first available task in a sort order, returning it if there is one.
+
+    A task is available if it is pending, or its lease expired and it has
+    attempts left. Expired tasks without any are marked as failed first.
+
+    :param values: other fields to set on the leased task
+    """
+    park_expired(collection, max_attempts)
+    now = datetime.utcnow()
+    return collection.find_one_and_update(
+        {
+            "$or": [
+                {"status": PENDING},
+                {"status": LEASED, "lease_expires": {"$lte": now}},
+            ],
+            "attempts": {"$lt": max_attempts},
+        },
+        {
+            "$set": {"status": LEASED, "lease_expires": now + timedelta(seconds=lease_seconds),
+                     **(values or {})},
+            "$inc": {"attempts": 1},
+        },
+        sort=sort,
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+def release(
+    collection: Collection, query: Dict[str, Any], max_attempts: int, error: str
+) -> None:
+    """Release a failed task for a retry, or park it once it is out of attempts."""
+    task = collection.find_one(query, {"attempts": 1})
+    if task is None:
+        return
+    status = FAILED if task.get("attempts", 0) >= max_attempts else PENDING
+    collection.update_one(
+        query, {"$set": {"status": status, "error": error}, "$unset": {"lease_expires": ""}}
+    )
@@ -23,8 +23,9 @@ from sklearn.cluster import DBSCAN
 from sklearn.metrics.pairwise import cosine_similarity
 from spacy.lang.en import English
 
-from src.models.__init__ import (DENYLIST, forward_geocode, get_ents,
-                                 get_user_spacy, reverse_geocode)
+from src.entities import get_user_ents
+from src.gazetteer import ALIAS_MAP
+from src.models.__init__ import DENYLIST, forward_geocode, reverse_geocode
 from src.models.filters import BaseFilter, DenylistFilter, LocationFilter
 from src.schema import Location, User, Post
 from src.utils import ROOT_DIR, connect_to_mongo, get_nlp
@@ -40,12 +41,6 @@ LARGE_STATE_MAP = {
     'alaska': ['alaska', 'juneau, alaska', 'anchorage, alaska', 'fairbanks, alaska']
 }
 
-ALIAS_MAP = {
-    'vegas': 'las vegas',
-    'nyc': 'new york city',
-    'l.a.': 'los angeles'
-}
-
 
 def find_center(points: np.array) -> np.array:
     '''Find the point that is closest to the center of the points.'''
@@ -268,9 +263,8 @@ class LocationClusterer:
         if self.use_caches and user.username in self.user_ents_cache:
             return self.user_ents_cache[user.username]
 
-        # extract entities from spacy
-        user_spacy_docs = get_user_spacy(user, self.nlp)
-        user_entities = get_ents(user_spacy_docs, 'GPE')
+        # extract entities stored by the spacy stage
+        user_entities = get_user_ents(user, 'GPE')
         filtered_user_entities = filter_entities(user_entities, self.filters)
 
         # add subreddit as entity if represents a location subreddit
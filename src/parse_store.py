@@ -0,0 +1,216 @@
+"""Stores for spacy parses kept out of their post documents, which hold a reference instead."""
+import json
+import os
+import re
+import threading
+from abc import ABC, abstractmethod
+from typing import BinaryIO, Dict, Iterable, Optional, TextIO, Tuple, Type
+
+from bson import ObjectId
+
+from src.encoders import encode_document
+from src.schema import SpacyBlob
+from src.shard_leases import worker_name
+from src.utils import ROOT_DIR
+
+PART_BYTES = 8 * 1024 * 1024
+SHARD_BYTES = 1024 * 1024 * 1024
+PARSE_DIR = os.getenv("PARSE_DIR", os.path.join(ROOT_DIR, "cache", "parses"))
+
+
+def _fsync_dir(path: str) -> None:
+    # make a new file's directory entry durable too
+    dir_fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+
+class ParseStore(ABC):
+    """
+    A store of serialized parses keyed by post.
+
+    Putting a parse returns a short reference, beginning with the store's
+    prefix, that is stored on the post in place of the parse. Any reader can
+    follow a reference back to its parse with load_parse.
+    """
+
+    prefix: bytes
+
+    @abstractmethod
+    def put(self, key: str, data: bytes) -> bytes:
+        """Store a parse under a key, returning the reference to it."""
+
+    @abstractmethod
+    def get(self, ref: bytes) -> bytes:
+        """Return the parse a reference points to."""
+
+    def flush(self) -> None:
+        """Durably store every parse put so far, making it readable by other processes."""
+
+    def close(self) -> None:
+        """Release any open files."""
+
+
+class MongoParseStore(ParseStore):
+    """
+    Stores parses in the SpacyBlob collection, split into parts within the document limit.
+
+    Each put stores a new version of a post's parse under a fresh key, so
+    readers of the reference on the post never see a partly replaced parse.
+    Once the new reference is on the post, prune deletes the older versions.
+    """
+
+    prefix = b"SpacyBlob:"
+    part_bytes = PART_BYTES
+
+    def put(self, key: str, data: bytes) -> bytes:
+        version = f"{key}@{ObjectId()}"
+        SpacyBlob._get_collection().insert_many([
+            encode_document(SpacyBlob, {"key": version, "post": key, "part": part,
+                                        "data": data[offset:offset + self.part_bytes]})
+            for part, offset in enumerate(range(0, max(len(data), 1), self.part_bytes))
+        ])
+        return self.prefix + version.encode()
+
+    def get(self, ref: bytes) -> bytes:
+        key = bytes(ref[len(self.prefix):]).decode()
+        parts = SpacyBlob._get_collection().find({"key": key}).sort("part", 1)
+        return b"".join(bytes(part["data"]) for part in parts)
+
+    def delete(self, ref: bytes) -> None:
+        """Delete the parse a reference points to."""
+        SpacyBlob._get_collection().delete_many({"key": bytes(ref[len(self.prefix):]).decode()})
+
+    def prune(self, keys: Iterable[str], keep: Iterable[bytes] = ()) -> int:
+        """
+        Delete every version of the given posts' parses but those referenced by keep.
+
+        :returns: the number of parts deleted
+        """
+        keys = list(keys)
+        if not keys:
+            return 0
+        kept = [bytes(ref[len(self.prefix):]).decode()
+                for ref in keep if bytes(ref[:len(self.prefix)]) == self.prefix]
+        # parts put before parses were versioned are keyed by their post alone
+        result = SpacyBlob._get_collection().delete_many({
+            "$or": [{"post": {"$in": keys}}, {"key": {"$in": keys}}],
+            "key": {"$nin": kept},
+        })
+        return result.deleted_count
+
+
+class DiskParseStore(ParseStore):
+    """
+    Appends parses to shard files on disk, which only ever grow.
+
+    Each writer appends to its own shards, named after it, so processes on
+    any number of nodes can share a directory without locking. References
+    hold the shard, offset and length of their parse, so a read is one seek.
+    Every shard has an index of the key, offset and length of its parses as
+    JSON lines, to find parses by key without the posts.
+
+    :param root: the directory of the shards, PARSE_DIR if not given
+    :param shard_bytes: the size after which a writer starts a new shard
+    :param writer: the name of this writer's shards, this host and process if not given
+    """
+
+    prefix = b"ParseShard:"
+
+    def __init__(
+        self,
+        root: Optional[str] = None,
+        shard_bytes: int = SHARD_BYTES,
+        writer: Optional[str] = None,
+    ):
+        self.root = root or PARSE_DIR
+        self.shard_bytes = shard_bytes
+        self.writer = re.sub(r"[^\w.-]", "-", writer or worker_name())
+        self.shard: Optional[Tuple[str, BinaryIO, TextIO]] = None
+        self.n_shards = 0
+        self.readers: Dict[str, BinaryIO] = {}
+        self.lock = threading.Lock()
+
+    def _open_shard(self) -> Tuple[str, BinaryIO, TextIO]:
+        os.makedirs(self.root, exist_ok=True)
+        while True:
+            name = f"{self.writer}-{self.n_shards:05d}.bin"
+            path = os.path.join(self.root, name)
+            if not os.path.exists(path):
+                shard = name, open(path, "ab"), open(path[:-len(".bin")] + ".idx", "a")
+                _fsync_dir(self.root)
+                return shard
+            if os.path.getsize(path) < self.shard_bytes:
+                return name, open(path, "ab"), open(path[:-len(".bin")] + ".idx", "a")
+            self.n_shards += 1
+
+    def put(self, key: str, data: bytes) -> bytes:
+        with self.lock:
+            if self.shard is None:
+                self.shard = self._open_shard()
+            name, shard_file, index_file = self.shard
+            offset = shard_file.tell()
+            shard_file.write(data)
+            index_file.write(json.dumps({"key": key, "offset": offset, "length": len(data)}) + "\n")
+            if shard_file.tell() >= self.shard_bytes:
+                self._close_shard()
+                self.n_shards += 1
+        return self.prefix + f"{name}:{offset}:{len(data)}".encode()
+
+    def get(self, ref: bytes) -> bytes:
+        name, offset, length = bytes(ref[len(self.prefix):]).decode().rsplit(":", 2)
+        with self.lock:
+            if self.shard is not None and self.shard[0] == name:
+                self.shard[1].flush()
+            if name not in self.readers:
+                self.readers[name] = open(os.path.join(self.root, name), "rb")
+            reader = self.readers[name]
+            reader.seek(int(offset))
+            return reader.read(int(length))
+
+    def _sync_shard(self) -> None:
+        if self.shard is not None:
+            # references to these parses are written next, so they must survive a crash
+            for shard_file in self.shard[1:]:
+                shard_file.flush()
+                os.fsync(shard_file.fileno())
+
+    def _close_shard(self) -> None:
+        if self.shard is not None:
+            self._sync_shard()
+            self.shard[1].close()
+            self.shard[2].close()
+            self.shard = None
+
+    def flush(self) -> None:
+        with self.lock:
+            self._sync_shard()
+
+    def close(self) -> None:
+        with self.lock:
+            self._close_shard()
+            for reader in self.readers.values():
+                reader.close()
+            self.readers = {}
+
+
+PARSE_STORES: Dict[str, Type[ParseStore]] = {"mongo": MongoParseStore, "disk": DiskParseStore}
+# stores for following references, opened on first use
+_readers: Dict[Type[ParseStore], ParseStore] = {}
+
+
+def is_reference(data: bytes) -> bool:
+    """Check if stored spacy bytes are a reference to a parse in a store."""
+    return any(bytes(data[:len(store.prefix)]) == store.prefix for store in PARSE_STORES.values())
+
+
+def load_parse(data: bytes) -> bytes:
+    """Return the parse stored spacy bytes stand for, following a reference to any store."""
+    for store in PARSE_STORES.values():
+        if bytes(data[:len(store.prefix)]) == store.prefix:
+            if store not in _readers:
+                _readers[store] = store()
+            return _readers[store].get(data)
+    return bytes(data)
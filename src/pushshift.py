@@ -0,0 +1,156 @@
+"""A small thread-safe Pushshift client with a shared rate limit."""
+import os
+import threading
+import time
+from types import SimpleNamespace
+from typing import Any, Dict, Iterator, List, Optional, Set
+
+import requests
+
+PUSHSHIFT_URL = os.getenv("PUSHSHIFT_URL", "https://api.pushshift.io")
+RATE_LIMIT_PER_MINUTE = 120
+PAGE_SIZE = 100
+MAX_RETRIES = 5
+
+# attributes read by post_fields, defaulted when pushshift omits them
+OBJ_DEFAULTS = {
+    "author": None,
+    "subreddit": None,
+    "url": None,
+    "selftext": None,
+    "title": None,
+    "num_comments": None,
+    "body": None,
+    "parent_id": None,
+}
+
+
+class TokenBucket:
+    """A token bucket rate limiter that can be shared between threads."""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        """
+        :param rate: the number of tokens added per second
+        :param capacity: the max number of tokens that can be saved up
+        """
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, tokens: float = 1.0) -> None:
+        """Block until the given number of tokens is available, then take them."""
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = (tokens - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def try_acquire(self, tokens: float = 1.0) -> bool:
+        """Take the given number of tokens if they are available, without blocking."""
+        with self.lock:
+            self._refill()
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return True
+            return False
+
+
+class PushshiftClient:
+    """
+    Queries the Pushshift search endpoints directly.
+
+    Every request, including each page of a paginated search, takes a token
+    from the shared limiter, so any number of threads can use one client.
+    """
+
+    def __init__(
+        self,
+        base_url: str = PUSHSHIFT_URL,
+        limiter: Optional[TokenBucket] = None,
+        page_size: int = PAGE_SIZE,
+        max_retries: int = MAX_RETRIES,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.limiter = limiter or TokenBucket(RATE_LIMIT_PER_MINUTE / 60)
+        self.page_size = page_size
+        self.max_retries = max_retries
+        self.local = threading.local()
+
+    @property
+    def session(self) -> requests.Session:
+        """A requests session for the calling thread."""
+        if not hasattr(self.local, "session"):
+            self.local.session = requests.Session()
+        return self.local.session
+
+    def get(self, kind: str, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Make a single rate limited search request, retrying when throttled."""
+        url = f"{self.base_url}/reddit/{kind}/search"
+        for attempt in range(self.max_retries + 1):
+            self.limiter.acquire()
+            response = self.session.get(url, params=params, timeout=60)
+            if response.status_code == 429 and attempt < self.max_retries:
+                time.sleep(2 ** attempt)
+                continue
+            response.raise_for_status()
+            return response.json()["data"]
+        raise RuntimeError(f"Pushshift request to {url} kept being rate limited.")
+
+    def search(self, kind: str, limit: Optional[int] = None, **params: Any) -> Iterator[Any]:
+        """
+        Yield all objects of the given kind matching the given search params.
+
+        Results are paged newest first by moving 'before' to just after the
+        oldest time on each page, as pushshift bounds are exclusive. Posts
+        made in that second that did not fit on the page are then on the next,
+        and those already yielded are skipped by id.
+        """
+        params = {k: v for k, v in params.items() if v is not None}
+        n_yielded = 0
+        # the ids yielded from the second the next page starts at
+        boundary: Set[str] = set()
+        while limit is None or n_yielded < limit:
+            size = self.page_size if limit is None else min(self.page_size, limit - n_yielded)
+            page = self.get(kind, {**params, "size": size, "sort": "desc",
+                                   "sort_type": "created_utc"})
+            new = [item for item in page if item.get("id") not in boundary]
+            for item in new:
+                yield SimpleNamespace(**{**OBJ_DEFAULTS, **item})
+            n_yielded += len(new)
+            if len(page) < size:
+                return
+
+            oldest = min(item["created_utc"] for item in page)
+            if not new:
+                # more posts were made in one second than fit on a page, skip past it
+                params["before"] = oldest
+                boundary = set()
+                continue
+            if params.get("before") != oldest + 1:
+                boundary = set()
+            boundary.update(item["id"] for item in page
+                            if item["created_utc"] == oldest and item.get("id"))
+            params["before"] = oldest + 1
+
+    def search_ids(self, kind: str, ids: List[str]) -> List[Any]:
+        """Return the objects of the given kind with the given ids in a single request."""
+        page = self.get(kind, {"ids": ",".join(ids)})
+        return [SimpleNamespace(**{**OBJ_DEFAULTS, **item}) for item in page]
+
+    def search_submissions(self, **params: Any) -> Iterator[Any]:
+        """Yield all submissions matching the given search params."""
+        return self.search("submission", **params)
+
+    def search_comments(self, **params: Any) -> Iterator[Any]:
+        """Yield all comments matching the given search params."""
+        return self.search("comment", **params)
@@ -2,7 +2,7 @@
 import itertools as it
 from typing import List, Any
 
-from mongoengine import (BinaryField, DateTimeField, Document,
+from mongoengine import (BinaryField, BooleanField, DateTimeField, Document,
                          EmbeddedDocument, EmbeddedDocumentField,
                          EmbeddedDocumentListField, IntField, ReferenceField,
                          StringField, FloatField)
@@ -77,6 +77,15 @@ class Location(EmbeddedDocument):
         return possible_locations
 
 
+class Entity(EmbeddedDocument):
+    """A named entity span in a post's parsed text."""
+
+    text = StringField(required=True)
+    label = StringField(required=True)
+    start = IntField()
+    end = IntField()
+
+
 class DateRangeLocation(EmbeddedDocument):
     """A location that can exist over a datetime range."""
 
@@ -90,6 +99,8 @@ class User(Document):
 
     username = StringField(required=True)
     locations = EmbeddedDocumentListField(DateRangeLocation)
+    # the newest post datetime of the user's fetched posting history
+    history_datetime = DateTimeField()
     meta = {"indexes": [{"fields": ["username"], "unique": True}]}
 
     def __str__(self) -> str:
@@ -104,12 +115,19 @@ class Post(Document):
     datetime = DateTimeField()
     subreddit = StringField()
     spacy = BinaryField()
+    # the model and text hash a parse was made with, to find parses that are out of date
+    spacy_model = StringField()
+    spacy_hash = StringField()
+    # absent until the post is parsed, so posts without entities can be told from unparsed ones
+    ents = EmbeddedDocumentListField(Entity, default=None)
+    # set on unparsed posts the gazetteer found no place name in, so their NER was skipped
+    gazetteer_skipped = BooleanField()
     meta = {
         "allow_inheritance": True,
         "indexes": ["user", "$text", "-datetime", {
             "fields": ["pid"],
             "unique": True
-        }],
+        }, ("user", "ents.label")],
     }
 
 
@@ -118,9 +136,84 @@ class SubmissionPost(Post):
     url = StringField()
     title = StringField()
     num_comments = IntField()
+    # comments have no title, so only submissions are indexed, including those missing one
+    meta = {
+        "indexes": [{
+            "fields": ["title"],
+            "partialFilterExpression": {"_cls": "Post.SubmissionPost"},
+        }]
+    }
 
 
 class CommentPost(Post):
     """A Reddit Comment."""
     parent_id = StringField()
     meta = {'indexes': ['parent_id']}
+
+
+class Subreddit(Document):
+    """A subreddit tracked by the incremental updater."""
+    name = StringField(required=True)
+    last_datetime = DateTimeField()
+    active = BooleanField(default=True)
+    meta = {"indexes": [{"fields": ["name"], "unique": True}]}
+
+    def __str__(self) -> str:
+        return self.name
+
+
+class HistoryTask(Document):
+    """A user waiting to have their full posting history fetched."""
+    username = StringField(required=True)
+    status = StringField(required=True, default="pending")
+    attempts = IntField(default=0)
+    lease_expires = DateTimeField()
+    worker = StringField()
+    created = DateTimeField()
+    error = StringField()
+    meta = {
+        "indexes": [
+            {"fields": ["username"], "unique": True},
+            ("status", "lease_expires"),
+        ]
+    }
+
+    def __str__(self) -> str:
+        return f"{self.username} ({self.status})"
+
+
+class SpacyShard(Document):
+    """A pid range of posts leased by one spacy worker at a time."""
+    shard = IntField(required=True)
+    lo = StringField()
+    hi = StringField()
+    status = StringField(required=True, default="pending")
+    worker = StringField()
+    attempts = IntField(default=0)
+    lease_expires = DateTimeField()
+    parsed = IntField(default=0)
+    seconds = FloatField(default=0.0)
+    created = DateTimeField()
+    error = StringField()
+    meta = {
+        "indexes": [
+            {"fields": ["shard"], "unique": True},
+            ("status", "lease_expires"),
+        ]
+    }
+
+    def __str__(self) -> str:
+        return f"{self.shard} [{self.lo}, {self.hi}) ({self.status})"
+
+
+class SpacyBlob(Document):
+    """A part of a spacy parse too large to be stored on its post."""
+    # the key of this version of the parse, and of the post every version belongs to
+    key = StringField(required=True)
+    post = StringField()
+    part = IntField(required=True)
+    data = BinaryField()
+    meta = {"indexes": [{"fields": ["key", "part"], "unique": True}, ("post",)]}
+
+    def __str__(self) -> str:
+        return f"{self.key} ({self.part})"
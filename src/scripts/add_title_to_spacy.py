@@ -1,19 +1,13 @@
-import tqdm
 from spacy.lang.en import English
 import spacy
 
 from src.utils import connect_to_mongo
-from src.schema import Post, SubmissionPost
+from src.tasks.spacy import SpacyReport, add_spacy_to_mongo
 
 
-def add_title_to_spacy(nlp: English):
-    post_subsets = SubmissionPost.objects.only('pid')
-    for post_subset in tqdm.tqdm(post_subsets):
-        post = SubmissionPost.objects(pid=post_subset.pid).first()
-        text = '. '.join([post.title, post.text])
-        if type(text) == str:
-            post.spacy = nlp(text).to_bytes()
-            post.save()
+def add_title_to_spacy(nlp: English) -> SpacyReport:
+    """Re-parse every submission with its title, along with any unparsed posts."""
+    return add_spacy_to_mongo(nlp, titles=True)
 
 
 if __name__ == '__main__':
@@ -1,96 +1,207 @@
+import multiprocessing
+import os
+from concurrent.futures import Future, ProcessPoolExecutor
 from datetime import datetime
-from typing import Any, Dict, Optional
-
-from tqdm import tqdm
-import numpy as np
-
-from src.schema import CommentPost, Post, SubmissionPost, User
-from src.utils import connect_to_mongo, get_mongo
-
-
-def praw_to_post() -> None:
-    """Convert existing documents in praw to Post/User objects."""
-    collection = get_mongo()["drug_pricing"]["praw"]
-    print("Getting all documents from praw collection .....")
-    pid_query = list(collection.aggregate(
-        [
-            {
-                "$group": {"_id": "$pid"}
-            }
-        ],
-        allowDiskUse=True
-    ))
-    pids = [item["_id"] for item in pid_query]
-
-    connect_to_mongo()
-
-    def maybe_attr(attr: str, pair: Dict[str, Any], dtype) -> Optional[Any]:
-        if attr in pair:
-            item = pair[attr]
-            if isinstance(item, dtype):
-                return item
-        return None
-
-    n_batches = 100
-    pid_batches = np.array_split(pids, n_batches)
-    pid_batches = pid_batches[33:]
-
-    for i, pid_batch in enumerate(pid_batches):
-        print(f"Batch {i} .....")
-
-        batch_praw = list(collection.find({"pid": {"$in": list(pid_batch)}}))
-
-        print("Converting praw documents to posts .....")
-        for praw in tqdm(batch_praw):
-            # assign a user
-            user = None
-            if "username" in praw and isinstance(praw["username"], str):
-                if User.objects(username=praw["username"]).count() == 0:
-                    user = User(username=praw["username"])
-                    user.save()
-                else:
-                    user = User.objects(username=praw["username"]).first()
-
-            # check if post exists
-            if "pid" in praw and Post.objects(pid=praw["pid"]).count() == 0:
-
-                # build general post features
-                kwargs = {
-                    "pid": praw["pid"],
-                    "text": maybe_attr("text", praw, str),
-                    "user": user,
-                    "datetime": maybe_attr("time", praw, datetime),
-                    "subreddit": maybe_attr("subr", praw, str),
-                    "spacy": maybe_attr("spacy", praw, object),
-                }
-
-                # instantiate and assign specific post features
-                if (
-                    ("is_sub" in praw and praw["is_sub"])
-                    or "url" in praw
-                    or "title" in praw
-                    or "num_comments" in praw
-                ):
-                    post = SubmissionPost
-                    if "url" in praw:
-                        url = praw["url"]
-                        if isinstance(url, str):
-                            praw["url"] = url
-                    if "title" in praw:
-                        title = praw["title"]
-                        if isinstance(title, str):
-                            praw["title"] = title
-                    kwargs["num_comments"] = maybe_attr("num_comments", praw, int)
-                elif "parent_id" in praw:
-                    post = CommentPost
-                    kwargs["parent_id"] = maybe_attr("parent_id", praw, str)
-                else:
-                    post = Post
-                kwargs = {k: v for k, v in kwargs.items() if v is not None}
-                post(**kwargs).save()
-
-    print("Done.")
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Type
+
+from bson import ObjectId
+from mongoengine.errors import ValidationError
+from pymongo.collection import Collection
+
+from src.encoders import encode_document
+from src.journal import Journal
+from src.schema import CommentPost, Post, SubmissionPost
+from src.utils import (ROOT_DIR, BatchReport, UserResolver, bounded_map, bulk_upsert_docs,
+                       chunked, connect_to_mongo, get_mongo)
+
+LEGACY_DB = "drug_pricing"
+LEGACY_COLLECTION = "praw"
+BATCH_SIZE = 5000
+N_WORKERS = 4
+CHECKPOINT_FN = os.path.join(ROOT_DIR, "cache", "backfill-drms.jsonl")
+
+# the legacy collection of the current process, opened lazily by each worker
+_legacy = None
+
+
+def legacy_collection() -> Collection:
+    """Return this process's connection to the legacy praw collection."""
+    global _legacy
+    if _legacy is None:
+        _legacy = get_mongo()[LEGACY_DB][LEGACY_COLLECTION]
+    return _legacy
+
+
+def maybe_attr(attr: str, pair: Dict[str, Any], dtype) -> Optional[Any]:
+    """Return the attribute if it is present with the given type."""
+    if attr in pair:
+        item = pair[attr]
+        if isinstance(item, dtype):
+            return item
+    return None
+
+
+def legacy_to_fields(praw: Dict[str, Any]) -> Tuple[Type[Post], Dict[str, Any]]:
+    """Return the Post type and field values for a legacy praw document."""
+    # build general post features
+    kwargs = {
+        "pid": praw["pid"],
+        "text": maybe_attr("text", praw, str),
+        "datetime": maybe_attr("time", praw, datetime),
+        "subreddit": maybe_attr("subr", praw, str),
+        "spacy": maybe_attr("spacy", praw, object),
+    }
+
+    # instantiate and assign specific post features
+    if (
+        ("is_sub" in praw and praw["is_sub"])
+        or "url" in praw
+        or "title" in praw
+        or "num_comments" in praw
+    ):
+        post = SubmissionPost
+        kwargs["url"] = maybe_attr("url", praw, str)
+        kwargs["title"] = maybe_attr("title", praw, str)
+        kwargs["num_comments"] = maybe_attr("num_comments", praw, int)
+    elif "parent_id" in praw:
+        post = CommentPost
+        kwargs["parent_id"] = maybe_attr("parent_id", praw, str)
+    else:
+        post = Post
+    return post, {k: v for k, v in kwargs.items() if v is not None}
+
+
+def migrate_batch(
+    first_id: ObjectId, last_id: ObjectId, collection: Optional[Collection] = None
+) -> BatchReport:
+    """
+    Migrate all legacy documents in the given inclusive _id range.
+
+    Pids that are already stored are found with one $in query and skipped,
+    users are resolved in bulk and new posts are written in one bulk upsert.
+    """
+    collection = collection if collection is not None else legacy_collection()
+    batch = list(collection.find({"_id": {"$gte": first_id, "$lte": last_id}}))
+
+    # the legacy collection holds repeated pids, the first of which is migrated
+    by_pid: Dict[str, Dict[str, Any]] = {}
+    for praw in batch:
+        if isinstance(praw.get("pid"), str):
+            by_pid.setdefault(praw["pid"], praw)
+
+    stored = {
+        doc["pid"]
+        for doc in Post._get_collection().find({"pid": {"$in": list(by_pid)}}, {"pid": 1})
+    }
+    new = [praw for pid, praw in by_pid.items() if pid not in stored]
+    users = UserResolver().resolve(maybe_attr("username", praw, str) for praw in new)
+
+    docs = []
+    n_invalid = sum(1 for praw in batch if not isinstance(praw.get("pid"), str))
+    n_repeated = len(batch) - n_invalid - len(by_pid)
+    for praw in new:
+        post, kwargs = legacy_to_fields(praw)
+        username = maybe_attr("username", praw, str)
+        kwargs["user"] = users.get(username) if username is not None else None
+        try:
+            docs.append(encode_document(post, kwargs))
+        except ValidationError as e:
+            print(f"Error migrating post {praw['pid']}: {e}")
+            n_invalid += 1
+
+    report = bulk_upsert_docs(docs)
+    report.duplicates += n_repeated + len(stored)
+    report.invalid += n_invalid
+    return report
+
+
+def id_ranges(
+    collection: Collection, after: Optional[ObjectId], batch_size: int
+) -> Iterator[Tuple[ObjectId, ObjectId]]:
+    """Lazily split the legacy _ids after the given one into inclusive ranges of a batch size."""
+    query = {"_id": {"$gt": after}} if after is not None else {}
+    cursor = collection.find(query, {"_id": 1}).sort("_id", 1).batch_size(batch_size)
+    for ids in chunked((doc["_id"] for doc in cursor), batch_size):
+        yield ids[0], ids[-1]
+
+
+def praw_to_post(
+    n_workers: int = N_WORKERS,
+    batch_size: int = BATCH_SIZE,
+    checkpoint_fn: str = CHECKPOINT_FN,
+    collection: Optional[Collection] = None,
+) -> BatchReport:
+    """
+    Convert existing documents in praw to Post/User objects.
+
+    The legacy collection's _ids are streamed in order and split into ranges
+    that are migrated across a process pool. The checkpoint records the last
+    _id before which every range has been migrated, so an interrupted run
+    resumes from there; ranges migrated past it are skipped as stored pids.
+
+    :param n_workers: the number of ranges migrated at once, 1 to migrate inline
+    :param batch_size: the number of legacy documents per range
+    :param checkpoint_fn: the journal filename recording migration progress
+    :param collection: the legacy collection when migrating inline, the
+        configured one if not given
+    """
+    collection = collection if collection is not None else legacy_collection()
+    os.makedirs(os.path.dirname(os.path.abspath(checkpoint_fn)), exist_ok=True)
+    checkpoint = Journal(checkpoint_fn)
+    frontier = checkpoint.get("frontier")
+    after = ObjectId(frontier["last_id"]) if frontier else None
+    print(f"Migrating praw documents after {after} .....")
+
+    total = BatchReport()
+    ranges: List[Tuple[ObjectId, ObjectId]] = []
+    finished: Dict[int, bool] = {}
+    n_frontier = 0
+
+    def record(idx: int, report: Optional[BatchReport]) -> None:
+        nonlocal total, n_frontier
+        finished[idx] = report is not None
+        if report is not None:
+            total += report
+            print(f"Range {idx}: {report}")
+        # advance the frontier over every leading range that succeeded
+        start = n_frontier
+        while finished.get(n_frontier):
+            n_frontier += 1
+        if n_frontier > start:
+            checkpoint.add("frontier", last_id=str(ranges[n_frontier - 1][1]),
+                           inserted=total.inserted)
+
+    def planned() -> Iterator[int]:
+        for id_range in id_ranges(collection, after, batch_size):
+            ranges.append(id_range)
+            yield len(ranges) - 1
+
+    try:
+        if n_workers == 1:
+            for idx in planned():
+                record(idx, migrate_batch(*ranges[idx], collection))
+        else:
+            # spawned workers open their own mongo connections rather than sharing forked ones
+            context = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(n_workers, mp_context=context,
+                                     initializer=connect_to_mongo) as executor:
+                def submit(idx: int) -> Future:
+                    return executor.submit(migrate_batch, *ranges[idx])
+
+                for idx, future in bounded_map(submit, planned(), 2 * n_workers):
+                    try:
+                        report = future.result()
+                    except Exception as e:
+                        print(f"Range {idx} failed and will be migrated again next run: {e}")
+                        report = None
+                    record(idx, report)
+    finally:
+        checkpoint.close()
+
+    print(f"{total.inserted} posts migrated: {total}")
+    return total
 
 
 if __name__ == "__main__":
+    connect_to_mongo()
     praw_to_post()
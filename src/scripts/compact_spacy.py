@@ -0,0 +1,89 @@
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Sequence
+
+from pymongo import UpdateOne
+from spacy.vocab import Vocab
+
+from src.schema import Post
+from src.parse_store import is_reference
+from src.tasks.spacy import SPACY_ATTRS, bytes_to_doc, doc_ents, is_compact, spacy_to_bytes
+from src.utils import chunked, connect_to_mongo
+
+COMPACT_BATCH_SIZE = 1000
+
+
+@dataclass
+class CompactReport:
+    """Counts for stored spacy parses rewritten in the compact format."""
+
+    posts: int = 0
+    compacted: int = 0
+    ents: int = 0
+    invalid: int = 0
+    bytes_before: int = 0
+    bytes_after: int = 0
+    seconds: float = 0.0
+
+    def __str__(self) -> str:
+        rate = self.posts / self.seconds if self.seconds else 0.0
+        saved = 1 - self.bytes_after / self.bytes_before if self.bytes_before else 0.0
+        return (f"{self.compacted} of {self.posts} parses compacted, {self.ents} entity lists "
+                f"filled, {self.invalid} invalid, {self.bytes_before} to {self.bytes_after} "
+                f"bytes ({saved:.0%} saved, {rate:.0f} docs/s)")
+
+
+def compact_spacy(
+    batch_size: int = COMPACT_BATCH_SIZE, attrs: Optional[Sequence[str]] = SPACY_ATTRS
+) -> CompactReport:
+    """
+    Rewrite every full spacy parse stored on a post in the compact format.
+
+    Posts parsed before entities were stored have their ents filled from the
+    same parse. Full parses carry their own strings, so they are read into an
+    empty vocab and no model needs to be loaded. Compact parses with entities
+    are skipped, so an interrupted migration can simply be run again.
+    """
+    start = time.perf_counter()
+    report = CompactReport()
+    vocab = Vocab()
+    collection = Post._get_collection()
+    projection = {"_id": 0, "_cls": 1, "pid": 1, "spacy": 1, "ents": 1}
+    cursor = collection.find({"spacy": {"$exists": True}}, projection).batch_size(batch_size)
+
+    for docs in chunked(cursor, batch_size):
+        updates = []
+        for doc in docs:
+            report.posts += 1
+            # parses in a store are only put there by the current stage, so are left as they are
+            compact = is_compact(doc["spacy"]) or is_reference(doc["spacy"])
+            if compact and "ents" in doc:
+                continue
+            try:
+                parse = bytes_to_doc(doc["spacy"], vocab)
+            except Exception as e:
+                print(f"Post with pid='{doc['pid']}' has an unreadable parse: {e}")
+                report.invalid += 1
+                continue
+
+            values: Dict[str, Any] = {}
+            if not compact:
+                values["spacy"] = spacy_to_bytes(parse, attrs)
+                report.compacted += 1
+                report.bytes_before += len(doc["spacy"])
+                report.bytes_after += len(values["spacy"])
+            if "ents" not in doc:
+                values["ents"] = doc_ents(parse)
+                report.ents += 1
+            updates.append(UpdateOne({"_cls": doc["_cls"], "pid": doc["pid"]}, {"$set": values}))
+        if updates:
+            collection.bulk_write(updates, ordered=False)
+
+    report.seconds = time.perf_counter() - start
+    print(report)
+    return report
+
+
+if __name__ == '__main__':
+    connect_to_mongo()
+    compact_spacy()
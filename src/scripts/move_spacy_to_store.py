@@ -0,0 +1,74 @@
+import argparse
+import time
+from dataclasses import dataclass
+
+from pymongo import UpdateOne
+
+from src.parse_store import PARSE_STORES, ParseStore, is_reference
+from src.schema import Post
+from src.tasks.spacy import blob_key
+from src.utils import chunked, connect_to_mongo
+
+MOVE_BATCH_SIZE = 1000
+
+
+@dataclass
+class MoveReport:
+    """Counts for spacy parses moved from their posts to a parse store."""
+
+    posts: int = 0
+    moved: int = 0
+    bytes_moved: int = 0
+    seconds: float = 0.0
+
+    def __str__(self) -> str:
+        rate = self.posts / self.seconds if self.seconds else 0.0
+        return (f"{self.moved} of {self.posts} parses moved, {self.bytes_moved} bytes "
+                f"({rate:.0f} docs/s)")
+
+
+def move_spacy_to_store(store: ParseStore, batch_size: int = MOVE_BATCH_SIZE) -> MoveReport:
+    """
+    Move every parse stored on a post into a parse store, leaving a reference on the post.
+
+    Each batch's parses are flushed to the store before their references are
+    written, and parses that are already references are skipped, so an
+    interrupted move can simply be run again.
+    """
+    start = time.perf_counter()
+    report = MoveReport()
+    collection = Post._get_collection()
+    cursor = collection.find({"spacy": {"$exists": True}},
+                             {"_id": 0, "_cls": 1, "pid": 1, "spacy": 1}).batch_size(batch_size)
+
+    for docs in chunked(cursor, batch_size):
+        updates = []
+        for doc in docs:
+            report.posts += 1
+            if is_reference(doc["spacy"]):
+                continue
+            ref = store.put(blob_key(doc), bytes(doc["spacy"]))
+            report.bytes_moved += len(doc["spacy"])
+            updates.append(UpdateOne({"_cls": doc["_cls"], "pid": doc["pid"]},
+                                     {"$set": {"spacy": ref}}))
+        if updates:
+            store.flush()
+            collection.bulk_write(updates, ordered=False)
+            report.moved += len(updates)
+
+    report.seconds = time.perf_counter() - start
+    print(report)
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Move spacy parses off their posts.")
+    parser.add_argument("store", help="The parse store to move parses to.",
+                        choices=sorted(PARSE_STORES))
+    args = parser.parse_args()
+    connect_to_mongo()
+    parse_store = PARSE_STORES[args.store]()
+    try:
+        move_spacy_to_store(parse_store)
+    finally:
+        parse_store.close()
@@ -1,85 +1,144 @@
-import tqdm
-
-from src.utils import connect_to_mongo, get_praw, utc_to_dt
-from src.schema import Post, SubmissionPost, CommentPost
-
-from mongoengine.queryset.visitor import Q
-from praw import Reddit
-from praw.models import Submission, Comment
-import numpy as np
-from typing import List, Dict
-import requests
-
-
-def fill_missing_post_fields(post: Post, praw: Reddit):
-	'''Attempt to fill in any missing fields for a post.'''
-	is_sub = isinstance(post, SubmissionPost)
-	if post.datetime is None:
-		try:
-			praw_inst = Submission if is_sub else Comment
-			praw_sc = praw_inst(reddit=praw, id=post.pid)
-			post.datetime = utc_to_dt(praw_sc.created_utc)
-		except praw.exceptions.ClientException:
-			pass
-	if is_sub and post.title is None:
-		try:
-			praw_sub = Submission(reddit=praw, id=post.pid)
-			post.title = praw_sub.title
-		except praw.exceptions.ClientException:
-			pass
-	post.save()
-
-
-def get_posts_by_ids(is_sub: bool, ids: List[str]) -> List[Dict]:
-    base_url = "https://api.pushshift.io/reddit/"
-    base_url += "submission" if is_sub else "comment"
-    base_url += ("/search?ids=" + ",".join(ids))
-    data = requests.get(base_url).json()['data']
-    return data
-
-def fill_all_posts():
-
-    chunk_size = 1000
-    '''
-    # update posts without datetimes
-    print('Comments:')
-    print('\tRetrieving pids without datetimes .....')
-    comment_subsets = CommentPost.objects(datetime__exists=False).only('pid')
-    pids = [c.pid for c in comment_subsets]
-
-    print('\tRetrieving missing data from psaw .....')
-    n_chunks = int(len(pids) / chunk_size)
-    for chunk_pids in np.array_split(pids, n_chunks):
-        full_comments = get_posts_by_ids(False, chunk_pids)
-    assert len(pids) == len(full_comments)
-
-    print('\tUpdating comms with missing data .....')
-    for pid, real_comm in tqdm(zip(pids, full_comments)):
-        comment = Comment.objects(pid=pid).first()
-        comment.datetime = utc_to_dt(real_comm.created_utc)
-        comment.save()
-    '''
-
-	# update submissions without titles
-	print('Submissions:')
-	print('\tUpdating pids without titles/datetimes .....')
-	sub_subsets = SubmissionPost.objects(Q(title__exists=False) | Q(datetime__exists=False))\
-								.only('pid')
-	pids = [s.pid for s in sub_subsets]
-
-    print('\tRetrieving missing data from psaw .....')
-    n_chunks = int(len(pids) / chunk_size)
-    for chunk_pids in tqdm.tqdm(np.array_split(pids, n_chunks)):
-        full_subs = get_posts_by_ids(True, chunk_pids)
-        for pid, real_sub in tqdm(zip(chunk_pids, full_subs)):
-            sub = Submission.objects(pid=pid).first()
-            sub.datetime = utc_to_dt(sub.created_utc)
-            sub.title = real_sub.title
-            sub.save()
-
-    print('\tUpdating subs with missing data .....')
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterator, List, Tuple, Type
+
+from pymongo import UpdateOne
+
+from src.pushshift import PushshiftClient
+from src.schema import CommentPost, Post, SubmissionPost
+from src.utils import bounded_map, chunked, connect_to_mongo, utc_to_dt
+
+FILL_BATCH_SIZE = 100
+N_WORKERS = 4
+
+# the fields filled from pushshift for each post type
+FILL_FIELDS = {
+    SubmissionPost: ["title", "datetime"],
+    CommentPost: ["datetime"],
+}
+FIELD_VALUES: Dict[str, Callable[[Any], Any]] = {
+    "title": lambda obj: obj.title,
+    "datetime": lambda obj: utc_to_dt(obj.created_utc) if obj.created_utc else None,
+}
+PUSHSHIFT_KINDS = {SubmissionPost: "submission", CommentPost: "comment"}
+
+
+@dataclass
+class FillReport:
+    """Counts for posts whose missing fields were filled."""
+
+    missing: int = 0
+    posts: int = 0
+    fields: int = 0
+    seconds: float = 0.0
+
+    def __add__(self, other: "FillReport") -> "FillReport":
+        return FillReport(
+            self.missing + other.missing,
+            self.posts + other.posts,
+            self.fields + other.fields,
+            self.seconds + other.seconds,
+        )
+
+    def __str__(self) -> str:
+        rate = self.fields / self.seconds if self.seconds else 0.0
+        return (f"{self.fields} fields filled on {self.posts} of {self.missing} incomplete posts "
+                f"({rate:.0f} fields/s)")
+
+
+def incomplete_posts(post: Type[Post]) -> Iterator[Dict[str, Any]]:
+    """
+    Stream the pids and fill fields of the posts of the given type missing any of them.
+
+    The query matches the (_cls, datetime) index and the partial (_cls, title)
+    index on submissions, both of which index missing fields as null.
+    """
+    fields = FILL_FIELDS[post]
+    query = {"_cls": post._class_name, "$or": [{field: None} for field in fields]}
+    projection = {"_id": 0, "pid": 1, **{field: 1 for field in fields}}
+    return Post._get_collection().find(query, projection).batch_size(10000)
+
+
+def fill_updates(
+    post: Type[Post], docs: List[Dict[str, Any]], objs: List[Any]
+) -> Tuple[List[UpdateOne], int]:
+    """
+    Return a $set update for each stored post that pushshift has any missing fields for.
+
+    :returns: the updates and the total number of fields they fill
+    """
+    by_id = {obj.id: obj for obj in objs}
+    updates = []
+    n_fields = 0
+    for doc in docs:
+        obj = by_id.get(doc["pid"])
+        if obj is None:
+            continue
+        values = {
+            field: FIELD_VALUES[field](obj)
+            for field in FILL_FIELDS[post] if doc.get(field) is None
+        }
+        values = {field: value for field, value in values.items() if value is not None}
+        if values:
+            updates.append(UpdateOne({"pid": doc["pid"], "_cls": post._class_name},
+                                     {"$set": values}))
+            n_fields += len(values)
+    return updates, n_fields
+
+
+def fill_missing_fields(
+    client: PushshiftClient,
+    post: Type[Post],
+    n_workers: int = N_WORKERS,
+    batch_size: int = FILL_BATCH_SIZE,
+) -> FillReport:
+    """
+    Fill the missing fields of all posts of the given type from pushshift.
+
+    Incomplete posts are fetched by id in batches by a pool of threads sharing
+    the client's rate limiter, and each batch's fixes are applied by the calling
+    thread with one unordered bulk write of $set updates.
+    """
+    start = time.perf_counter()
+    report = FillReport()
+    collection = Post._get_collection()
+    kind = PUSHSHIFT_KINDS[post]
+    remaining = chunked(incomplete_posts(post), batch_size)
+
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        def submit(docs: List[Dict[str, Any]]) -> Future:
+            return executor.submit(client.search_ids, kind, [doc["pid"] for doc in docs])
+
+        for docs, future in bounded_map(submit, remaining, 2 * n_workers):
+            report.missing += len(docs)
+            try:
+                updates, n_fields = fill_updates(post, docs, future.result())
+            except Exception as e:
+                print(f"Batch starting at {docs[0]['pid']} failed: {e}")
+                continue
+            if updates:
+                collection.bulk_write(updates, ordered=False)
+            report.posts += len(updates)
+            report.fields += n_fields
+
+    report.seconds = time.perf_counter() - start
+    print(f"\t{post.__name__}: {report}")
+    return report
+
+
+def fill_all_posts(
+    client: PushshiftClient, n_workers: int = N_WORKERS, batch_size: int = FILL_BATCH_SIZE
+) -> FillReport:
+    """Fill the missing titles and datetimes of all submissions and comments."""
+    total = FillReport()
+    for post in FILL_FIELDS:
+        print(f"Filling {post.__name__} fields .....")
+        total += fill_missing_fields(client, post, n_workers, batch_size)
+    print(f"Total: {total}")
+    return total
 
 
 if __name__ == '__main__':
-	connect_to_mongo()
-	fill_all_posts()
+    connect_to_mongo()
+    fill_all_posts(PushshiftClient())
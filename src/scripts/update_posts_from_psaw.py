@@ -1,4 +1,5 @@
-from src.utils import get_praw, get_psaw, sub_comm_to_post, posts_to_mongo, connect_to_mongo, dt_to_utc, utc_to_dt
+from src.encoders import encode_document
+from src.utils import UserResolver, get_praw, get_psaw, convert_posts, bulk_docs_to_mongo, connect_to_mongo, dt_to_utc, utc_to_dt
 from datetime import date, datetime
 from collections import Counter
 import pickle
@@ -45,11 +46,12 @@ def main():
     cache_month_counts(comms, False)
 
     print('Converting to Posts .....')
-    sub_posts = [sub_comm_to_post(s, True) for s in subs]
-    comm_posts = [sub_comm_to_post(c, False) for c in comms]
+    resolver = UserResolver()
+    sub_docs = convert_posts(subs, True, encode_document, resolver)
+    comm_docs = convert_posts(comms, False, encode_document, resolver)
 
     print('Storing in DB .....')
-    posts_to_mongo(sub_posts + comm_posts)
+    bulk_docs_to_mongo(sub_docs + comm_docs)
 
     print('Done.')
 
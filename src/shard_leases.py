@@ -0,0 +1,130 @@
+"""Pid-range shards of unparsed posts leased to spacy workers across processes and nodes."""
+import os
+import socket
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from pymongo.errors import BulkWriteError
+
+from src.encoders import encode_document
+from src.leases import (DONE, FAILED, LEASED, PENDING, held_by, lease_next, park_expired,
+                        release)
+from src.schema import Post, SpacyShard
+
+LEASE_SECONDS = 600
+MAX_ATTEMPTS = 3
+SAMPLES_PER_SHARD = 100
+
+
+def worker_name() -> str:
+    """
+    Return a name identifying this process across nodes.
+
+    The tasks of a Slurm job run on several nodes, where pids can repeat, so
+    the job and task ids are added to the hostname rather than replacing it.
+    """
+    slurm = [os.getenv(var) for var in ("SLURM_JOB_ID", "SLURM_PROCID")]
+    return ":".join([socket.gethostname(), *(part for part in slurm if part), str(os.getpid())])
+
+
+class ShardLeases:
+    """
+    Splits unparsed posts into pid ranges in the SpacyShard collection and leases them out.
+
+    Any number of workers, on any number of nodes, plan and lease shards
+    through mongo alone. Only the first worker to plan a round inserts its
+    shards, enforced by the unique shard index. A worker holds each shard by
+    renewing its lease as it writes parses; a lease that lapses, e.g. because
+    its worker died, makes the shard available to other workers again.
+    Shards that fail too often, or whose lease expires on their final attempt,
+    are parked as failed rather than retried forever.
+    """
+
+    def __init__(self, lease_seconds: int = LEASE_SECONDS, max_attempts: int = MAX_ATTEMPTS):
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+
+    @property
+    def collection(self):
+        """The underlying pymongo collection."""
+        return SpacyShard._get_collection()
+
+    def boundaries(self, n_shards: int, query: Dict[str, Any]) -> List[str]:
+        """Return the lower pids of all but the first of n roughly equal shards of a query."""
+        pids = sorted({
+            doc["pid"]
+            for doc in Post._get_collection().aggregate([
+                {"$match": query},
+                {"$sample": {"size": n_shards * SAMPLES_PER_SHARD}},
+                {"$project": {"_id": 0, "pid": 1}},
+            ])
+        })
+        step = len(pids) / n_shards
+        return sorted({pids[int(i * step)] for i in range(1, n_shards)}) if pids else []
+
+    def plan(self, n_shards: int, query: Dict[str, Any]) -> int:
+        """
+        Split the posts matching a query into pid ranges, unless a round is still unfinished.
+
+        Finished shards of a previous round are replaced by the new ones.
+
+        :returns: the number of shards this call created
+        """
+        park_expired(self.collection, self.max_attempts)
+        if self.collection.count_documents({"status": {"$in": [PENDING, LEASED]}}):
+            return 0
+        self.collection.delete_many({"status": {"$in": [DONE, FAILED]}})
+
+        bounds: List[Optional[str]] = [None, *self.boundaries(n_shards, query), None]
+        now = datetime.utcnow()
+        shards = [
+            encode_document(SpacyShard, {"shard": idx, "lo": lo, "hi": hi, "created": now})
+            for idx, (lo, hi) in enumerate(zip(bounds, bounds[1:]))
+        ]
+        try:
+            # shard 0 goes first, so a concurrent planner fails before inserting any shard
+            self.collection.insert_many(shards, ordered=True)
+        except BulkWriteError:
+            return 0
+        return len(shards)
+
+    def lease(self, worker: str) -> Optional[Dict[str, Any]]:
+        """Atomically lease the lowest available shard, returning it if there is one."""
+        return lease_next(self.collection, [("shard", 1)], self.lease_seconds, self.max_attempts,
+                          {"worker": worker})
+
+    def held(self, shard: int, worker: str) -> Dict[str, Any]:
+        """Return a query matching a shard only while a worker still holds its lease."""
+        return {"shard": shard, **held_by(worker)}
+
+    def renew(self, shard: int, worker: str, parsed: int) -> bool:
+        """Extend a held lease and record progress, returning False if the lease was lost."""
+        result = self.collection.update_one(
+            self.held(shard, worker),
+            {"$set": {"parsed": parsed,
+                      "lease_expires": datetime.utcnow() + timedelta(seconds=self.lease_seconds)}},
+        )
+        return result.matched_count == 1
+
+    def complete(self, shard: int, worker: str, parsed: int, seconds: float) -> bool:
+        """Mark a held shard as parsed, returning False if the lease was lost."""
+        result = self.collection.update_one(
+            self.held(shard, worker),
+            {"$set": {"status": DONE, "parsed": parsed, "seconds": seconds},
+             "$unset": {"lease_expires": "", "error": ""}},
+        )
+        return result.matched_count == 1
+
+    def fail(self, shard: int, worker: str, error: str) -> None:
+        """Release a failed shard for a retry, or park it once it is out of attempts."""
+        release(self.collection, self.held(shard, worker), self.max_attempts, error)
+
+    def progress(self) -> Dict[str, Any]:
+        """Return the number of shards in each status and the posts parsed by each worker."""
+        statuses: Dict[str, int] = {}
+        workers: Dict[str, int] = {}
+        for doc in self.collection.find({}, {"status": 1, "worker": 1, "parsed": 1}):
+            statuses[doc["status"]] = statuses.get(doc["status"], 0) + 1
+            if doc.get("worker"):
+                workers[doc["worker"]] = workers.get(doc["worker"], 0) + doc.get("parsed", 0)
+        return {"shards": statuses, "parsed": sum(workers.values()), "workers": workers}
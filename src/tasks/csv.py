@@ -1,10 +1,16 @@
+import multiprocessing
 import os
-from typing import List
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
+import numpy as np
 import pandas as pd
 
+from src.encoders import encode_document
+from src.journal import Journal
 from src.schema import CommentPost, Post, SubmissionPost
-from src.utils import utc_to_dt
+from src.utils import (ROOT_DIR, BatchReport, UserResolver, bulk_upsert_docs, connect_to_mongo,
+                       utc_to_dt)
 
 # hardcoded file locations on the HPC cluster
 BASE_DIR = "/work/akilby/drug_pricing_project"
@@ -15,6 +21,10 @@ OUT_JSON = os.path.join(BASE_DIR, "all_posts.json")
 # hardcoded column names for legacy comment and submission csv files
 SUB_COLNAMES = ["id", "url", "num_comments", "shortlink", "author", "title", "text", "utc"]
 COMM_COLNAMES = ["id", "sub_url", "parent_id", "text", "author", "utc"]
+CSV_CHUNK_SIZE = 50000
+N_WORKERS = 4
+MANIFEST_FN = os.path.join(ROOT_DIR, "cache", "csv-import-manifest.jsonl")
+LEGACY_SUBREDDIT = "opiates"
 
 
 def row_to_post(row: pd.Series, is_sub: bool) -> Post:
@@ -69,19 +79,175 @@ def extract_csv(filepath: str, colnames: List[str]) -> List[Post]:
     return []
 
 
-def read_csv(filepath: str, posttype: str) -> List[Post]:
-    """Read data from the given csv file using the given post type."""
-    if posttype.lower() in {"s", "c"}:
-        if os.path.isfile(filepath):
-            is_sub = posttype.lower() == "s"
-            colnames = SUB_COLNAMES if is_sub else COMM_COLNAMES
+def _nullable(column: pd.Series) -> List[Any]:
+    """Return the column as a list of python objects with missing values as None."""
+    return column.astype(object).where(column.notna(), None).tolist()
+
+
+def chunk_to_docs(
+    df: pd.DataFrame, is_sub: bool, resolver: Optional[UserResolver] = None
+) -> List[Dict[str, Any]]:
+    """
+    Convert a chunk of a legacy csv file to raw Post documents.
+
+    Columns are converted as a whole, and the chunk's authors are resolved to
+    users with a single batched lookup.
+    """
+    resolver = resolver or UserResolver()
+    df = df.dropna(subset=["id"])
+    users = resolver.resolve(df["author"].dropna().unique())
+    utc = pd.to_numeric(df["utc"], errors="coerce").apply(np.trunc)
+
+    columns = {
+        "pid": df["id"],
+        "text": df["text"],
+        "user": df["author"].map({name: user.id for name, user in users.items()}),
+        "datetime": pd.to_datetime(utc, unit="s"),
+    }
+    if is_sub:
+        columns["url"] = df["url"]
+        columns["title"] = df["title"]
+        columns["num_comments"] = pd.to_numeric(df["num_comments"], errors="coerce")\
+            .astype("Int64")
+        post = SubmissionPost
+    else:
+        columns["parent_id"] = df["parent_id"]
+        post = CommentPost
+
+    keys = list(columns.keys())
+    values = [_nullable(column) for column in columns.values()]
+    return [
+        encode_document(post, {"subreddit": LEGACY_SUBREDDIT, **dict(zip(keys, row))})
+        for row in zip(*values)
+    ]
+
+
+def stream_csv(
+    filepath: str, colnames: List[str], chunksize: int = CSV_CHUNK_SIZE
+) -> Iterator[List[Dict[str, Any]]]:
+    """
+    Lazily read all submissions or comments from the given csv file.
+
+    :param filepath: the csv filepath
+    :param colnames: the column names associated with the csv file
+    :param chunksize: the number of rows read into memory at once
+
+    :returns: an iterator over lists of raw Post documents
+    """
+    is_sub = "parent_id" not in colnames
+    resolver = UserResolver()
+    chunks = pd.read_csv(filepath, header=None, names=colnames, dtype=str, chunksize=chunksize)
+    for df in chunks:
+        yield chunk_to_docs(df, is_sub, resolver)
 
-            print("Reading Posts from csv file .....")
-            file_data = extract_csv(filepath, colnames)
 
-            print(f"{len(file_data)} posts from files retrieved.")
-            return file_data
+def _posttype_colnames(filepath: str, posttype: str) -> List[str]:
+    """Validate the given file and post type, returning the file's column names."""
+    if posttype.lower() in {"s", "c"}:
+        if os.path.isfile(filepath):
+            return SUB_COLNAMES if posttype.lower() == "s" else COMM_COLNAMES
 
         raise ValueError("The given file does not exist.")
 
     raise ValueError("Invalid post type provided.")
+
+
+def import_csv(filepath: str, posttype: str, chunksize: int = CSV_CHUNK_SIZE) -> BatchReport:
+    """Bulk write all posts in the given csv file to mongo, one chunk at a time."""
+    colnames = _posttype_colnames(filepath, posttype)
+
+    print("Importing Posts from csv file .....")
+    total = BatchReport()
+    for i, docs in enumerate(stream_csv(filepath, colnames, chunksize)):
+        report = bulk_upsert_docs(docs)
+        print(f"Chunk {i}: {report}")
+        total += report
+
+    print(f"{total.inserted} posts added to mongo.")
+    return total
+
+
+def _fingerprint(filepath: str) -> Dict[str, int]:
+    """Identify a version of a file by its size and modification time."""
+    stat = os.stat(filepath)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def _import_file(filepath: str, posttype: str, chunksize: int) -> Tuple[str, BatchReport]:
+    """Import a single file, returning the file alongside its counts."""
+    return filepath, import_csv(filepath, posttype, chunksize)
+
+
+def import_csv_dir(
+    dirpath: str,
+    posttype: str,
+    n_workers: int = N_WORKERS,
+    manifest_fn: str = MANIFEST_FN,
+    chunksize: int = CSV_CHUNK_SIZE,
+) -> BatchReport:
+    """
+    Bulk write all csv files in the given directory to mongo across a process pool.
+
+    Each completed file is recorded in the manifest with its size and modified
+    time, so re-running only imports files that are new or have changed. Pids
+    are deduplicated across files by the unique pid index the writes upsert on.
+
+    :param dirpath: the directory containing the csv files
+    :param posttype: if the files contain submissions (s) or comments (c)
+    :param n_workers: the number of files imported at once
+    :param manifest_fn: the journal filename recording imported files
+    :param chunksize: the number of rows read into memory at once per file
+
+    :returns: the summed counts over all imported files
+    """
+    filepaths = sorted(
+        os.path.abspath(os.path.join(dirpath, fn))
+        for fn in os.listdir(dirpath)
+        if os.path.splitext(fn)[1] == ".csv"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(manifest_fn)), exist_ok=True)
+    manifest = Journal(manifest_fn)
+
+    def is_imported(filepath: str) -> bool:
+        record = manifest.get(filepath)
+        return record is not None and record["fingerprint"] == _fingerprint(filepath)
+
+    todo = [fp for fp in filepaths if not is_imported(fp)]
+    print(f"Importing {len(todo)} of {len(filepaths)} csv files .....")
+
+    total = BatchReport()
+
+    def record(filepath: str, report: BatchReport) -> None:
+        nonlocal total
+        total += report
+        manifest.add(filepath, fingerprint=_fingerprint(filepath),
+                     inserted=report.inserted, duplicates=report.duplicates)
+
+    try:
+        if n_workers == 1:
+            for filepath in todo:
+                record(*_import_file(filepath, posttype, chunksize))
+        else:
+            # spawned workers open their own mongo connection rather than sharing a forked one
+            context = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(n_workers, mp_context=context,
+                                     initializer=connect_to_mongo) as executor:
+                futures = [executor.submit(_import_file, fp, posttype, chunksize) for fp in todo]
+                for future in as_completed(futures):
+                    record(*future.result())
+    finally:
+        manifest.close()
+
+    print(f"{total.inserted} posts added to mongo from {dirpath}.")
+    return total
+
+
+def read_csv(filepath: str, posttype: str) -> List[Post]:
+    """Read data from the given csv file using the given post type."""
+    colnames = _posttype_colnames(filepath, posttype)
+
+    print("Reading Posts from csv file .....")
+    file_data = extract_csv(filepath, colnames)
+
+    print(f"{len(file_data)} posts from files retrieved.")
+    return file_data
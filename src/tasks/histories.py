@@ -1,13 +1,23 @@
 """Functions for extracting user histories."""
 import random
-from typing import List, Optional
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
 
-import pandas as pd
 import tqdm
 from psaw import PushshiftAPI
 
+from src.dedupe import PidFilter
+from src.encoders import encode_document
+from src.history_queue import HistoryQueue
+from src.journal import Journal
+from src.pushshift import PushshiftClient
 from src.schema import Post, User
-from src.utils import posts_to_mongo, sub_comm_to_post
+from src.shard_leases import worker_name
+from src.utils import (BULK_BATCH_SIZE, BatchReport, UserResolver, bounded_map, build_post,
+                       bulk_docs_to_mongo, convert_posts, posts_to_mongo, utc_to_dt)
+
+N_WORKERS = 8
 
 
 def get_users(how: str = "all") -> List[str]:
@@ -27,34 +37,299 @@ def get_users(how: str = "all") -> List[str]:
     raise ValueError("Invalid 'how' type given.")
 
 
-def extract_user_posts(psaw: PushshiftAPI, user: str) -> List[Post]:
-    """Retrieve the full reddit posting history for the given user."""
+def history_newest(objs: List[Any]) -> Optional[datetime]:
+    """
+    Return the datetime a user's history watermark advances to once the given posts are stored.
+
+    This is the datetime of the newest fetched post, counting posts a pid
+    filter drops as already stored. Without any posts the watermark stays put,
+    as posts made before the fetch may not have been indexed by pushshift yet.
+    """
+    return max((utc_to_dt(obj.created_utc) for obj in objs), default=None)
+
+
+def extract_user_posts(
+    psaw: PushshiftAPI,
+    user: str,
+    resolver: Optional[UserResolver] = None,
+    pid_filter: Optional[PidFilter] = None,
+    after: Optional[datetime] = None,
+) -> Optional[Tuple[List[Post], Optional[datetime]]]:
+    """
+    Retrieve the full reddit posting history for the given user.
+
+    If a datetime is given, only posts made from then on are retrieved.
+
+    :returns: the user's posts and the datetime their history watermark advances to, if any,
+        or None if their history could not be fetched
+    """
+    resolver = resolver or UserResolver(queue_histories=False)
+    params: Dict[str, Any] = {"author": user}
+    if after:
+        # pushshift bounds are exclusive, so reach back a second to include the watermark itself
+        params["after"] = int(after.replace(tzinfo=timezone.utc).timestamp()) - 1
     try:
-        submissions = list(psaw.search_submissions(author=user))
-        comments = list(psaw.search_comments(author=user))
+        submissions = list(psaw.search_submissions(**params))
+        comments = list(psaw.search_comments(**params))
 
-        posts = [sub_comm_to_post(s, True) for s in submissions] + \
-                [sub_comm_to_post(c, False) for c in comments]
-        return posts
-    except Exception:
-        print(f"User: {user} was not found with PushshiftAPI")
-        return []
+        newest = history_newest(submissions + comments)
+        posts = convert_posts(submissions, True, build_post, resolver, pid_filter) + \
+            convert_posts(comments, False, build_post, resolver, pid_filter)
+        return posts, newest
+    except Exception as e:
+        print(f"User: {user} was not found with PushshiftAPI: {e}")
+        return None
 
 
 def get_users_histories(
-    users: List[str], psaw: PushshiftAPI, cache_fn: Optional[str] = None,
+    users: List[str],
+    psaw: PushshiftAPI,
+    journal_fn: Optional[str] = None,
+    pid_filter: Optional[PidFilter] = None,
+    refresh: bool = False,
 ) -> None:
     """
     Retrieve the full reddit posting history for all given users.
 
     :param users: a list of usernames
     :param psaw: a psaw connection object
-    :param cache_fn: an optional cache filename to write remaining users to
+    :param journal_fn: an optional journal filename recording completed users,
+        users already in the journal are skipped and users whose history could
+        not be fetched are left out, to be fetched again on the next run
+    :param pid_filter: an optional filter of stored pids, whose posts still advance the watermark
+    :param refresh: if only posts made since each user's history watermark are retrieved
+    """
+    journal = Journal(journal_fn) if journal_fn else None
+    resolver = UserResolver(queue_histories=False)
+    watermarks = history_watermarks(users) if refresh else {}
+    try:
+        for user in tqdm.tqdm(users):
+            if journal is not None and user in journal:
+                continue
+            fetched = extract_user_posts(psaw, user, resolver, pid_filter, watermarks.get(user))
+            if fetched is None:
+                continue
+            posts, newest = fetched
+            posts_to_mongo(posts)
+            advance_history_watermark(user, newest)
+
+            if journal is not None:
+                journal.add(user, n_posts=len(posts))
+    finally:
+        if journal is not None:
+            journal.close()
+
+
+def fetch_user_posts(
+    client: PushshiftClient,
+    user: str,
+    resolver: UserResolver,
+    pid_filter: Optional[PidFilter] = None,
+    after: Optional[datetime] = None,
+) -> Tuple[List[Dict[str, Any]], Optional[datetime]]:
+    """
+    Retrieve the reddit posting history for the given user as raw Post documents.
+
+    :param after: if given, only posts made from this time on are fetched
+
+    :returns: the user's posts and the datetime their history watermark advances to, if any
+    """
+    # pushshift bounds are exclusive, so reach back a second to include the watermark itself
+    after_int = int(after.replace(tzinfo=timezone.utc).timestamp()) - 1 if after else None
+    submissions = list(client.search_submissions(author=user, after=after_int))
+    comments = list(client.search_comments(author=user, after=after_int))
+    newest = history_newest(submissions + comments)
+    docs = convert_posts(submissions, True, encode_document, resolver, pid_filter) + \
+        convert_posts(comments, False, encode_document, resolver, pid_filter)
+    return docs, newest
+
+
+def history_watermarks(users: List[str]) -> Dict[str, datetime]:
+    """Return the history watermark of each given user that has one."""
+    cursor = User._get_collection().find(
+        {"username": {"$in": users}, "history_datetime": {"$ne": None}},
+        {"username": 1, "history_datetime": 1},
+    )
+    return {doc["username"]: doc["history_datetime"] for doc in cursor}
+
+
+def advance_history_watermark(user: str, newest: Optional[datetime]) -> None:
+    """Move the user's history watermark forward to the given datetime, if there is one."""
+    if newest is None:
+        return
+    User._get_collection().update_one({"username": user}, {"$max": {"history_datetime": newest}})
+
+
+def fetch_histories(
+    users: Iterable[str],
+    client: PushshiftClient,
+    n_workers: int,
+    batch_size: int,
+    on_done: Callable[[str, BatchReport], None],
+    on_error: Callable[[str, Exception], None],
+    pid_filter: Optional[PidFilter] = None,
+    total: Optional[int] = None,
+    watermarks: Optional[Dict[str, datetime]] = None,
+) -> None:
+    """
+    Fetch and store the posting histories of the given users concurrently.
+
+    Histories are fetched by a pool of threads that share the client's rate
+    limiter and are written by the calling thread as each user completes. At
+    most twice as many users as workers are pulled from the iterable at once.
+    Each user's history watermark is advanced once their posts are written.
+
+    :param users: an iterable of usernames, consumed lazily
+    :param on_done: called with each stored user and the counts of their write
+    :param on_error: called with each user whose history could not be fetched
+    :param total: the number of users for the progress bar, if known
+    :param watermarks: an optional map from users to the datetime to fetch from,
+        users without one have their full history fetched
+    """
+    watermarks = watermarks or {}
+    resolver = UserResolver(queue_histories=False)
+
+    with ThreadPoolExecutor(max_workers=n_workers) as executor, tqdm.tqdm(total=total) as bar:
+        def submit(user: str) -> Future:
+            return executor.submit(fetch_user_posts, client, user, resolver, pid_filter,
+                                   watermarks.get(user))
+
+        for user, future in bounded_map(submit, users, 2 * n_workers):
+            bar.update()
+            try:
+                posts, newest = future.result()
+            except Exception as e:
+                on_error(user, e)
+                continue
+            report = bulk_docs_to_mongo(posts, batch_size)
+            advance_history_watermark(user, newest)
+            on_done(user, report)
+
+
+def get_users_histories_concurrent(
+    users: List[str],
+    client: PushshiftClient,
+    n_workers: int = N_WORKERS,
+    batch_size: int = BULK_BATCH_SIZE,
+    journal_fn: Optional[str] = None,
+    pid_filter: Optional[PidFilter] = None,
+) -> Dict[str, int]:
+    """
+    Retrieve the full reddit posting history for all given users concurrently.
+
+    A failure only loses the history of the user it occurred for.
+
+    :param users: a list of usernames
+    :param client: a pushshift client, shared by all workers
+    :param n_workers: the number of histories to fetch at once
+    :param batch_size: the number of posts per bulk write
+    :param journal_fn: an optional journal filename recording completed users,
+        users already in the journal are skipped
+    :param pid_filter: an optional filter of stored pids, shared by all workers
+
+    :returns: a map from each successfully fetched user to their number of posts
+    """
+    n_posts: Dict[str, int] = {}
+    journal = Journal(journal_fn) if journal_fn else None
+
+    def on_done(user: str, report: BatchReport) -> None:
+        n_posts[user] = report.total
+        if journal is not None:
+            journal.add(user, n_posts=report.total)
+
+    def on_error(user: str, error: Exception) -> None:
+        print(f"User: {user} was not found with PushshiftAPI: {error}")
+
+    try:
+        fetch_histories(
+            (u for u in users if journal is None or u not in journal),
+            client, n_workers, batch_size, on_done, on_error, pid_filter, total=len(users),
+        )
+    finally:
+        if journal is not None:
+            journal.close()
+    return n_posts
+
+
+def drain_history_queue(
+    client: PushshiftClient,
+    n_workers: int = N_WORKERS,
+    batch_size: int = BULK_BATCH_SIZE,
+    queue: Optional[HistoryQueue] = None,
+    limit: Optional[int] = None,
+    pid_filter: Optional[PidFilter] = None,
+    worker: Optional[str] = None,
+) -> Dict[str, int]:
+    """
+    Fetch the histories of users waiting in the history queue until it is empty.
+
+    Tasks are leased only as workers become free, so several drainers can run
+    against the same queue. A failed task is released for a later retry.
+
+    :param client: a pushshift client, shared by all workers
+    :param n_workers: the number of histories to fetch at once
+    :param batch_size: the number of posts per bulk write
+    :param queue: the queue to drain, the default HistoryQueue if not given
+    :param limit: the max number of tasks to lease. 'None' if no limit.
+    :param pid_filter: an optional filter of stored pids, shared across leased users
+    :param worker: the name recorded on leased tasks, this host and process if not given
+
+    :returns: a map from each successfully fetched user to their number of posts
+    """
+    queue = queue or HistoryQueue()
+    worker = worker or worker_name()
+    n_posts: Dict[str, int] = {}
+
+    def on_done(user: str, report: BatchReport) -> None:
+        n_posts[user] = report.total
+        if not queue.complete(user, worker):
+            print(f"Lost the lease on user {user}")
+
+    def on_error(user: str, error: Exception) -> None:
+        print(f"User: {user} was not found with PushshiftAPI: {error}")
+        queue.fail(user, worker, str(error))
+
+    fetch_histories(queue.leases(worker, limit), client, n_workers, batch_size, on_done, on_error,
+                    pid_filter)
+    return n_posts
+
+
+def refresh_users_histories(
+    users: List[str],
+    client: PushshiftClient,
+    n_workers: int = N_WORKERS,
+    batch_size: int = BULK_BATCH_SIZE,
+    pid_filter: Optional[PidFilter] = None,
+) -> Dict[str, int]:
     """
-    for i in tqdm.tqdm(range(len(users))):
-        posts = extract_user_posts(psaw, users[i])
-        posts_to_mongo(posts)
+    Fetch only the posts made since each user's history watermark.
+
+    Users whose history has never been fetched get their full history.
+
+    :param users: a list of usernames
+    :param client: a pushshift client, shared by all workers
+    :param n_workers: the number of histories to fetch at once
+    :param batch_size: the number of posts per bulk write
+    :param pid_filter: an optional filter of stored pids, mainly for users without a watermark
+
+    :returns: a map from each successfully refreshed user to their number of new posts
+    """
+    watermarks = history_watermarks(users)
+    n_new = len(users) - len(watermarks)
+    print(f"Refreshing {len(users)} users, {n_new} without a watermark .....")
+    deltas: Dict[str, int] = {}
+
+    def on_done(user: str, report: BatchReport) -> None:
+        deltas[user] = report.inserted
+
+    def on_error(user: str, error: Exception) -> None:
+        print(f"User: {user} was not found with PushshiftAPI: {error}")
+
+    fetch_histories(users, client, n_workers, batch_size, on_done, on_error, pid_filter,
+                    total=len(users), watermarks=watermarks)
 
-        if cache_fn:
-            new_users = users[(i + 1) :]
-            pd.Series(new_users).to_csv(cache_fn, index=False, header=False)
+    for user, delta in sorted(deltas.items(), key=lambda item: -item[1]):
+        if delta:
+            print(f"\t{user}: {delta} new posts")
+    print(f"{sum(deltas.values())} new posts for {len(deltas)} refreshed users.")
+    return deltas
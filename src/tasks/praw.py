@@ -1,12 +1,98 @@
 """Define utility functions for the data pipeline."""
+import itertools as it
 import re
-from datetime import datetime
-from typing import List, Optional
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, Union
 
 from psaw import PushshiftAPI
 
-from src.schema import Post
-from src.utils import sub_comm_to_post
+from src.dedupe import PidFilter
+from src.encoders import encode_document
+from src.journal import Journal
+from src.pushshift import PushshiftClient
+from src.schema import Post, Subreddit
+from src.utils import (BULK_BATCH_SIZE, BatchReport, UserResolver, build_post, bulk_docs_to_mongo,
+                       chunked, convert_posts)
+
+N_WINDOWS = 8
+
+
+def search_chunks(
+    psaw: Union[PushshiftAPI, PushshiftClient],
+    subr: str,
+    start_time: datetime,
+    limit: Optional[int] = None,
+    end_time: Optional[datetime] = None,
+    chunk_size: int = BULK_BATCH_SIZE,
+) -> Iterator[Tuple[List[Any], bool]]:
+    """
+    Lazily search a subreddit's submissions, then its comments, in chunks.
+
+    :returns: an iterator over chunks of search results and whether they are submissions
+    """
+    # convert datetimes to ints for PSAW
+    start_int = int(start_time.timestamp())
+    end_int = int(end_time.timestamp()) if end_time else None
+
+    subs = psaw.search_submissions(after=start_int, subreddit=subr, limit=limit, before=end_int)
+    for sub_chunk in chunked(subs, chunk_size):
+        yield sub_chunk, True
+
+    comms = psaw.search_comments(after=start_int, subreddit=subr, limit=limit, before=end_int)
+    for comm_chunk in chunked(comms, chunk_size):
+        yield comm_chunk, False
+
+
+def stream_praw(
+    psaw: Union[PushshiftAPI, PushshiftClient],
+    subr: str,
+    start_time: datetime,
+    limit: Optional[int] = None,
+    end_time: Optional[datetime] = None,
+    chunk_size: int = BULK_BATCH_SIZE,
+    resolver: Optional[UserResolver] = None,
+    pid_filter: Optional[PidFilter] = None,
+) -> Iterator[List[Post]]:
+    """
+    Lazily extract all submissions/comments from reddit in the given time frame.
+
+    Results are pulled from psaw and converted only as chunks are consumed, so
+    memory is bounded by the chunk size rather than the size of the window.
+
+    :param subr: the name of a subreddit
+    :param start_time: the time to start extracting comments
+    :param limit: the max number of comments to obtain. 'None' if no limit.
+    :param end_time: the time to end extracting comments
+    :param chunk_size: the max number of posts in each yielded chunk
+    :param resolver: an optional user resolver shared across chunks
+    :param pid_filter: an optional filter of stored pids, applied to each chunk
+
+    :returns: an iterator over lists of Post objects
+    """
+    resolver = resolver or UserResolver()
+    for chunk, is_sub in search_chunks(psaw, subr, start_time, limit, end_time, chunk_size):
+        yield convert_posts(chunk, is_sub, build_post, resolver, pid_filter)
+
+
+def stream_praw_docs(
+    psaw: Union[PushshiftAPI, PushshiftClient],
+    subr: str,
+    start_time: datetime,
+    limit: Optional[int] = None,
+    end_time: Optional[datetime] = None,
+    chunk_size: int = BULK_BATCH_SIZE,
+    resolver: Optional[UserResolver] = None,
+    pid_filter: Optional[PidFilter] = None,
+) -> Iterator[List[Dict[str, Any]]]:
+    """
+    Lazily extract submissions/comments like stream_praw, as raw Post documents.
+
+    The chunks are ready for bulk_docs_to_mongo, skipping Post objects entirely.
+    """
+    resolver = resolver or UserResolver()
+    for chunk, is_sub in search_chunks(psaw, subr, start_time, limit, end_time, chunk_size):
+        yield convert_posts(chunk, is_sub, encode_document, resolver, pid_filter)
 
 
 def extract_praw(
@@ -26,23 +112,195 @@ def extract_praw(
 
     :returns: a list of Post objects
     """
-    # convert datetimes to ints for PSAW
-    start_int = int(start_time.timestamp())
-    end_int = int(end_time.timestamp()) if end_time else None
+    chunks = stream_praw(psaw, subr, start_time, limit=limit, end_time=end_time)
+    return list(it.chain.from_iterable(chunks))
+
+
+def split_window(
+    start_time: datetime, end_time: datetime, n_windows: int
+) -> List[Tuple[datetime, datetime]]:
+    """Split a time frame into the given number of contiguous, equally sized windows."""
+    step = (end_time - start_time) / n_windows
+    bounds = [start_time + i * step for i in range(n_windows)] + [end_time]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def extract_praw_sharded(
+    psaw: Union[PushshiftAPI, PushshiftClient],
+    subr: str,
+    start_time: datetime,
+    end_time: Optional[datetime] = None,
+    n_windows: int = N_WINDOWS,
+    checkpoint_fn: Optional[str] = None,
+    batch_size: int = BULK_BATCH_SIZE,
+    pid_filter: Optional[PidFilter] = None,
+) -> BatchReport:
+    """
+    Extract and store all submissions/comments in a time frame, fetching windows concurrently.
+
+    The time frame is split into windows that are each streamed into the bulk
+    writer by their own thread. Completed windows are recorded in the
+    checkpoint journal, so after a failure only the failed windows are
+    fetched again when the same backfill is re-run. A backfill without an end
+    time records the time it resolved the end to, which re-runs reuse so that
+    they split the time frame into the same windows.
+
+    :param psaw: a psaw connection object or a thread-safe pushshift client
+    :param subr: the name of a subreddit
+    :param start_time: the time to start extracting posts
+    :param end_time: the time to end extracting posts, now if not given
+    :param n_windows: the number of windows to split the time frame into
+    :param checkpoint_fn: an optional journal filename recording completed windows
+    :param batch_size: the number of posts per chunk and bulk write
+    :param pid_filter: an optional filter of stored pids, shared by all windows
+
+    :returns: the summed counts over all completed windows
+    """
+    checkpoint = Journal(checkpoint_fn) if checkpoint_fn else None
+    if end_time is None:
+        plan_key = f"{subr}/{start_time.isoformat()}/end"
+        plan = checkpoint.get(plan_key) if checkpoint is not None else None
+        if plan is not None:
+            end_time = datetime.fromisoformat(plan["end_time"])
+        else:
+            end_time = datetime.now()
+            if checkpoint is not None:
+                checkpoint.add(plan_key, end_time=end_time.isoformat())
+    windows = split_window(start_time, end_time, n_windows)
+    resolver = UserResolver()
+
+    def window_key(window: Tuple[datetime, datetime]) -> str:
+        return f"{subr}/{window[0].isoformat()}/{window[1].isoformat()}"
+
+    def fetch(i: int, window: Tuple[datetime, datetime]) -> BatchReport:
+        # pushshift bounds are exclusive, so later windows reach back a second
+        # to include posts made exactly on the boundary
+        window_start = window[0] if i == 0 else window[0] - timedelta(seconds=1)
+        chunks = stream_praw_docs(psaw, subr, window_start, end_time=window[1],
+                                  chunk_size=batch_size, resolver=resolver, pid_filter=pid_filter)
+        return bulk_docs_to_mongo(it.chain.from_iterable(chunks), batch_size)
+
+    todo = [
+        (i, w) for i, w in enumerate(windows)
+        if checkpoint is None or window_key(w) not in checkpoint
+    ]
+    print(f"Fetching {len(todo)} of {len(windows)} windows for {subr} .....")
+
+    total = BatchReport()
+    with ThreadPoolExecutor(max_workers=max(1, len(todo))) as executor:
+        futures = {executor.submit(fetch, i, w): w for i, w in todo}
+        for future in as_completed(futures):
+            window = futures[future]
+            try:
+                report = future.result()
+            except Exception as e:
+                print(f"Window {window_key(window)} failed and will be retried next run: {e}")
+                continue
+            total += report
+            if checkpoint is not None:
+                checkpoint.add(window_key(window), inserted=report.inserted,
+                               duplicates=report.duplicates)
+
+    if checkpoint is not None:
+        checkpoint.close()
+    return total
+
 
-    # retrieve all submissions and comments
+def register_subreddits(names: Iterable[str], start_time: Optional[datetime] = None) -> None:
+    """
+    Add subreddits to the updater's registry if they are not already tracked.
+
+    A new subreddit's watermark starts at its newest stored post, or at the
+    given start time if none of its posts are stored yet.
+    """
+    for name in names:
+        if Subreddit.objects(name=name).count() == 0:
+            newest = Post.objects(subreddit=name).only("datetime").order_by("-datetime").first()
+            last_datetime = newest.datetime if newest else start_time
+            Subreddit(name=name, last_datetime=last_datetime).save()
+
+
+def update_subreddit(
+    psaw: Union[PushshiftAPI, PushshiftClient],
+    subreddit: Subreddit,
+    batch_size: int = BULK_BATCH_SIZE,
+    resolver: Optional[UserResolver] = None,
+    pid_filter: Optional[PidFilter] = None,
+) -> BatchReport:
+    """
+    Store all posts made to a subreddit since its watermark, then advance the watermark.
+
+    The watermark only moves once every post up to it has been written, so an
+    interrupted update is simply repeated from the old watermark.
+    """
+    if subreddit.last_datetime is None:
+        raise ValueError(f"Subreddit {subreddit.name} has no watermark to update from.")
+
+    newest = subreddit.last_datetime
+
+    def track_newest(chunks: Iterator[List[Dict[str, Any]]]) -> Iterator[Dict[str, Any]]:
+        nonlocal newest
+        for chunk in chunks:
+            for doc in chunk:
+                if doc.get("datetime") and doc["datetime"] > newest:
+                    newest = doc["datetime"]
+                yield doc
 
-    subs = list(
-        psaw.search_submissions(after=start_int, subreddit=subr, limit=limit, before=end_int)
+    chunks = stream_praw_docs(psaw, subreddit.name, subreddit.last_datetime,
+                              chunk_size=batch_size, resolver=resolver, pid_filter=pid_filter)
+    report = bulk_docs_to_mongo(track_newest(chunks), batch_size)
+
+    Subreddit.objects(name=subreddit.name).update_one(
+        __raw__={"$max": {"last_datetime": newest}}
     )
-    comms = list(psaw.search_comments(after=start_int, subreddit=subr, limit=limit, before=end_int))
+    return report
+
+
+def update_subreddits(
+    psaw: Union[PushshiftAPI, PushshiftClient],
+    n_workers: int = 1,
+    batch_size: int = BULK_BATCH_SIZE,
+    pid_filter: Optional[PidFilter] = None,
+) -> Dict[str, BatchReport]:
+    """
+    Update every active subreddit in the registry, several at a time.
+
+    :param psaw: a psaw connection object, or a thread-safe pushshift client
+        when updating concurrently
+    :param n_workers: the number of subreddits updated at once
+    :param batch_size: the number of posts per chunk and bulk write
+    :param pid_filter: an optional filter of stored pids, shared by all subreddits
 
-    # convert Submission/Comment object to Sub/Comm objects
-    sub_objs: List[Post] = [sub_comm_to_post(s, True) for s in subs]
-    comm_objs: List[Post] = [sub_comm_to_post(c, False) for c in comms]
+    :returns: a map from each successfully updated subreddit to its counts
+    """
+    subreddits = list(Subreddit.objects(active=True))
+    resolver = UserResolver()
+    reports = {}
+
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        futures = {
+            executor.submit(
+                update_subreddit, psaw, subreddit, batch_size, resolver, pid_filter
+            ): subreddit
+            for subreddit in subreddits
+        }
+        for future in as_completed(futures):
+            name = futures[future].name
+            try:
+                reports[name] = future.result()
+            except Exception as e:
+                print(f"Subreddit {name} failed to update: {e}")
+                continue
+            print(f"\tUpdated subreddit {name}: {reports[name]}")
+
+    return reports
 
-    # return list of combined post objects
-    return sub_objs + comm_objs
+
+def parse_date(date_str: str) -> datetime:
+    """Parse a YYYY-MM-DD date given on the command line."""
+    if re.match(r"\d{4}-\d{2}-\d{2}", date_str):
+        return datetime.strptime(date_str, "%Y-%m-%d")
+    raise ValueError("Invalid date provided.")
 
 
 def validate_praw(
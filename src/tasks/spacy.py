@@ -1,40 +1,591 @@
 import ast
+import hashlib
+import random
+import re
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
 
 import tqdm
-from mongoengine.queryset.visitor import Q
+from pymongo import UpdateOne
 from spacy.lang.en import English
-from spacy.tokens import Doc
+from spacy.tokens import Doc, DocBin
+from spacy.vocab import Vocab
 import pymongo
 
+from src.gazetteer import GazetteerMatcher, load_matcher
+from src.parse_store import MongoParseStore, ParseStore, is_reference, load_parse
 from src.schema import Post, SubmissionPost
+from src.shard_leases import ShardLeases, worker_name
+from src.utils import chunked
 
+SPACY_BATCH_SIZE = 256
+N_PROCESS = 1
+N_SHARDS = 64
+# leave room in the 16MB document limit for the rest of the post, spilling larger parses
+MAX_SPACY_BYTES = 16 * 1024 * 1024 - 256 * 1024
+# longer texts are parsed in chunks, bounding the memory of any one nlp call
+MAX_CHUNK_CHARS = 20000
+# chunk boundaries in order of preference: paragraphs, sentences and whitespace
+CHUNK_BOUNDARIES = (re.compile(r"\n\s*\n\s*"), re.compile(r"[.!?]+\s+"), re.compile(r"\s+"))
+# the token attributes kept by compact parses, enough for entities and lemmas
+SPACY_ATTRS = ("ORTH", "LEMMA", "ENT_IOB", "ENT_TYPE")
+# marks compact parses, which are compressed DocBins rather than Doc.to_bytes
+COMPACT_PREFIX = b"DocBin:"
+# the entity labels of places and the pipes that find them
+LOCATION_LABELS = ("GPE", "LOC")
+NER_PIPES = ("tok2vec", "ner", "entity_ruler")
+LOCATION_AUDIT_RATE = 0.01
 
-def add_spacy_to_mongo(nlp: English) -> int:
-    """Add spacy field to all posts in mongo."""
-    post_subsets = Post.objects(Q(spacy__exists=False) & Q(text__exists=True))\
-                       .only('pid')
-
-    for post_subset in tqdm.tqdm(post_subsets):
-        post = Post.objects(pid=post_subset.pid).first()
-        if isinstance(post, SubmissionPost):
-            post_title = post.title if isinstance(post.title, str) else ""
-            text = '. '.join([post_title, post.text])
-        else:
-            text = post.text
-        if type(text) == str:
-            post.spacy = nlp(text).to_bytes()
+PidRange = Tuple[Optional[str], Optional[str]]
+
+
+@dataclass
+class SpacyReport:
+    """Counts for posts parsed by spacy."""
+
+    parsed: int = 0
+    chunked: int = 0
+    spilled: int = 0
+    too_large: int = 0
+    unchanged: int = 0
+    seconds: float = 0.0
+
+    def __add__(self, other: "SpacyReport") -> "SpacyReport":
+        return SpacyReport(
+            self.parsed + other.parsed,
+            self.chunked + other.chunked,
+            self.spilled + other.spilled,
+            self.too_large + other.too_large,
+            self.unchanged + other.unchanged,
+            self.seconds + other.seconds,
+        )
+
+    def __str__(self) -> str:
+        rate = (self.parsed + self.too_large) / self.seconds if self.seconds else 0.0
+        return (f"{self.parsed} parsed ({self.chunked} in chunks, {self.spilled} spilled), "
+                f"{self.too_large} too large to save, {self.unchanged} unchanged "
+                f"({rate:.0f} docs/s)")
+
+
+@dataclass
+class LocationReport:
+    """Counts for posts whose entities were found only if the gazetteer flagged them."""
+
+    from_parses: int = 0
+    flagged: int = 0
+    skipped: int = 0
+    found: int = 0
+    audited: int = 0
+    missed: int = 0
+    audit_rate: float = 0.0
+    seconds: float = 0.0
+
+    @property
+    def skip_rate(self) -> float:
+        """The fraction of the posts without a parse whose NER was skipped."""
+        total = self.flagged + self.skipped
+        return self.skipped / total if total else 0.0
+
+    @property
+    def recall(self) -> Optional[float]:
+        """
+        The estimated fraction of posts naming a place that were flagged.
+
+        Posts are counted as naming a place if full NER finds a location in
+        them. The flagged posts are all parsed, and the unflagged posts found
+        to name a place in the audited sample are scaled up by the audit rate.
+        """
+        if not self.audit_rate:
+            return None
+        missed = self.missed / self.audit_rate
+        return self.found / (self.found + missed) if self.found + missed else 1.0
+
+    def __str__(self) -> str:
+        rate = (self.from_parses + self.flagged + self.skipped) / self.seconds \
+            if self.seconds else 0.0
+        recall = f"{self.recall:.1%}" if self.recall is not None else "not audited"
+        return (f"{self.from_parses} from stored parses, "
+                f"{self.flagged} flagged ({self.found} naming places), {self.skipped} skipped "
+                f"({self.skip_rate:.1%}), {self.missed} of {self.audited} audited missed, "
+                f"recall {recall} ({rate:.0f} docs/s)")
+
+
+def model_name(nlp: English) -> str:
+    """Return the name and version of a spacy model, stamped on the parses it makes."""
+    return f"{nlp.meta['lang']}_{nlp.meta['name']}-{nlp.meta['version']}"
+
+
+def text_hash(text: str) -> str:
+    """Return a digest of parsed text, stamped on its parse to detect changed posts."""
+    return hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+
+
+def spacy_to_bytes(doc: Doc, attrs: Optional[Sequence[str]] = SPACY_ATTRS) -> bytes:
+    """
+    Serialize a spacy doc for storage.
+
+    :param attrs: the token attributes to keep in a compact parse, or None to
+        keep the full doc with Doc.to_bytes
+    """
+    if attrs is None:
+        return doc.to_bytes()
+    doc_bin = DocBin(attrs=list(attrs), store_user_data=False)
+    doc_bin.add(doc)
+    return COMPACT_PREFIX + doc_bin.to_bytes()
+
+
+def is_compact(data: bytes) -> bool:
+    """Check if stored spacy bytes are a compact parse."""
+    return bytes(data[:len(COMPACT_PREFIX)]) == COMPACT_PREFIX
+
+
+def blob_key(doc: Dict[str, Any]) -> str:
+    """Return the key of a raw post's parse in a parse store, unique across post types."""
+    return f"{doc['_cls']}:{doc['pid']}"
+
+
+def _split_at(text: str, level: int, max_chars: int) -> Iterator[str]:
+    if len(text) <= max_chars:
+        yield text
+    elif level == len(CHUNK_BOUNDARIES):
+        for offset in range(0, len(text), max_chars):
+            yield text[offset:offset + max_chars]
+    else:
+        ends = [m.end() for m in CHUNK_BOUNDARIES[level].finditer(text) if m.end() < len(text)]
+        for start, end in zip([0, *ends], [*ends, len(text)]):
+            yield from _split_at(text[start:end], level + 1, max_chars)
+
+
+def split_text(text: str, max_chars: int = MAX_CHUNK_CHARS) -> List[str]:
+    """
+    Split text into chunks of at most max_chars characters that join back into it.
+
+    Chunks end on paragraph boundaries where possible, then on sentence
+    boundaries, then on whitespace, and only as a last resort mid-word.
+    """
+    chunks = [""]
+    for piece in _split_at(text, 0, max_chars):
+        if chunks[-1] and len(chunks[-1]) + len(piece) > max_chars:
+            chunks.append("")
+        chunks[-1] += piece
+    return chunks
+
+
+def doc_ents(doc: Doc) -> List[Dict[str, Any]]:
+    """Return the raw Entity documents of a parsed doc's entity spans."""
+    return [
+        {"text": ent.text.strip(), "label": ent.label_,
+         "start": ent.start_char, "end": ent.end_char}
+        for ent in doc.ents if ent.text.strip()
+    ]
+
+
+def merge_chunks(parses: Iterator[Tuple[Doc, Tuple[Any, int]]]) -> Iterator[Tuple[Doc, Any]]:
+    """
+    Merge piped chunk parses back into one parse per text.
+
+    The context of each chunk holds its text's context and number of chunks,
+    and the chunks of a text must arrive in order, one after another.
+    """
+    chunk_parses: List[Doc] = []
+    for parse, context in parses:
+        chunk_parses.append(parse)
+        if len(chunk_parses) == context[1]:
+            if len(chunk_parses) > 1:
+                parse = Doc.from_docs(chunk_parses, ensure_whitespace=False)
+            chunk_parses = []
+            yield parse, context
+
+
+def parse_text(doc: Dict[str, Any]) -> Optional[str]:
+    """Return the text to parse for a raw post, prefixed by its title if it is a submission."""
+    text = doc.get("text")
+    if not isinstance(text, str):
+        return None
+    if doc.get("_cls") == SubmissionPost._class_name:
+        title = doc.get("title")
+        text = '. '.join([title if isinstance(title, str) else "", text])
+    return text
+
+
+def unparsed_query(
+    model: Optional[str] = None,
+    titles: bool = False,
+    verify: bool = False,
+    pid_range: PidRange = (None, None),
+) -> Dict[str, Any]:
+    """
+    Return the query for posts without an up to date spacy parse.
+
+    :param model: also match posts whose parse was not stamped with this model
+    :param titles: also match every parsed submission, to re-parse it with its title
+    :param verify: match every post with text, to compare its text with the stamped hash
+    :param pid_range: the inclusive lower and exclusive upper pids to match, either unbounded
+        if None
+    """
+    query: Dict[str, Any] = {"text": {"$exists": True}}
+    if not verify:
+        stale: List[Dict[str, Any]] = [{"spacy": {"$exists": False}}]
+        if model is not None:
+            stale.append({"spacy_model": {"$ne": model}})
+        if titles:
+            stale.append({"_cls": SubmissionPost._class_name})
+        query["$or"] = stale
+    lo, hi = pid_range
+    if lo is not None or hi is not None:
+        query["pid"] = {op: pid for op, pid in (("$gte", lo), ("$lt", hi)) if pid is not None}
+    return query
+
+
+def unparsed_posts(query: Dict[str, Any], batch_size: int = 10000) -> Iterator[Dict[str, Any]]:
+    """Stream the raw pids, classes, texts and parse stamps of the posts matching a query."""
+    projection = {"_id": 0, "_cls": 1, "pid": 1, "text": 1, "title": 1, "spacy_model": 1,
+                  "spacy_hash": 1}
+    return Post._get_collection().find(query, projection).batch_size(batch_size)
+
+
+def write_parses(
+    updates: List[Tuple[Dict[str, Any], Dict[str, Any]]], report: SpacyReport
+) -> None:
+    """
+    Write the values of parsed raw posts in one unordered bulk write of $set updates.
+
+    If any post would grow too large, the posts are written one at a time, and
+    the parses of those that do not fit are spilled to a MongoParseStore. Once
+    a post holds its new parse, any other parse of it spilled to the
+    MongoParseStore is deleted.
+    """
+    collection = Post._get_collection()
+    blobs = MongoParseStore()
+
+    def update(doc: Dict[str, Any], values: Dict[str, Any]) -> UpdateOne:
+        return UpdateOne({"_cls": doc["_cls"], "pid": doc["pid"]}, {"$set": values})
+
+    def prune(written: List[Tuple[Dict[str, Any], Dict[str, Any]]]) -> None:
+        blobs.prune([blob_key(doc) for doc, _ in written],
+                    [values["spacy"] for _, values in written])
+
+    try:
+        collection.bulk_write([update(doc, values) for doc, values in updates], ordered=False)
+        report.parsed += len(updates)
+        prune(updates)
+        return
+    except pymongo.errors.DocumentTooLarge:
+        pass
+    written = []
+    for doc, values in updates:
+        try:
+            collection.bulk_write([update(doc, values)])
+        except pymongo.errors.DocumentTooLarge:
+            if is_reference(values["spacy"]):
+                print(f"Post with pid='{doc['pid']}' is too large to save.")
+                report.too_large += 1
+                continue
+            values["spacy"] = blobs.put(blob_key(doc), values["spacy"])
+            report.spilled += 1
             try:
-                post.save()
+                collection.bulk_write([update(doc, values)])
             except pymongo.errors.DocumentTooLarge:
-                print(f"Post with pid='{post.pid}' is too large to save.")
+                print(f"Post with pid='{doc['pid']}' is too large to save.")
+                report.too_large += 1
+                # the post still references its old parse, so only the new one goes
+                blobs.delete(values["spacy"])
+                continue
+        report.parsed += 1
+        written.append((doc, values))
+    prune(written)
+
+
+def add_spacy_to_mongo(
+    nlp: English,
+    batch_size: int = SPACY_BATCH_SIZE,
+    n_process: int = N_PROCESS,
+    titles: bool = False,
+    attrs: Optional[Sequence[str]] = SPACY_ATTRS,
+    verify: bool = False,
+    max_chars: Optional[int] = MAX_CHUNK_CHARS,
+    store: Optional[ParseStore] = None,
+    pid_range: PidRange = (None, None),
+    on_batch: Optional[Callable[[SpacyReport], bool]] = None,
+) -> SpacyReport:
+    """
+    Add spacy field to all posts in mongo.
+
+    Posts are read with a single projected cursor and their texts parsed in
+    batches with nlp.pipe. With more than one process, spacy forks its workers
+    from this process after the model has loaded, so they share it
+    copy-on-write and only texts and parsed docs are sent between processes.
+    Each batch of parses is written back as unordered $set updates of the
+    spacy field, by default in the compact format of spacy_to_bytes, and of
+    the ents field indexed for entity lookups by user.
+
+    Texts longer than max_chars are split by split_text, their chunks piped
+    like any other text and their parses merged back with the entity offsets
+    of the whole text. With a parse store, every parse is put in it and its
+    post stores a reference instead, keeping posts small. Without one, only
+    parses too large for their post are spilled to a MongoParseStore.
+
+    Parses are stamped with the model's name and version and a hash of the
+    parsed text. Posts are parsed if they are unparsed or their stamp names
+    another model; with verify, posts whose text no longer matches its hash
+    are parsed as well.
+
+    :param nlp: the loaded spacy model
+    :param batch_size: the number of texts sent to the model and written at a time
+    :param n_process: the number of processes parsing texts
+    :param titles: also re-parse every submission already parsed, so its parse includes its title
+    :param attrs: the token attributes to store, or None to store full docs
+    :param verify: also hash the text of every parsed post, re-parsing those that changed
+    :param max_chars: the longest text parsed whole, or None to parse every text whole
+    :param store: the store to put parses in, or None to store them on their posts
+    :param pid_range: the inclusive lower and exclusive upper pids to parse
+    :param on_batch: called with the running report after each batch is written,
+        stopping the stage early if it returns False
+    """
+    start = time.perf_counter()
+    report = SpacyReport()
+    model = model_name(nlp)
+
+    def texts() -> Iterator[Tuple[str, Tuple[Dict[str, Any], int]]]:
+        for doc in unparsed_posts(unparsed_query(model, titles, verify, pid_range)):
+            text = parse_text(doc)
+            if text is None:
+                continue
+            doc["spacy_hash"], stamped_hash = text_hash(text), doc.get("spacy_hash")
+            # only verify and titles match posts that may be up to date
+            fresh = doc.get("spacy_model") == model and doc["spacy_hash"] == stamped_hash
+            if (verify or titles) and fresh:
+                report.unchanged += 1
+                continue
+            chunks = split_text(text, max_chars) if max_chars else [text]
+            for chunk in chunks:
+                yield chunk, (doc, len(chunks))
+
+    parses = nlp.pipe(texts(), as_tuples=True, batch_size=batch_size, n_process=n_process)
+    for batch in chunked(tqdm.tqdm(merge_chunks(parses)), batch_size):
+        updates = []
+        for parse, (doc, n_chunks) in batch:
+            report.chunked += n_chunks > 1
+            data = spacy_to_bytes(parse, attrs)
+            if store is not None:
+                data = store.put(blob_key(doc), data)
+            elif len(data) > MAX_SPACY_BYTES:
+                data = MongoParseStore().put(blob_key(doc), data)
+                report.spilled += 1
+            updates.append((doc, {"spacy": data, "ents": doc_ents(parse), "spacy_model": model,
+                                  "spacy_hash": doc["spacy_hash"]}))
+        if updates:
+            # references must not be written before their parses can be read
+            if store is not None:
+                store.flush()
+            write_parses(updates, report)
+        if on_batch is not None and not on_batch(report):
+            break
+
+    report.seconds = time.perf_counter() - start
+    print(report)
+    return report
+
+
+def count_stale_posts(nlp: English, verify: bool = False) -> Dict[str, int]:
+    """
+    Count the posts the spacy stage would parse, by reason, without parsing any.
+
+    :param verify: also count parsed posts whose text changed, hashing every parsed post's text
+    """
+    model = model_name(nlp)
+    collection = Post._get_collection()
+    parsed = {"text": {"$exists": True}, "spacy": {"$exists": True}}
+    counts = {
+        "unparsed": collection.count_documents({"text": {"$exists": True},
+                                                "spacy": {"$exists": False}}),
+        "stale_model": collection.count_documents({**parsed, "spacy_model": {"$ne": model}}),
+    }
+    if verify:
+        counts["changed"] = 0
+        for doc in unparsed_posts({**parsed, "spacy_model": model}):
+            text = parse_text(doc)
+            if text is not None and text_hash(text) != doc.get("spacy_hash"):
+                counts["changed"] += 1
+    return counts
+
+
+def add_location_ents(
+    nlp: English,
+    matcher: Optional[GazetteerMatcher] = None,
+    batch_size: int = SPACY_BATCH_SIZE,
+    n_process: int = N_PROCESS,
+    audit_rate: float = LOCATION_AUDIT_RATE,
+    max_chars: Optional[int] = MAX_CHUNK_CHARS,
+    seed: Optional[int] = None,
+) -> LocationReport:
+    """
+    Add the ents field to posts without one, running NER only on posts that could name a place.
+
+    Posts that already have a spacy parse get the entities of that parse.
+    Of the rest, the gazetteer matcher flags the posts whose text holds a
+    place name, and only those are piped through the model's entity pipes.
+    The others are marked as gazetteer_skipped rather than given entities, so
+    a full spacy run still parses them and fills their ents. Posts' spacy
+    fields are left as they are.
+
+    A random sample of the skipped posts is parsed as well, as the full NER
+    baseline the report's recall is estimated against. Their entities are
+    stored like those of flagged posts.
+
+    :param nlp: the loaded spacy model
+    :param matcher: the place name matcher, the gazetteer's if not given
+    :param batch_size: the number of texts sent to the model and written at a time
+    :param n_process: the number of processes parsing texts
+    :param audit_rate: the fraction of skipped posts parsed to estimate recall
+    :param max_chars: the longest text parsed whole, or None to parse every text whole
+    :param seed: the seed of the audit sample
+    """
+    start = time.perf_counter()
+    report = LocationReport(audit_rate=audit_rate)
+    matcher = matcher if matcher is not None else load_matcher()
+    rand = random.Random(seed)
+    collection = Post._get_collection()
+    # the updates of posts that are not piped, written a batch at a time
+    unpiped: List[UpdateOne] = []
+    query = {"text": {"$exists": True}, "ents": {"$exists": False},
+             "gazetteer_skipped": {"$ne": True}}
+    projection = {"_id": 0, "_cls": 1, "pid": 1, "text": 1, "title": 1, "spacy": 1}
+
+    def update(doc: Dict[str, Any], values: Dict[str, Any]) -> UpdateOne:
+        return UpdateOne({"_cls": doc["_cls"], "pid": doc["pid"]}, {"$set": values})
+
+    def write_unpiped(min_updates: int = 1) -> None:
+        if len(unpiped) >= min_updates:
+            collection.bulk_write(unpiped, ordered=False)
+            unpiped.clear()
+
+    def texts() -> Iterator[Tuple[str, Tuple[Tuple[Dict[str, Any], bool], int]]]:
+        for doc in collection.find(query, projection).batch_size(10000):
+            text = parse_text(doc)
+            if text is None:
+                continue
+            if doc.get("spacy") is not None:
+                try:
+                    ents = doc_ents(bytes_to_doc(doc["spacy"], nlp.vocab))
+                except Exception as e:
+                    print(f"Post with pid='{doc['pid']}' has an unreadable parse: {e}")
+                else:
+                    unpiped.append(update(doc, {"ents": ents}))
+                    report.from_parses += 1
+                    write_unpiped(batch_size)
+                    continue
+
+            flagged = matcher.matches(text)
+            if flagged:
+                report.flagged += 1
+            else:
+                report.skipped += 1
+                if rand.random() >= audit_rate:
+                    unpiped.append(update(doc, {"gazetteer_skipped": True}))
+                    write_unpiped(batch_size)
+                    continue
+                report.audited += 1
+            chunks = split_text(text, max_chars) if max_chars else [text]
+            for chunk in chunks:
+                yield chunk, ((doc, flagged), len(chunks))
+
+    pipes = [name for name in NER_PIPES if name in nlp.pipe_names]
+    with nlp.select_pipes(enable=pipes):
+        parses = nlp.pipe(texts(), as_tuples=True, batch_size=batch_size, n_process=n_process)
+        for batch in chunked(tqdm.tqdm(merge_chunks(parses)), batch_size):
+            updates = []
+            for parse, ((doc, flagged), _) in batch:
+                ents = doc_ents(parse)
+                if any(ent["label"] in LOCATION_LABELS for ent in ents):
+                    if flagged:
+                        report.found += 1
+                    else:
+                        report.missed += 1
+                updates.append(update(doc, {"ents": ents}))
+            collection.bulk_write(updates, ordered=False)
+    write_unpiped()
+
+    report.seconds = time.perf_counter() - start
+    print(report)
+    return report
+
+
+def run_spacy_shards(
+    nlp: English,
+    n_shards: int = N_SHARDS,
+    batch_size: int = SPACY_BATCH_SIZE,
+    n_process: int = N_PROCESS,
+    leases: Optional[ShardLeases] = None,
+    worker: Optional[str] = None,
+    store: Optional[ParseStore] = None,
+    verify: bool = False,
+) -> SpacyReport:
+    """
+    Parse unparsed posts as one of any number of workers sharing pid-range shards.
+
+    The first worker of a round splits the unparsed posts into shards, then
+    every worker leases shards until none are left, renewing its lease after
+    each batch it writes. A worker that loses a lease, because it stalled past
+    its expiry and another worker reclaimed the shard, stops parsing it and
+    leaves its status to the new holder.
+
+    :param n_shards: the number of shards to split a new round into
+    :param leases: the shard leases, with the default lease length if not given
+    :param worker: the name recorded on leased shards, this host and process if not given
+    :param store: the store to put parses in, or None to store them on their posts
+    :param verify: also hash the text of every parsed post, re-parsing those that changed
+    """
+    leases = leases or ShardLeases()
+    worker = worker or worker_name()
+    if leases.plan(n_shards, unparsed_query(model_name(nlp), verify=verify)):
+        print(f"Planned {n_shards} spacy shards .....")
+
+    total = SpacyReport()
+    while True:
+        shard = leases.lease(worker)
+        if shard is None:
+            break
+
+        held = True
+
+        def renew(report: SpacyReport) -> bool:
+            nonlocal held
+            held = leases.renew(shard["shard"], worker, report.parsed)
+            return held
+
+        try:
+            report = add_spacy_to_mongo(nlp, batch_size, n_process, verify=verify, store=store,
+                                        pid_range=(shard.get("lo"), shard.get("hi")),
+                                        on_batch=renew)
+        except Exception as e:
+            print(f"Shard {shard['shard']} failed: {e}")
+            leases.fail(shard["shard"], worker, str(e))
+            continue
+        total += report
+        if not held or not leases.complete(shard["shard"], worker, report.parsed,
+                                           report.seconds):
+            print(f"Lost the lease on shard {shard['shard']}")
+
+    print(f"{worker}: {total}")
+    print(f"Shards: {leases.progress()}")
+    return total
+
 
-    return len(post_subsets)
+def bytes_to_doc(data: bytes, vocab: Vocab) -> Doc:
+    """Convert bytes data to a spacy doc in a vocab, whatever format the parse is stored in."""
+    if is_reference(data):
+        data = load_parse(data)
+    if is_compact(data):
+        doc_bin = DocBin().from_bytes(bytes(data[len(COMPACT_PREFIX):]))
+        return next(doc_bin.get_docs(vocab))
+    return Doc(vocab).from_bytes(bytes(data))
 
 
 def bytes_to_spacy(data: bytes, nlp: English) -> Doc:
-    """Convert bytes data to a spacy doc."""
-    doc = Doc(nlp.vocab).from_bytes(data)
-    return doc
+    """Convert bytes data to a spacy doc, whatever format the parse is stored in."""
+    return bytes_to_doc(data, nlp.vocab)
 
 
 def literal_bytes_to_spacy(data: str, nlp: English) -> Doc:
@@ -1,8 +1,14 @@
 """Stores project constants and utility functions."""
+import itertools as it
 import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, Future, wait
 from dataclasses import dataclass
 from datetime import datetime
-from typing import List, Optional, Union
+from typing import (TYPE_CHECKING, Any, Callable, Dict, Iterable, Iterator, List, Optional,
+                    Tuple, Type, TypeVar)
 
 import mongoengine
 import pymongo
@@ -11,18 +17,27 @@ import spacy
 from dotenv import load_dotenv
 from mongoengine import connect
 from praw import Reddit
-from praw.models import Comment, Submission
 from psaw import PushshiftAPI
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
 from spacy.lang.en import English
 
+from src.encoders import encode_document
+from src.history_queue import HistoryQueue
 from src.schema import CommentPost, Post, SubmissionPost, User
 
+if TYPE_CHECKING:
+    from src.dedupe import PidFilter
+
 # --- Utility Constants ---
 # project constants
 PROJ_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)))
 ROOT_DIR = os.path.abspath(os.path.join(PROJ_DIR, '..'))
 SUBR_NAMES = ["opiates", "heroin"]
 SUB_LIMIT = 1000
+BULK_BATCH_SIZE = 1000
+USER_CACHE_SIZE = 100000
+PSAW_RATE_LIMIT_PER_MINUTE = 120
 GEONAMES_KEY = os.getenv("GEONAMES_KEY")
 MAPBOX_KEY = os.getenv("MAPBOX_KEY")
 GOOGLE_KEY = os.getenv("GOOGLE_KEY")
@@ -30,6 +45,117 @@ GOOGLE_KEY = os.getenv("GOOGLE_KEY")
 # load local environment variables
 load_dotenv(os.path.join(PROJ_DIR, "..", ".env"))
 
+T = TypeVar("T")
+
+# --- Utility Classes ---
+
+
+@dataclass
+class BatchReport:
+    """Counts for a single batch of documents written to mongo."""
+
+    inserted: int = 0
+    duplicates: int = 0
+    invalid: int = 0
+    seconds: float = 0.0
+
+    def __add__(self, other: "BatchReport") -> "BatchReport":
+        return BatchReport(
+            self.inserted + other.inserted,
+            self.duplicates + other.duplicates,
+            self.invalid + other.invalid,
+            self.seconds + other.seconds,
+        )
+
+    def __str__(self) -> str:
+        rate = self.total / self.seconds if self.seconds else 0.0
+        return (f"{self.inserted} inserted, {self.duplicates} duplicates, "
+                f"{self.invalid} invalid ({rate:.0f} docs/s)")
+
+    @property
+    def total(self) -> int:
+        """The number of documents seen in this batch."""
+        return self.inserted + self.duplicates + self.invalid
+
+
+class UserResolver:
+    """
+    Resolves usernames to stored Users, creating any missing users in bulk.
+
+    Resolved users are kept in a bounded LRU cache, so converting many posts
+    by the same authors only touches mongo the first time an author is seen.
+    Users it creates are queued for a history backfill unless queue_histories
+    is False.
+    """
+
+    def __init__(self, max_size: int = USER_CACHE_SIZE, queue_histories: bool = True):
+        self.max_size = max_size
+        self.cache: "OrderedDict[str, User]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.history_queue = HistoryQueue() if queue_histories else None
+
+    def _remember(self, users: Iterable[User]) -> None:
+        with self.lock:
+            for user in users:
+                self.cache[user.username] = user
+                self.cache.move_to_end(user.username)
+            while len(self.cache) > self.max_size:
+                self.cache.popitem(last=False)
+
+    def resolve(self, usernames: Iterable[Optional[str]]) -> Dict[str, User]:
+        """
+        Return a map from each distinct username to its User.
+
+        Uncached usernames are looked up with a single $in query and any that
+        do not exist are created with a single unordered bulk upsert.
+        """
+        names = {name for name in usernames if isinstance(name, str)}
+        users = {}
+        with self.lock:
+            for name in names:
+                if name in self.cache:
+                    self.cache.move_to_end(name)
+                    users[name] = self.cache[name]
+
+        missing = names - set(users)
+        if missing:
+            collection = User._get_collection()
+            for doc in collection.find({"username": {"$in": list(missing)}}):
+                users[doc["username"]] = User._from_son(doc)
+
+            to_create = sorted(missing - set(users))
+            if to_create:
+                result = collection.bulk_write(
+                    [
+                        UpdateOne({"username": name},
+                                  {"$setOnInsert": encode_document(User, {"username": name})},
+                                  upsert=True)
+                        for name in to_create
+                    ],
+                    ordered=False,
+                )
+                for idx, _id in result.upserted_ids.items():
+                    users[to_create[idx]] = User(id=_id, username=to_create[idx])
+                if self.history_queue is not None and result.upserted_ids:
+                    self.history_queue.enqueue(to_create[idx] for idx in result.upserted_ids)
+
+                # users created concurrently by another writer were matched, not upserted
+                raced = [name for name in to_create if name not in users]
+                if raced:
+                    for doc in collection.find({"username": {"$in": raced}}):
+                        users[doc["username"]] = User._from_son(doc)
+
+            self._remember(users[name] for name in missing)
+
+        return users
+
+    def get(self, username: Optional[str]) -> Optional[User]:
+        """Return the user for a single username, creating it if needed."""
+        if not isinstance(username, str):
+            return None
+        return self.resolve([username])[username]
+
+
 # --- Utility Functions ---
 
 
@@ -66,9 +192,22 @@ def get_praw() -> Reddit:
     )
 
 
-def get_psaw(praw: Reddit) -> PushshiftAPI:
-    """Allows for lazy connection to Psaw."""
-    return PushshiftAPI(praw)
+def get_psaw(praw: Optional[Reddit], base_url: Optional[str] = None) -> PushshiftAPI:
+    """
+    Allows for lazy connection to Psaw.
+
+    If a base url is given, or set as PUSHSHIFT_URL, Pushshift requests are sent
+    there instead, e.g. to a local fake server. Objects looked up through praw
+    still come from Reddit.
+    """
+    base_url = base_url or os.getenv("PUSHSHIFT_URL")
+    if not base_url:
+        return PushshiftAPI(praw)
+    psaw = PushshiftAPI(praw, rate_limit_per_minute=PSAW_RATE_LIMIT_PER_MINUTE)
+    # psaw formats the url twice, first with the domain and then with the endpoint
+    psaw._base_url = base_url.rstrip("/") + "/{{endpoint}}"
+    return psaw
+
 
 def get_nlp() -> English:
     """Allows lazy access of nlp module."""
@@ -91,16 +230,129 @@ def last_date(subreddit: Optional[str] = None) -> datetime:
     return base_query.order_by("-datetime").first().datetime
 
 
-def posts_to_mongo(posts: List[Post]) -> None:
-    """Store the given posts in mongo."""
+def chunked(items: Iterable[T], size: int) -> Iterator[List[T]]:
+    """Lazily split an iterable into lists of at most the given size."""
+    iterator = iter(items)
+    chunk = list(it.islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(it.islice(iterator, size))
+
+
+def bounded_map(
+    submit: Callable[[T], Future], items: Iterable[T], max_in_flight: int
+) -> Iterator[Tuple[T, Future]]:
+    """
+    Lazily submit work for each item, yielding items with their futures as they finish.
+
+    At most max_in_flight items are pulled from the iterable and running at
+    once, so memory stays bounded however many items there are.
+
+    :param submit: submits the work for an item to an executor, returning its future
+    """
+    remaining = iter(items)
+    futures: Dict[Future, T] = {}
+    while True:
+        for item in remaining:
+            futures[submit(item)] = item
+            if len(futures) >= max_in_flight:
+                break
+        if not futures:
+            return
+
+        done, _ = wait(futures, return_when=FIRST_COMPLETED)
+        for future in done:
+            yield futures.pop(future), future
+
+
+def bulk_upsert_docs(docs: List[Dict[str, Any]], key: str = "pid") -> BatchReport:
+    """
+    Insert raw post documents in a single unordered bulk write.
+
+    Documents are upserted by the given key with $setOnInsert, so documents
+    already stored in mongo are counted as duplicates and left untouched.
+    """
+    report = BatchReport()
+    if not docs:
+        return report
+    start = time.perf_counter()
+    requests = [UpdateOne({key: doc[key]}, {"$setOnInsert": doc}, upsert=True) for doc in docs]
+    try:
+        result = Post._get_collection().bulk_write(requests, ordered=False)
+        details = result.bulk_api_result
+    except BulkWriteError as e:
+        # concurrent writers can race on the unique index; the loser is a duplicate
+        details = e.details
+        report.duplicates += sum(1 for err in details["writeErrors"] if err["code"] == 11000)
+        report.invalid += sum(1 for err in details["writeErrors"] if err["code"] != 11000)
+    report.inserted += details["nUpserted"]
+    report.duplicates += details["nMatched"]
+    report.seconds = time.perf_counter() - start
+    return report
+
+
+def bulk_posts_to_mongo(posts: Iterable[Post], batch_size: int = BULK_BATCH_SIZE) -> BatchReport:
+    """
+    Store the given posts in mongo using unordered bulk writes.
+
+    :param posts: an iterable of Post objects, consumed lazily
+    :param batch_size: the number of posts sent to mongo per round trip
+
+    :returns: the summed counts over all batches
+    """
+    total = BatchReport()
+    for i, batch in enumerate(chunked(posts, batch_size)):
+        docs = []
+        n_invalid = 0
+        for post in batch:
+            try:
+                post.validate()
+                docs.append(post.to_mongo().to_dict())
+            except mongoengine.errors.ValidationError as e:
+                print(f"Error adding post {post.pid}: {e}")
+                n_invalid += 1
+        report = bulk_upsert_docs(docs)
+        report.invalid += n_invalid
+        print(f"Batch {i}: {report}")
+        total += report
+    print(f"{total.inserted} posts added to mongo.")
+    return total
+
+
+def bulk_docs_to_mongo(
+    docs: Iterable[Dict[str, Any]], batch_size: int = BULK_BATCH_SIZE
+) -> BatchReport:
+    """
+    Store raw Post documents in mongo using unordered bulk writes.
+
+    :param docs: an iterable of encoded Post documents, consumed lazily
+    :param batch_size: the number of documents sent to mongo per round trip
+
+    :returns: the summed counts over all batches
+    """
+    total = BatchReport()
+    for i, batch in enumerate(chunked(docs, batch_size)):
+        report = bulk_upsert_docs(batch)
+        print(f"Batch {i}: {report}")
+        total += report
+    print(f"{total.inserted} posts added to mongo.")
+    return total
+
+
+def posts_to_mongo(posts: Iterable[Post], batch_size: Optional[int] = None) -> None:
+    """
+    Store the given posts in mongo.
+
+    If a batch size is given, posts are written with unordered bulk writes
+    rather than one save per post. New authors were already queued for a
+    history backfill when their users were created, so writes never wait on one.
+    """
+    if batch_size:
+        bulk_posts_to_mongo(posts, batch_size)
+        return
+
     n_posted = 0
     for post in posts:
-        # add full user history if user not in db
-        if isinstance(post.user, User):
-            username = post.user.username
-            if User.objects(username=username).count() == 0:
-                print(f'Adding {username} posting history .....')
-                get_users_histories([username], psaw)
         try:
             post.save()
             n_posted += 1
@@ -110,60 +362,44 @@ def posts_to_mongo(posts: List[Post]) -> None:
 
 
 def user_from_username(username: Optional[str]) -> Optional[User]:
-    """Return the user if it exists, else create it and return."""
+    """Return the user if it exists, else create it, queue its history and return."""
     user = None
     if isinstance(username, str):
         query = User.objects(username=username)
         if query.count() == 0:
             user = User(username=username)
             user.save()
+            HistoryQueue().enqueue([username])
         else:
             user = query.first()
 
     return user
 
 
-def sub_comm_to_post(sub_comm: Union[Submission, Comment], is_sub: bool) -> Post:
-    """Convert a Praw Submission or Comment to a Post object."""
-    # convert username to user
-    username = None if not sub_comm.author else sub_comm.author.name
-    user = user_from_username(username)
-
-    # store attributes common to both submission and comments
-    kwargs = {
-        "pid": sub_comm.id,
-        "user": user,
-        "datetime": utc_to_dt(sub_comm.created_utc),
-        "subreddit": sub_comm.subreddit.display_name,
-    }
-
-    # assign particular attributes and return the proper post type
-    if is_sub:
-        kwargs["url"] = sub_comm.url
-        kwargs["text"] = sub_comm.selftext
-        kwargs["title"] = sub_comm.title
-        kwargs["num_comments"] = sub_comm.num_comments
-        post = SubmissionPost
-    else:
-        kwargs["text"] = sub_comm.body
-        kwargs["parent_id"] = sub_comm.parent_id
-        post = CommentPost
+def post_username(sub_comm: Any) -> Optional[str]:
+    """Return the author name of a Praw or psaw Submission or Comment."""
+    author = sub_comm.author
+    if not author:
+        return None
+    # psaw objects hold the name itself rather than a praw Redditor
+    return author if isinstance(author, str) else author.name
 
-    return post(**kwargs)
 
+def post_subreddit(sub_comm: Any) -> Optional[str]:
+    """Return the subreddit name of a Praw or psaw Submission or Comment."""
+    return getattr(sub_comm.subreddit, "display_name", sub_comm.subreddit)
 
-def psaw_obj_to_post(sub_comm, is_sub: bool) -> Post:
-    """Convert a Praw Submission or Comment to a Post object."""
-    # convert username to user
-    username = sub_comm.author
-    user = user_from_username(username)
 
+def post_fields(
+    sub_comm: Any, is_sub: bool, user: Optional[User], subreddit: Optional[str]
+) -> Tuple[Type[Post], Dict[str, Any]]:
+    """Return the Post type and field values for a Submission or Comment."""
     # store attributes common to both submission and comments
     kwargs = {
         "pid": sub_comm.id,
         "user": user,
         "datetime": utc_to_dt(sub_comm.created_utc),
-        "subreddit": sub_comm.subreddit,
+        "subreddit": subreddit,
     }
 
     # assign particular attributes and return the proper post type
@@ -172,10 +408,47 @@ def psaw_obj_to_post(sub_comm, is_sub: bool) -> Post:
         kwargs["text"] = sub_comm.selftext
         kwargs["title"] = sub_comm.title
         kwargs["num_comments"] = sub_comm.num_comments
-        post = SubmissionPost
-    else:
-        kwargs["text"] = sub_comm.body
-        kwargs["parent_id"] = sub_comm.parent_id
-        post = CommentPost
+        return SubmissionPost, kwargs
+
+    kwargs["text"] = sub_comm.body
+    kwargs["parent_id"] = sub_comm.parent_id
+    return CommentPost, kwargs
+
 
+def build_post(post: Type[Post], kwargs: Dict[str, Any]) -> Post:
+    """Return an unsaved Post object of the given type."""
     return post(**kwargs)
+
+
+def convert_posts(
+    sub_comms: List[Any],
+    is_sub: bool,
+    build: Callable[[Type[Post], Dict[str, Any]], T],
+    resolver: Optional[UserResolver] = None,
+    pid_filter: Optional["PidFilter"] = None,
+) -> List[T]:
+    """
+    Convert a batch of Praw or psaw Submissions or Comments, resolving their users at once.
+
+    Posts that fail validation are skipped.
+
+    :param build: builds a post from its type and field values, build_post for Post
+        objects or encode_document for raw Post documents
+    :param resolver: an optional user resolver shared across batches
+    :param pid_filter: an optional filter dropping already stored posts before conversion
+    """
+    if pid_filter is not None:
+        sub_comms = pid_filter.filter_new(sub_comms)
+    resolver = resolver or UserResolver()
+    users = resolver.resolve(post_username(s) for s in sub_comms)
+
+    posts = []
+    for sub_comm in sub_comms:
+        username = post_username(sub_comm)
+        user = users.get(username) if username is not None else None
+        post, kwargs = post_fields(sub_comm, is_sub, user, post_subreddit(sub_comm))
+        try:
+            posts.append(build(post, kwargs))
+        except mongoengine.errors.ValidationError as e:
+            print(f"Error adding post {kwargs['pid']}: {e}")
+    return posts
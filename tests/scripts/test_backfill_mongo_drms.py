@@ -0,0 +1,61 @@
+"""Tests for migrating the legacy praw collection."""
+import os
+import tempfile
+import unittest
+from datetime import datetime
+
+import mongomock
+from mongoengine import connect, disconnect
+
+from src.journal import Journal
+from src.schema import CommentPost, Post, SubmissionPost, User
+from src.scripts.backfill_mongo_drms import praw_to_post
+
+
+class TestPrawToPost(unittest.TestCase):
+    """Tests for the resumable legacy migration."""
+
+    @classmethod
+    def setUpClass(cls):
+        connect('mongoenginetest', host='mongomock://localhost')
+
+    @classmethod
+    def tearDownClass(cls):
+        disconnect()
+
+    def test_praw_to_post(self) -> None:
+        """Test that legacy documents are migrated once and a rerun resumes after them."""
+        legacy = mongomock.MongoClient()["drug_pricing"]["praw"]
+        CommentPost(pid="drms_stored", text="already migrated").save()
+        legacy.insert_many([
+            {"pid": "drms_sub", "username": "drms_user", "url": "url", "title": "title",
+             "num_comments": 2, "time": datetime(2019, 1, 1), "subr": "opiates"},
+            {"pid": "drms_comm", "username": "drms_user", "parent_id": "t3_drms_sub",
+             "text": "text"},
+            {"pid": "drms_comm", "username": "drms_user", "parent_id": "t3_drms_sub"},
+            {"pid": "drms_stored", "parent_id": "t3_drms_sub", "text": "legacy"},
+            {"username": "no_pid_user"},
+        ])
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            checkpoint_fn = os.path.join(tmp_dir, "drms.jsonl")
+            report = praw_to_post(1, batch_size=2, checkpoint_fn=checkpoint_fn,
+                                  collection=legacy)
+
+            self.assertEqual((report.inserted, report.duplicates, report.invalid), (2, 2, 1))
+            sub = Post.objects(pid="drms_sub").first()
+            self.assertIsInstance(sub, SubmissionPost)
+            self.assertEqual((sub.title, sub.url, sub.user.username), ("title", "url", "drms_user"))
+            self.assertIsInstance(Post.objects(pid="drms_comm").first(), CommentPost)
+            self.assertEqual(Post.objects(pid="drms_stored").first().text, "already migrated")
+            self.assertEqual(User.objects(username="drms_user").count(), 1)
+            self.assertEqual(User.objects(username="no_pid_user").count(), 0)
+
+            legacy.insert_one({"pid": "drms_new", "parent_id": "t3_drms_sub"})
+            report = praw_to_post(1, batch_size=2, checkpoint_fn=checkpoint_fn,
+                                  collection=legacy)
+
+            self.assertEqual((report.inserted, report.total), (1, 1))
+            with Journal(checkpoint_fn) as checkpoint:
+                last_id = legacy.find_one({"pid": "drms_new"})["_id"]
+                self.assertEqual(checkpoint.get("frontier")["last_id"], str(last_id))
@@ -0,0 +1,50 @@
+"""Tests for compacting stored spacy parses."""
+import unittest
+
+import spacy
+from mongoengine import connect, disconnect
+
+from src.schema import CommentPost, Post
+from src.scripts.compact_spacy import compact_spacy
+from src.tasks.spacy import bytes_to_spacy, is_compact, spacy_to_bytes
+
+
+class TestCompactSpacy(unittest.TestCase):
+    """Tests for migrating full parses to compact ones."""
+
+    @classmethod
+    def setUpClass(cls):
+        connect('mongoenginetest', host='mongomock://localhost')
+        cls.nlp = spacy.blank("en")
+        cls.nlp.add_pipe("entity_ruler").add_patterns([{"label": "GPE", "pattern": "Boston"}])
+
+    @classmethod
+    def tearDownClass(cls):
+        disconnect()
+
+    def test_compact_spacy(self) -> None:
+        """Test that full parses are compacted, keep their text and have entities stored."""
+        Post.objects.delete()
+        texts = [f"moved to Boston in {year}" for year in range(2015, 2020)]
+        for i, text in enumerate(texts):
+            CommentPost(pid=f"cs_{i}", text=text, spacy=self.nlp(text).to_bytes()).save()
+        CommentPost(pid="cs_compact", text="Boston",
+                    spacy=spacy_to_bytes(self.nlp("Boston"))).save()
+        CommentPost(pid="cs_invalid", text="bad", spacy=b"not a doc").save()
+
+        report = compact_spacy(batch_size=2)
+        self.assertEqual((report.posts, report.compacted, report.ents, report.invalid),
+                         (7, 5, 6, 1))
+        self.assertLess(report.bytes_after, report.bytes_before)
+
+        for i, text in enumerate(texts):
+            data = Post.objects(pid=f"cs_{i}").first().spacy
+            self.assertTrue(is_compact(data))
+            doc = bytes_to_spacy(data, self.nlp)
+            self.assertEqual((doc.text, [(e.text, e.label_) for e in doc.ents]),
+                             (text, [("Boston", "GPE")]))
+            self.assertEqual([e.text for e in Post.objects(pid=f"cs_{i}").first().ents],
+                             ["Boston"])
+
+        report = compact_spacy()
+        self.assertEqual((report.compacted, report.ents), (0, 0))
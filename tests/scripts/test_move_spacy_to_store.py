@@ -0,0 +1,36 @@
+"""Tests for moving spacy parses off their posts."""
+import unittest
+
+from mongoengine import connect, disconnect
+
+from src.parse_store import MongoParseStore, is_reference, load_parse
+from src.schema import CommentPost, Post
+from src.scripts.move_spacy_to_store import move_spacy_to_store
+
+
+class TestMoveSpacyToStore(unittest.TestCase):
+    """Tests for the parse store migration."""
+
+    @classmethod
+    def setUpClass(cls):
+        connect('mongoenginetest', host='mongomock://localhost')
+
+    @classmethod
+    def tearDownClass(cls):
+        disconnect()
+
+    def test_move(self) -> None:
+        """Test that inline parses are moved once and stay readable through their posts."""
+        Post.objects.delete()
+        for i in range(5):
+            CommentPost(pid=f"mv_{i}", text="text", spacy=f"parse {i}".encode()).save()
+        CommentPost(pid="mv_unparsed", text="text").save()
+
+        report = move_spacy_to_store(MongoParseStore(), batch_size=2)
+        self.assertEqual((report.posts, report.moved, report.bytes_moved), (5, 5, 35))
+        for i in range(5):
+            data = Post.objects(pid=f"mv_{i}").first().spacy
+            self.assertTrue(is_reference(data))
+            self.assertEqual(load_parse(data), f"parse {i}".encode())
+
+        self.assertEqual(move_spacy_to_store(MongoParseStore()).moved, 0)
@@ -0,0 +1,58 @@
+"""Tests for filling missing post fields from pushshift."""
+import unittest
+from datetime import datetime
+from types import SimpleNamespace
+
+from mongoengine import connect, disconnect
+
+from src.schema import CommentPost, Post, SubmissionPost
+from src.scripts.update_post_fields import fill_all_posts
+
+
+class FakeClient:
+    """A stand-in for PushshiftClient serving by-id lookups, recording each batch."""
+
+    def __init__(self, objs):
+        self.objs = {obj.id: obj for obj in objs}
+        self.batches = []
+
+    def search_ids(self, kind, ids):
+        self.batches.append((kind, ids))
+        return [self.objs[pid] for pid in ids if pid in self.objs]
+
+
+class TestFillAllPosts(unittest.TestCase):
+    """Tests for the batched gap filler."""
+
+    @classmethod
+    def setUpClass(cls):
+        connect('mongoenginetest', host='mongomock://localhost')
+
+    @classmethod
+    def tearDownClass(cls):
+        disconnect()
+
+    def test_fill_all_posts(self) -> None:
+        """Test that only missing fields are filled, in batched bulk updates."""
+        SubmissionPost(pid="fill_s0").save()
+        SubmissionPost(pid="fill_s1", title="kept", datetime=datetime(2019, 1, 1)).save()
+        SubmissionPost(pid="fill_s2", title="kept").save()
+        SubmissionPost(pid="fill_s3").save()
+        CommentPost(pid="fill_c0").save()
+        client = FakeClient([
+            SimpleNamespace(id="fill_s0", title="title", created_utc=1594339200),
+            SimpleNamespace(id="fill_s1", title="replaced", created_utc=1594339200),
+            SimpleNamespace(id="fill_s2", title="replaced", created_utc=1594339200),
+            SimpleNamespace(id="fill_c0", title=None, created_utc=1594339200),
+        ])
+
+        report = fill_all_posts(client, n_workers=2, batch_size=2)
+
+        self.assertEqual((report.missing, report.posts, report.fields), (4, 3, 4))
+        s0 = Post.objects(pid="fill_s0").first()
+        self.assertEqual((s0.title, s0.datetime), ("title", datetime(2020, 7, 10)))
+        s2 = Post.objects(pid="fill_s2").first()
+        self.assertEqual((s2.title, s2.datetime), ("kept", datetime(2020, 7, 10)))
+        self.assertIsNone(Post.objects(pid="fill_s3").first().title)
+        self.assertEqual(Post.objects(pid="fill_c0").first().datetime, datetime(2020, 7, 10))
+        self.assertEqual(sorted(len(ids) for _, ids in client.batches), [1, 1, 2])
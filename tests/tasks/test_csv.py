@@ -1,8 +1,14 @@
 import os
+import tempfile
+import unittest
+from datetime import datetime
 from typing import List
 
-from src.schema import Post
-from src.tasks.csv import COMM_COLNAMES, SUB_COLNAMES, extract_csv
+from mongoengine import connect, disconnect
+
+from src.schema import Post, SubmissionPost, User
+from src.tasks.csv import (COMM_COLNAMES, SUB_COLNAMES, extract_csv, import_csv,
+                           import_csv_dir, stream_csv)
 from src.utils import PROJ_DIR
 from tests.tasks.test_praw import TestExtractPraw
 
@@ -25,3 +31,73 @@ class TestExtractCsv(TestExtractPraw):
         threads = extract_csv(thread_fp, SUB_COLNAMES)
         comments = extract_csv(comm_fp, COMM_COLNAMES)
         return threads + comments
+
+
+class TestImportCsv(unittest.TestCase):
+    """Tests for chunked, vectorized csv ingestion."""
+
+    @classmethod
+    def setUpClass(cls):
+        connect('mongoenginetest', host='mongomock://localhost')
+
+    @classmethod
+    def tearDownClass(cls):
+        disconnect()
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.thread_fp = os.path.join(self.tmp_dir.name, "threads.csv")
+        with open(self.thread_fp, "w") as thread_file:
+            thread_file.write(
+                "csvs1,http://a,3,short,csv_author,title one,body one,1594339200.9\n"
+                "csvs2,http://b,,short,,title two,,1594339260\n"
+                "csvs1,http://a,3,short,csv_author,title one,body one,1594339200.9\n"
+                "csvs3,http://c,1,short,csv_author,title three,body three,1594339320\n"
+            )
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_stream_csv(self) -> None:
+        """Test that rows are converted column-wise into bounded chunks of documents."""
+        chunks = list(stream_csv(self.thread_fp, SUB_COLNAMES, chunksize=2))
+
+        self.assertEqual([len(c) for c in chunks], [2, 2])
+        first, second = chunks[0]
+        self.assertEqual(first["_cls"], SubmissionPost._class_name)
+        self.assertEqual(first["datetime"], datetime(2020, 7, 10))
+        self.assertEqual(first["num_comments"], 3)
+        self.assertEqual(first["subreddit"], "opiates")
+        self.assertNotIn("user", second)
+        self.assertNotIn("text", second)
+
+    def test_import_csv(self) -> None:
+        """Test that imported documents load as the matching Post subclass."""
+        report = import_csv(self.thread_fp, "s", chunksize=2)
+
+        self.assertEqual(report.inserted, 3)
+        self.assertEqual(report.duplicates, 1)
+        post = Post.objects(pid="csvs3").first()
+        self.assertIsInstance(post, SubmissionPost)
+        self.assertEqual(post.title, "title three")
+        self.assertEqual(post.user, User.objects(username="csv_author").first())
+
+    def test_import_csv_dir(self) -> None:
+        """Test that only new or changed files in a directory are imported."""
+        manifest_fn = os.path.join(self.tmp_dir.name, "manifest.jsonl")
+        other_fp = os.path.join(self.tmp_dir.name, "more-threads.csv")
+        with open(other_fp, "w") as other_file:
+            other_file.write("csvs3,http://c,1,short,csv_author,title three,body,1594339320\n")
+
+        report = import_csv_dir(self.tmp_dir.name, "s", n_workers=1, manifest_fn=manifest_fn)
+        self.assertEqual(report.inserted + report.duplicates, 5)
+        self.assertEqual(Post.objects(pid__startswith="csvs").count(), 3)
+
+        report = import_csv_dir(self.tmp_dir.name, "s", n_workers=1, manifest_fn=manifest_fn)
+        self.assertEqual(report.total, 0)
+
+        with open(other_fp, "a") as other_file:
+            other_file.write("csvs4,http://d,1,short,csv_author,title four,body,1594339380\n")
+        report = import_csv_dir(self.tmp_dir.name, "s", n_workers=1, manifest_fn=manifest_fn)
+        self.assertEqual(report.inserted, 1)
+        self.assertEqual(report.duplicates, 1)
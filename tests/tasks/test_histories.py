@@ -1,6 +1,182 @@
+import os
+import tempfile
 import unittest
+from datetime import datetime
+from types import SimpleNamespace
+
+from mongoengine import connect, disconnect
+
+from src.dedupe import PidFilter
+from src.fake_pushshift import FakePushshift, FakePushshiftServer
+from src.history_queue import HistoryQueue
+from src.leases import DONE
+from src.journal import Journal
+from src.pushshift import PushshiftClient, TokenBucket
+from src.schema import CommentPost, HistoryTask, Post, SubmissionPost, User
+from src.utils import utc_to_dt
+from src.tasks.histories import (drain_history_queue, get_users_histories,
+                                 get_users_histories_concurrent, refresh_users_histories)
+
+# posting histories served by the fake server, requests for "broken_user" fail
+RECORDS = {
+    "submission": [
+        {"id": f"hs{i}", "author": f"huser{i % 2}", "created_utc": 1600000000 + i,
+         "subreddit": "opiates", "title": "title", "selftext": "text", "url": "url",
+         "num_comments": 1}
+        for i in range(5)
+    ],
+    "comment": [
+        {"id": f"hc{i}", "author": f"huser{i % 2}", "created_utc": 1600000000 + i,
+         "subreddit": "heroin", "body": "text", "parent_id": "t3_hs0"}
+        for i in range(7)
+    ],
+}
+
+
+class HistoryPushshift(FakePushshift):
+    """Serves the records above, failing every search for "broken_user"."""
+
+    def search(self, kind, params):
+        if params.get("author") == "broken_user":
+            raise ValueError("pushshift is down")
+        return super().search(kind, params)
+
+
+class FakePsaw:
+    """A stand-in for PushshiftAPI serving the records above, failing for "broken_user"."""
+
+    def _search(self, kind: str, author: str, after: int = 0):
+        if author == "broken_user":
+            raise ConnectionError("pushshift is down")
+        for record in RECORDS[kind]:
+            if record["author"] == author and after < record["created_utc"]:
+                yield SimpleNamespace(**{
+                    **record, "author": SimpleNamespace(name=record["author"]),
+                    "subreddit": SimpleNamespace(display_name=record["subreddit"]),
+                })
+
+    def search_submissions(self, author: str, after: int = 0):
+        return self._search("submission", author, after)
+
+    def search_comments(self, author: str, after: int = 0):
+        return self._search("comment", author, after)
 
 
 class TestGetUsersHistories(unittest.TestCase):
     """Tests for retrieving full posting histories for multiple users."""
 
+    @classmethod
+    def setUpClass(cls):
+        connect('mongoenginetest', host='mongomock://localhost')
+        cls.server = FakePushshiftServer(HistoryPushshift()).__enter__()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.__exit__()
+        disconnect()
+
+    def setUp(self):
+        self.server.store = HistoryPushshift(RECORDS)
+
+    def test_concurrent_histories(self) -> None:
+        """Test that histories are fetched concurrently with per-user error isolation."""
+        client = PushshiftClient(self.server.base_url, limiter=TokenBucket(1000), page_size=2)
+
+        n_posts = get_users_histories_concurrent(
+            ["huser0", "broken_user", "huser1"], client, n_workers=2, batch_size=3
+        )
+
+        self.assertEqual(n_posts, {"huser0": 7, "huser1": 5})
+        self.assertEqual(SubmissionPost.objects(pid__startswith="hs").count(), 5)
+        self.assertEqual(CommentPost.objects(pid__startswith="hc").count(), 7)
+        huser0 = User.objects(username="huser0").first()
+        self.assertEqual(Post.objects(user=huser0).count(), 7)
+        self.assertEqual(User.objects(username="broken_user").count(), 0)
+
+    def test_resume_from_journal(self) -> None:
+        """Test that users recorded in the journal are skipped and new ones recorded."""
+        client = PushshiftClient(self.server.base_url, limiter=TokenBucket(1000))
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            journal_fn = os.path.join(tmp_dir, "users.jsonl")
+            with Journal(journal_fn) as journal:
+                journal.add("huser0", n_posts=7)
+
+            n_posts = get_users_histories_concurrent(
+                ["huser0", "huser1"], client, journal_fn=journal_fn
+            )
+
+            self.assertEqual(n_posts, {"huser1": 5})
+            with Journal(journal_fn) as journal:
+                self.assertEqual(journal.get("huser1"), {"n_posts": 5})
+
+    def test_sequential_failures_not_journaled(self) -> None:
+        """Test that users whose history could not be fetched are fetched again on resume."""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            journal_fn = os.path.join(tmp_dir, "users.jsonl")
+            get_users_histories(["huser1", "broken_user"], FakePsaw(), journal_fn=journal_fn)
+
+            with Journal(journal_fn) as journal:
+                self.assertEqual(list(journal), ["huser1"])
+                self.assertEqual(journal.get("huser1"), {"n_posts": 5})
+        self.assertEqual(Post.objects(pid__in=["hs1", "hc1"]).count(), 2)
+
+    def test_sequential_watermark_counts_filtered_posts(self) -> None:
+        """Test that posts a pid filter drops still advance the history watermark."""
+        get_users_histories(["huser1"], FakePsaw())
+        User.objects(username="huser1").update_one(unset__history_datetime=True)
+
+        get_users_histories(["huser1"], FakePsaw(), pid_filter=PidFilter.from_mongo())
+        self.assertEqual(User.objects(username="huser1").first().history_datetime,
+                         utc_to_dt(1600000005))
+
+    def test_drain_history_queue(self) -> None:
+        """Test that queued users are fetched, completed or released for a retry."""
+        client = PushshiftClient(self.server.base_url, limiter=TokenBucket(1000))
+        queue = HistoryQueue(max_attempts=2)
+        queue.enqueue(["huser1", "broken_user"])
+
+        n_posts = drain_history_queue(client, n_workers=2, queue=queue)
+
+        self.assertEqual(n_posts, {"huser1": 5})
+        self.assertEqual(HistoryTask.objects(username="huser1").first().status, DONE)
+        broken = HistoryTask.objects(username="broken_user").first()
+        self.assertEqual((broken.status, broken.attempts), ("pending", 1))
+        self.assertEqual(HistoryTask.objects(username__in=["huser0", "huser1"]).count(), 1)
+
+    def test_refresh_histories(self) -> None:
+        """Test that a refresh only fetches posts made since the user's watermark."""
+        client = PushshiftClient(self.server.base_url, limiter=TokenBucket(1000))
+        get_users_histories_concurrent(["huser0"], client)
+        self.assertEqual(User.objects(username="huser0").first().history_datetime,
+                         datetime(2020, 9, 13, 12, 26, 46))
+
+        new_comment = {"id": "hc_new", "author": "huser0", "created_utc": 1600000100,
+                       "subreddit": "heroin", "body": "text", "parent_id": "t3_hs0"}
+        self.server.store.add("comment", [new_comment])
+        User(username="huser_unseen").save()
+        deltas = refresh_users_histories(["huser0", "huser_unseen"], client)
+
+        self.assertEqual(deltas, {"huser0": 1, "huser_unseen": 0})
+        # users without posts keep no watermark, in case their posts are not indexed yet
+        self.assertIsNone(User.objects(username="huser_unseen").first().history_datetime)
+        self.assertEqual(User.objects(username="huser0").first().history_datetime,
+                         datetime(2020, 9, 13, 12, 28, 20))
+        self.assertEqual(CommentPost.objects(pid="hc_new").count(), 1)
+
+        late_comment = {**new_comment, "id": "hc_late", "author": "huser_unseen",
+                        "created_utc": 1600000050}
+        self.server.store.add("comment", [late_comment])
+        self.assertEqual(refresh_users_histories(["huser_unseen"], client), {"huser_unseen": 1})
+
+
+class TestTokenBucket(unittest.TestCase):
+    """Tests for the shared rate limiter."""
+
+    def test_acquire(self) -> None:
+        """Test that tokens beyond the capacity are throttled to the rate."""
+        bucket = TokenBucket(rate=100, capacity=1)
+        bucket.acquire()
+        bucket.tokens = 0
+        bucket.acquire()
+        self.assertLess(bucket.tokens, 1)
@@ -1,8 +1,64 @@
 """Tests for parsing data from Reddit."""
+import os
+import tempfile
 import unittest
-from datetime import datetime
+from datetime import datetime, timedelta
+from types import SimpleNamespace
 from mongoengine import connect, disconnect
 
+from src.schema import CommentPost, Post, SubmissionPost, Subreddit
+from src.tasks.praw import (extract_praw, extract_praw_sharded, register_subreddits, split_window,
+                            stream_praw, stream_praw_docs, update_subreddits)
+
+
+class FakePsaw:
+    """A stand-in for PushshiftAPI that records how many objects were pulled."""
+
+    def __init__(self, n_subs: int, n_comms: int):
+        self.n_subs = n_subs
+        self.n_comms = n_comms
+        self.n_pulled = 0
+
+    def _generate(self, n: int, is_sub: bool):
+        for i in range(n):
+            self.n_pulled += 1
+            obj = SimpleNamespace(
+                id=f"{'s' if is_sub else 'c'}{i}",
+                author=SimpleNamespace(name=f"author{i % 3}"),
+                created_utc=1576800000 + i,
+                subreddit=SimpleNamespace(display_name="opiates"),
+            )
+            if is_sub:
+                obj.url, obj.selftext, obj.title, obj.num_comments = "url", "text", "title", 0
+            else:
+                obj.body, obj.parent_id = "text", "t3_s0"
+            yield obj
+
+    def search_submissions(self, **kwargs):
+        return self._generate(self.n_subs, True)
+
+    def search_comments(self, **kwargs):
+        return self._generate(self.n_comms, False)
+
+
+class WindowedPsaw(FakePsaw):
+    """A stand-in for PushshiftAPI serving one comment per minute, failing once on request."""
+
+    def __init__(self, start: datetime, n_comms: int, fail_after: int = None):
+        super().__init__(0, 0)
+        self.start = int(start.timestamp())
+        self.n_comms = n_comms
+        self.fail_after = fail_after
+
+    def search_comments(self, after=None, before=None, **kwargs):
+        if after == self.fail_after:
+            self.fail_after = None
+            raise ConnectionError("pushshift is down")
+        for obj in self._generate(self.n_comms, False):
+            obj.created_utc = self.start + 60 * int(obj.id[1:])
+            if after < obj.created_utc and (before is None or obj.created_utc < before):
+                yield obj
+
 
 class TestExtractPraw(unittest.TestCase):
     """Tests for the extract_posts method."""
@@ -18,3 +74,119 @@ class TestExtractPraw(unittest.TestCase):
     # arbitrary date to test with
     date = datetime(2019, 12, 20)
     subreddit = "opiates"
+
+
+class TestStreamPraw(TestExtractPraw):
+    """Tests for lazily extracting posts from psaw."""
+
+    def test_stream_praw(self) -> None:
+        """Test that posts are pulled and converted lazily in bounded chunks."""
+        psaw = FakePsaw(5, 3)
+        chunks = stream_praw(psaw, self.subreddit, self.date, chunk_size=2)
+
+        first = next(chunks)
+        self.assertEqual(len(first), 2)
+        self.assertLessEqual(psaw.n_pulled, 3)
+
+        rest = list(chunks)
+        self.assertEqual([len(c) for c in rest], [2, 1, 2, 1])
+        self.assertTrue(all(isinstance(p, SubmissionPost) for p in first + rest[0] + rest[1]))
+        self.assertTrue(all(isinstance(p, CommentPost) for p in rest[2] + rest[3]))
+
+    def test_stream_praw_docs(self) -> None:
+        """Test that raw streaming yields the same chunks as Post documents."""
+        chunks = list(stream_praw_docs(FakePsaw(3, 2), self.subreddit, self.date, chunk_size=2))
+        pids = [[doc["pid"] for doc in chunk] for chunk in chunks]
+        self.assertEqual(pids, [["s0", "s1"], ["s2"], ["c0", "c1"]])
+        self.assertEqual({d["_cls"] for d in chunks[0] + chunks[2]},
+                         {"Post.SubmissionPost", "Post.CommentPost"})
+
+    def test_extract_praw(self) -> None:
+        """Test that extraction returns every converted post."""
+        posts = extract_praw(FakePsaw(4, 4), self.subreddit, self.date)
+        self.assertEqual(len(posts), 8)
+        self.assertEqual(posts[0].subreddit, self.subreddit)
+
+
+class TestExtractPrawSharded(TestExtractPraw):
+    """Tests for backfilling a time frame in concurrent windows."""
+
+    def test_split_window(self) -> None:
+        """Test that windows evenly and contiguously cover the time frame."""
+        windows = split_window(self.date, self.date + timedelta(hours=3), 3)
+        self.assertEqual(len(windows), 3)
+        self.assertEqual(windows[0][0], self.date)
+        self.assertEqual(windows[1][0], windows[0][1])
+        self.assertEqual(windows[2][1], self.date + timedelta(hours=3))
+
+    def test_extract_praw_sharded(self) -> None:
+        """Test that all windows are fetched and only failed windows are retried."""
+        start = datetime(2019, 1, 1)
+        end = start + timedelta(minutes=40)
+        # the second window starts a second early to include posts on its boundary
+        fail_after = int((start + timedelta(minutes=10, seconds=-1)).timestamp())
+        psaw = WindowedPsaw(start, 40, fail_after=fail_after)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            checkpoint_fn = os.path.join(tmp_dir, "checkpoint.jsonl")
+            report = extract_praw_sharded(psaw, self.subreddit, start, end, n_windows=4,
+                                          checkpoint_fn=checkpoint_fn, batch_size=3)
+            self.assertEqual(report.inserted, 29)
+
+            psaw.n_pulled = 0
+            report = extract_praw_sharded(psaw, self.subreddit, start, end, n_windows=4,
+                                          checkpoint_fn=checkpoint_fn, batch_size=3)
+            self.assertEqual(report.inserted, 10)
+            self.assertEqual(psaw.n_pulled, 40)
+
+        # every post strictly inside the time frame is stored, including window boundaries
+        self.assertEqual(Post.objects(pid__in=[f"c{i}" for i in range(40)]).count(), 39)
+
+    def test_extract_praw_sharded_resumes_without_end(self) -> None:
+        """Test that re-runs without an end time reuse the windows of the first run."""
+        start = datetime.now().replace(microsecond=0) - timedelta(minutes=40)
+        psaw = WindowedPsaw(start, 40)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            checkpoint_fn = os.path.join(tmp_dir, "checkpoint.jsonl")
+            extract_praw_sharded(psaw, "resume_subr", start, n_windows=4,
+                                 checkpoint_fn=checkpoint_fn, batch_size=3)
+            self.assertGreater(psaw.n_pulled, 0)
+
+            psaw.n_pulled = 0
+            report = extract_praw_sharded(psaw, "resume_subr", start, n_windows=4,
+                                          checkpoint_fn=checkpoint_fn, batch_size=3)
+            self.assertEqual((report.inserted, psaw.n_pulled), (0, 0))
+
+
+class TestUpdateSubreddits(TestExtractPraw):
+    """Tests for incrementally updating registered subreddits."""
+
+    def test_update_subreddits(self) -> None:
+        """Test that watermarks only advance for subreddits that were fully written."""
+        start = datetime(2018, 1, 1)
+        CommentPost(pid="upd_old", subreddit="upd_ok", datetime=start).save()
+        CommentPost(pid="upd_old2", subreddit="upd_down", datetime=start).save()
+        register_subreddits(["upd_ok", "upd_down", "upd_empty"])
+        register_subreddits(["upd_ok", "upd_new"], start_time=start)
+        self.assertEqual(Subreddit.objects(name__startswith="upd_").count(), 4)
+        self.assertEqual(Subreddit.objects(name="upd_ok").first().last_datetime, start)
+        self.assertEqual(Subreddit.objects(name="upd_new").first().last_datetime, start)
+
+        class RegistryPsaw(WindowedPsaw):
+            def search_comments(self, subreddit=None, **kwargs):
+                if subreddit == "upd_down":
+                    raise ConnectionError("pushshift is down")
+                for obj in super().search_comments(**kwargs):
+                    obj.id = f"upd{obj.id}"
+                    yield obj
+
+        reports = update_subreddits(RegistryPsaw(start, 5), n_workers=2, batch_size=2)
+
+        self.assertEqual(set(reports), {"upd_ok", "upd_new"})
+        self.assertEqual(reports["upd_ok"].inserted + reports["upd_new"].inserted, 4)
+        self.assertEqual(reports["upd_ok"].duplicates + reports["upd_new"].duplicates, 4)
+        self.assertEqual(Subreddit.objects(name="upd_ok").first().last_datetime,
+                         start + timedelta(minutes=4))
+        self.assertEqual(Subreddit.objects(name="upd_down").first().last_datetime, start)
+        self.assertIsNone(Subreddit.objects(name="upd_empty").first().last_datetime)
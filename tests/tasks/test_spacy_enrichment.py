@@ -0,0 +1,263 @@
+"""Tests for enriching mongo posts with spacy parses."""
+import os
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+import spacy
+from mongoengine import connect, disconnect
+
+from src.entities import get_user_ents
+from src.gazetteer import GazetteerMatcher
+from src.leases import DONE, LEASED
+from src.parse_store import DiskParseStore, MongoParseStore, is_reference
+from src.schema import CommentPost, Post, SpacyBlob, SpacyShard, SubmissionPost, User
+from src.shard_leases import ShardLeases
+from src.scripts.add_title_to_spacy import add_title_to_spacy
+from src.tasks.spacy import (add_location_ents, add_spacy_to_mongo, bytes_to_spacy,
+                             count_stale_posts, is_compact, model_name, run_spacy_shards,
+                             spacy_to_bytes, split_text, text_hash)
+
+
+class TestSpacyEnrichment(unittest.TestCase):
+    """Tests for parsing stored posts with a blank english model."""
+
+    @classmethod
+    def setUpClass(cls):
+        connect('mongoenginetest', host='mongomock://localhost')
+        cls.nlp = spacy.blank("en")
+        cls.nlp.add_pipe("entity_ruler").add_patterns([{"label": "GPE", "pattern": "Boston"}])
+
+    @classmethod
+    def tearDownClass(cls):
+        disconnect()
+
+    def setUp(self):
+        Post.objects.delete()
+        SubmissionPost(pid="sp_s0", title="Moving to Boston", text="any tips",
+                       datetime=datetime(2020, 1, 1)).save()
+        for i in range(5):
+            CommentPost(pid=f"sp_c{i}", text=f"comment number {i}").save()
+        CommentPost(pid="sp_parsed", text="already parsed", spacy=b"",
+                    spacy_model=model_name(self.nlp), spacy_hash=text_hash("already parsed")).save()
+        CommentPost(pid="sp_no_text").save()
+
+    def assert_parsed(self) -> None:
+        texts = {p.pid: bytes_to_spacy(p.spacy, self.nlp).text
+                 for p in Post.objects(pid__ne="sp_parsed", spacy__exists=True)}
+        self.assertEqual(texts, {"sp_s0": "Moving to Boston. any tips",
+                                 **{f"sp_c{i}": f"comment number {i}" for i in range(5)}})
+
+    def test_pipe(self) -> None:
+        """Test that every unparsed post with text is parsed in batches."""
+        report = add_spacy_to_mongo(self.nlp, batch_size=2)
+        self.assertEqual((report.parsed, report.too_large), (6, 0))
+        self.assert_parsed()
+
+    def test_pipe_processes(self) -> None:
+        """Test that posts are parsed the same way by forked processes."""
+        report = add_spacy_to_mongo(self.nlp, batch_size=2, n_process=2)
+        self.assertEqual(report.parsed, 6)
+        self.assert_parsed()
+
+    def test_write_back_spacy_only(self) -> None:
+        """Test that parses are written back without touching other fields."""
+        add_spacy_to_mongo(self.nlp)
+        post = SubmissionPost.objects(pid="sp_s0").first()
+        self.assertEqual((post.title, post.datetime), ("Moving to Boston", datetime(2020, 1, 1)))
+        self.assertEqual(bytes(Post.objects(pid="sp_parsed").first().spacy), b"")
+
+    def test_spill(self) -> None:
+        """Test that parses too large for their post are spilled and read back through it."""
+        with patch("src.tasks.spacy.MAX_SPACY_BYTES", 0), \
+                patch.object(MongoParseStore, "part_bytes", 50):
+            report = add_spacy_to_mongo(self.nlp)
+        self.assertEqual((report.parsed, report.spilled, report.too_large), (6, 6, 0))
+        self.assertGreater(SpacyBlob.objects(post="Post.SubmissionPost:sp_s0").count(), 1)
+        self.assertTrue(is_reference(SubmissionPost.objects(pid="sp_s0").first().spacy))
+        self.assert_parsed()
+
+        # a parse that fits on its post again replaces the spilled one
+        Post.objects(pid="sp_s0").update_one(set__text="any tips at all")
+        add_spacy_to_mongo(self.nlp, verify=True)
+        self.assertFalse(is_reference(SubmissionPost.objects(pid="sp_s0").first().spacy))
+        self.assertEqual(SpacyBlob.objects(post="Post.SubmissionPost:sp_s0").count(), 0)
+        self.assertGreater(SpacyBlob.objects(post="Post.CommentPost:sp_c0").count(), 0)
+
+    def test_chunks(self) -> None:
+        """Test that long texts are parsed in chunks with entity offsets of the whole text."""
+        text = "\n\n".join(f"Paragraph {i} about Boston. More words here." for i in range(40))
+        CommentPost(pid="sp_long", text=text).save()
+        report = add_spacy_to_mongo(self.nlp, max_chars=100)
+        self.assertEqual((report.parsed, report.chunked), (7, 1))
+
+        post = Post.objects(pid="sp_long").first()
+        self.assertEqual(bytes_to_spacy(post.spacy, self.nlp).text, text)
+        self.assertEqual(len(post.ents), 40)
+        self.assertTrue(all(text[e.start:e.end] == "Boston" for e in post.ents))
+
+    def test_split_text(self) -> None:
+        """Test that texts split on the largest boundaries that fit and join back together."""
+        text = "One. Two!  Three\n\nFour five six seven.\n \nsupercalifragilistic"
+        for max_chars in (5, 12, 30, 100):
+            chunks = split_text(text, max_chars)
+            self.assertEqual("".join(chunks), text)
+            self.assertTrue(all(0 < len(c) <= max_chars for c in chunks))
+        self.assertEqual(split_text(text, 30), ["One. Two!  Three\n\n",
+                                                "Four five six seven.\n \n",
+                                                "supercalifragilistic"])
+        self.assertEqual(split_text("short", 30), ["short"])
+
+    def test_titles(self) -> None:
+        """Test that already parsed submissions are re-parsed with their titles."""
+        SubmissionPost(pid="sp_s1", title="Title", text="body", spacy=b"").save()
+        report = add_title_to_spacy(self.nlp)
+        self.assertEqual(report.parsed, 7)
+        post = SubmissionPost.objects(pid="sp_s1").first()
+        self.assertEqual(bytes_to_spacy(post.spacy, self.nlp).text, "Title. body")
+
+    def test_compact(self) -> None:
+        """Test that parses are stored compactly unless full docs are asked for."""
+        add_spacy_to_mongo(self.nlp, attrs=None)
+        self.assertFalse(is_compact(Post.objects(pid="sp_c0").first().spacy))
+        self.assert_parsed()
+
+        Post.objects(pid="sp_c0").update_one(unset__spacy=True)
+        add_spacy_to_mongo(self.nlp)
+        self.assertTrue(is_compact(Post.objects(pid="sp_c0").first().spacy))
+        self.assert_parsed()
+
+    def test_ents(self) -> None:
+        """Test that entity spans are stored and looked up by user without parsing."""
+        user = User(username="sp_user").save()
+        CommentPost(pid="sp_ents", text="Boston again", user=user).save()
+        Post.objects(pid="sp_s0").update_one(set__user=user)
+        add_spacy_to_mongo(self.nlp)
+
+        self.assertEqual([(e.text, e.label, e.start, e.end)
+                          for e in SubmissionPost.objects(pid="sp_s0").first().ents],
+                         [("Boston", "GPE", 10, 16)])
+        self.assertEqual(Post.objects(pid="sp_c0").first().ents, [])
+        self.assertEqual(sorted(get_user_ents(user, "GPE")), ["boston", "boston"])
+        self.assertEqual(get_user_ents(user, "ORG"), [])
+
+    def test_location_ents(self) -> None:
+        """Test that only posts naming a place are parsed and the rest are marked as skipped."""
+        CommentPost(pid="sp_stored", text="back in Boston",
+                    spacy=spacy_to_bytes(self.nlp("back in Boston"))).save()
+        report = add_location_ents(self.nlp, GazetteerMatcher(["boston"]), batch_size=2,
+                                   audit_rate=0.0)
+        self.assertEqual((report.from_parses, report.flagged, report.skipped, report.found,
+                          report.audited), (1, 1, 6, 1, 0))
+        self.assertIsNone(report.recall)
+        self.assertAlmostEqual(report.skip_rate, 6 / 7)
+        self.assertEqual([(e.text, e.label) for e in Post.objects(pid="sp_s0").first().ents],
+                         [("Boston", "GPE")])
+        self.assertEqual([e.text for e in Post.objects(pid="sp_stored").first().ents], ["Boston"])
+        skipped = Post.objects(pid="sp_c0").first()
+        self.assertEqual((skipped.ents, skipped.gazetteer_skipped, skipped.spacy),
+                         (None, True, None))
+
+        # posts with entities or skipped before are not looked at again
+        report = add_location_ents(self.nlp, GazetteerMatcher(["boston"]))
+        self.assertEqual((report.from_parses, report.flagged, report.skipped), (0, 0, 0))
+
+        # a full parse still fills the entities of skipped posts
+        add_spacy_to_mongo(self.nlp)
+        self.assertEqual(Post.objects(pid="sp_c0").first().ents, [])
+
+    def test_location_recall(self) -> None:
+        """Test that recall is measured against parsing every skipped post."""
+        CommentPost(pid="sp_missed", text="Boston again").save()
+        report = add_location_ents(self.nlp, GazetteerMatcher(["tips"]), batch_size=2,
+                                   audit_rate=1.0)
+        self.assertEqual((report.flagged, report.skipped, report.audited), (1, 7, 7))
+        self.assertEqual((report.found, report.missed), (1, 1))
+        self.assertAlmostEqual(report.recall, 0.5)
+        self.assertEqual([e.text for e in Post.objects(pid="sp_missed").first().ents],
+                         ["Boston"])
+
+    def test_shards(self) -> None:
+        """Test that workers sharing shards parse every post, reclaiming a crashed worker's."""
+        SpacyShard.objects.delete()
+        leases = ShardLeases()
+        leases.plan(3, {})
+        leases.lease("crashed")
+        leases.collection.update_one(
+            {"worker": "crashed"}, {"$set": {"lease_expires": datetime.utcnow() - timedelta(1)}}
+        )
+
+        report = run_spacy_shards(self.nlp, 3, batch_size=2, leases=leases, worker="a")
+        self.assertEqual(report.parsed, 6)
+        self.assert_parsed()
+        self.assertEqual(leases.progress()["shards"], {DONE: 3})
+
+    def test_shards_stolen(self) -> None:
+        """Test that a worker whose lease is reclaimed mid-shard stops and leaves it alone."""
+        SpacyShard.objects.delete()
+        leases = ShardLeases()
+        leases.plan(1, {})
+        renew = leases.renew
+
+        def steal(shard: int, worker: str, parsed: int) -> bool:
+            leases.collection.update_one(
+                {"shard": shard}, {"$set": {"lease_expires": datetime.utcnow() - timedelta(1)}}
+            )
+            leases.lease("b")
+            return renew(shard, worker, parsed)
+
+        with patch.object(leases, "renew", side_effect=steal):
+            report = run_spacy_shards(self.nlp, 1, batch_size=2, leases=leases, worker="a")
+        self.assertEqual(report.parsed, 2)
+        shard = leases.collection.find_one()
+        self.assertEqual((shard["status"], shard["worker"]), (LEASED, "b"))
+
+    def test_shards_verify(self) -> None:
+        """Test that workers sharing shards re-parse posts whose text changed if verifying."""
+        SpacyShard.objects.delete()
+        add_spacy_to_mongo(self.nlp)
+        Post.objects(pid="sp_c0").update_one(set__text="edited comment")
+
+        report = run_spacy_shards(self.nlp, 2, leases=ShardLeases(), worker="a", verify=True)
+        self.assertEqual((report.parsed, report.unchanged), (1, 6))
+        post = Post.objects(pid="sp_c0").first()
+        self.assertEqual(bytes_to_spacy(post.spacy, self.nlp).text, "edited comment")
+
+    def test_stamps(self) -> None:
+        """Test that only posts parsed by another model or with changed text are re-parsed."""
+        self.assertEqual(count_stale_posts(self.nlp, verify=True),
+                         {"unparsed": 6, "stale_model": 0, "changed": 0})
+        add_spacy_to_mongo(self.nlp)
+        post = Post.objects(pid="sp_c0").first()
+        self.assertEqual((post.spacy_model, post.spacy_hash),
+                         ("en_pipeline-0.0.0", text_hash("comment number 0")))
+
+        Post.objects(pid="sp_c0").update_one(set__text="edited comment")
+        Post.objects(pid="sp_c1").update_one(set__spacy_model="en_core_web_sm-2.3.0")
+        self.assertEqual(count_stale_posts(self.nlp),
+                         {"unparsed": 0, "stale_model": 1})
+        self.assertEqual(count_stale_posts(self.nlp, verify=True),
+                         {"unparsed": 0, "stale_model": 1, "changed": 1})
+
+        self.assertEqual(add_spacy_to_mongo(self.nlp).parsed, 1)
+        report = add_spacy_to_mongo(self.nlp, verify=True)
+        self.assertEqual((report.parsed, report.unchanged), (1, 6))
+        post = Post.objects(pid="sp_c0").first()
+        self.assertEqual((bytes_to_spacy(post.spacy, self.nlp).text, post.spacy_hash),
+                         ("edited comment", text_hash("edited comment")))
+
+    def test_store(self) -> None:
+        """Test that parses put in a store leave only references on their posts."""
+        with tempfile.TemporaryDirectory() as tmp_dir, \
+                patch("src.parse_store.PARSE_DIR", tmp_dir), \
+                patch.dict("src.parse_store._readers", clear=True):
+            store = DiskParseStore(writer="test")
+            report = add_spacy_to_mongo(self.nlp, store=store)
+            self.assertEqual((report.parsed, report.spilled), (6, 0))
+            post = Post.objects(pid="sp_c0").first()
+            self.assertTrue(is_reference(post.spacy))
+            self.assertLess(len(post.spacy), 40)
+            self.assert_parsed()
+            store.close()
+            self.assertEqual(sorted(os.listdir(tmp_dir)), ["test-00000.bin", "test-00000.idx"])
@@ -0,0 +1,70 @@
+"""Tests for dropping already stored posts before conversion."""
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+from mongoengine import connect, disconnect
+
+from src.dedupe import BloomFilter, PidFilter
+from src.schema import CommentPost
+
+
+class TestBloomFilter(unittest.TestCase):
+    """Tests for the bloom filter."""
+
+    def test_membership(self) -> None:
+        """Test that added keys are members and few other keys are."""
+        bloom = BloomFilter.for_capacity(1000, error_rate=0.01)
+        for i in range(1000):
+            bloom.add(f"pid{i}")
+
+        self.assertTrue(all(f"pid{i}" in bloom for i in range(1000)))
+        false_positives = sum(f"other{i}" in bloom for i in range(10000))
+        self.assertLess(false_positives, 300)
+
+    def test_save_load(self) -> None:
+        """Test that a saved filter loads with the same members."""
+        bloom = BloomFilter.for_capacity(100)
+        bloom.add("abc")
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "pids.bloom")
+            bloom.save(path)
+            loaded = BloomFilter.load(path)
+
+        self.assertIn("abc", loaded)
+        self.assertNotIn("xyz", loaded)
+        self.assertEqual(loaded.n_items, 1)
+
+
+class TestPidFilter(unittest.TestCase):
+    """Tests for filtering out stored posts."""
+
+    @classmethod
+    def setUpClass(cls):
+        connect('mongoenginetest', host='mongomock://localhost')
+
+    @classmethod
+    def tearDownClass(cls):
+        disconnect()
+
+    def test_filter_new(self) -> None:
+        """Test that stored posts are skipped and counted, even across batches."""
+        CommentPost(pid="dedupe1").save()
+        CommentPost(pid="dedupe2").save()
+        pid_filter = PidFilter.from_mongo()
+        CommentPost(pid="dedupe3").save()
+
+        objs = [SimpleNamespace(id=f"dedupe{i}") for i in range(1, 6)]
+        new_objs = pid_filter.filter_new(objs)
+
+        # dedupe3 was stored after the filter was built, so it is left to the pid upsert
+        self.assertEqual([o.id for o in new_objs], ["dedupe3", "dedupe4", "dedupe5"])
+        self.assertEqual(pid_filter.n_checked, 5)
+        self.assertEqual(pid_filter.n_skipped, 2)
+
+        # pids seen in earlier batches are confirmed against mongo, not assumed stored
+        CommentPost(pid="dedupe4").save()
+        new_objs = pid_filter.filter_new(objs[2:])
+        self.assertEqual([o.id for o in new_objs], ["dedupe5"])
+        self.assertAlmostEqual(pid_filter.hit_rate, 4 / 8)
@@ -0,0 +1,102 @@
+"""Tests that raw encoded documents match the documents mongoengine stores."""
+import unittest
+from datetime import datetime
+from types import SimpleNamespace
+
+import numpy as np
+from bson import ObjectId
+from mongoengine import connect, disconnect
+from mongoengine.errors import FieldDoesNotExist, ValidationError
+
+from src.encoders import encode_document
+from src.schema import (CommentPost, DateRangeLocation, Location, Post, SubmissionPost,
+                        Subreddit, User)
+from src.utils import bulk_upsert_docs, convert_posts
+
+
+class TestEncodeDocument(unittest.TestCase):
+    """Tests for encoding documents without constructing them."""
+
+    @classmethod
+    def setUpClass(cls):
+        connect('mongoenginetest', host='mongomock://localhost')
+
+    @classmethod
+    def tearDownClass(cls):
+        disconnect()
+
+    def assert_parity(self, document, values, key) -> None:
+        """Assert that saving and raw inserting the given values store the same document."""
+        document(**values).save()
+        saved = document._get_collection().find_one({key: values[key]}, {"_id": 0})
+        document._get_collection().delete_many({key: values[key]})
+
+        document._get_collection().insert_one(encode_document(document, values))
+        inserted = document._get_collection().find_one({key: values[key]}, {"_id": 0})
+
+        self.assertEqual(inserted, saved)
+        self.assertEqual(list(inserted), list(saved))
+
+    def test_post_parity(self) -> None:
+        """Test that every post type is stored with the same fields and _cls marker."""
+        user = User(username="encoder_user")
+        user.save()
+        dt = datetime(2020, 7, 10, 12, 30, 15, 123456)
+
+        self.assert_parity(Post, {"pid": "enc_post", "text": "text", "datetime": dt}, "pid")
+        self.assert_parity(SubmissionPost, {
+            "pid": "enc_sub", "text": "text", "user": user, "datetime": dt,
+            "subreddit": "opiates", "spacy": b"\x00\x01", "url": "url", "title": "title",
+            "num_comments": 3,
+        }, "pid")
+        self.assert_parity(CommentPost, {
+            "pid": "enc_comm", "text": None, "user": user.id, "parent_id": "t3_enc_sub",
+        }, "pid")
+
+    def test_converted_value_parity(self) -> None:
+        """Test that values of other python types are converted like mongoengine would."""
+        self.assert_parity(SubmissionPost, {
+            "pid": "enc_np", "num_comments": np.int64(4), "datetime": "2020-07-10 12:30:15",
+        }, "pid")
+        self.assert_parity(SubmissionPost, {"pid": "enc_bool", "num_comments": True}, "pid")
+
+    def test_user_and_subreddit_parity(self) -> None:
+        """Test that defaults and embedded documents are stored like mongoengine would."""
+        self.assert_parity(User, {"username": "encoder_plain"}, "username")
+        location = DateRangeLocation(location=Location(city="Boston", state="MA"),
+                                     start_datetime=datetime(2020, 1, 1))
+        self.assert_parity(User, {"username": "encoder_located", "locations": [location]},
+                           "username")
+        self.assert_parity(Subreddit, {"name": "encoder_subr"}, "name")
+
+    def test_invalid_values(self) -> None:
+        """Test that invalid values are rejected like validate would."""
+        with self.assertRaises(ValidationError):
+            encode_document(CommentPost, {"text": "no pid"})
+        with self.assertRaises(ValidationError):
+            encode_document(CommentPost, {"pid": 123})
+        with self.assertRaises(ValidationError):
+            encode_document(SubmissionPost, {"pid": "enc_bad", "num_comments": "many"})
+        with self.assertRaises(ValidationError):
+            encode_document(CommentPost, {"pid": "enc_unsaved", "user": User(username="x")})
+        with self.assertRaises(FieldDoesNotExist):
+            encode_document(CommentPost, {"pid": "enc_title", "title": "comments have none"})
+
+    def test_encoded_posts_load_as_documents(self) -> None:
+        """Test that raw converted posts are bulk written and load as the right documents."""
+        objs = [
+            SimpleNamespace(id=f"enc_raw{i}", author="enc_author", created_utc=1594339200 + i,
+                            subreddit="opiates", body="text", parent_id="t3_abc")
+            for i in range(3)
+        ] + [SimpleNamespace(id=None, author="enc_author", created_utc=1594339200,
+                             subreddit="opiates", body="text", parent_id="t3_abc")]
+
+        docs = convert_posts(objs, False, encode_document)
+        report = bulk_upsert_docs(docs)
+
+        self.assertEqual(report.inserted, 3)
+        posts = list(Post.objects(pid__startswith="enc_raw").order_by("pid"))
+        self.assertTrue(all(isinstance(p, CommentPost) for p in posts))
+        self.assertEqual(posts[0].user.username, "enc_author")
+        self.assertEqual(posts[2].datetime, datetime(2020, 7, 10, 0, 0, 2))
+        self.assertIsInstance(docs[0]["user"], ObjectId)
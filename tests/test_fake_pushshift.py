@@ -0,0 +1,89 @@
+"""Tests for the local fake pushshift server."""
+import os
+import tempfile
+import time
+import unittest
+
+import requests
+
+from src.fake_pushshift import (FakePushshift, FakePushshiftServer, RecordingPushshift,
+                                load_fixtures, synthesize)
+from src.pushshift import PushshiftClient, TokenBucket
+from src.utils import get_psaw
+
+
+class TestFakePushshift(unittest.TestCase):
+    """Tests for serving, rate limiting and recording pushshift searches."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.records = synthesize(50, 200, n_authors=7)
+        cls.server = FakePushshiftServer(FakePushshift(cls.records)).__enter__()
+        cls.client = PushshiftClient(cls.server.base_url, limiter=TokenBucket(1000), page_size=30)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.__exit__()
+
+    def test_search(self) -> None:
+        """Test that paginated searches return every matching record newest first."""
+        after, before = self.records["comment"][20]["created_utc"], \
+            self.records["comment"][150]["created_utc"]
+        comments = list(self.client.search_comments(subreddit="Opiates", after=after,
+                                                    before=before))
+        expected = [r["id"] for r in reversed(self.records["comment"][21:150])
+                    if r["subreddit"] == "opiates"]
+        self.assertEqual([c.id for c in comments], expected)
+
+        submissions = list(self.client.search_submissions(author="fake_user3", limit=4))
+        self.assertEqual(len(submissions), 4)
+        self.assertTrue(all(s.author == "fake_user3" for s in submissions))
+
+        objs = self.client.search_ids("submission", ["fs1", "fs2", "missing"])
+        self.assertEqual([o.title for o in objs],
+                         [self.records["submission"][1]["title"],
+                          self.records["submission"][2]["title"]])
+
+    def test_search_shared_timestamps(self) -> None:
+        """Test that paging keeps posts sharing a timestamp across page boundaries."""
+        records = synthesize(0, 30, seconds_apart=0)
+        for i, record in enumerate(records["comment"]):
+            record["created_utc"] += i // 3
+        with FakePushshiftServer(FakePushshift(records)) as server:
+            client = PushshiftClient(server.base_url, limiter=TokenBucket(1000), page_size=4)
+            ids = [c.id for c in client.search_comments()]
+            self.assertEqual(sorted(ids), sorted(r["id"] for r in records["comment"]))
+            self.assertEqual(len(list(client.search_comments(limit=10))), 10)
+
+    def test_psaw(self) -> None:
+        """Test that psaw can be pointed at the fake server."""
+        psaw = get_psaw(None, self.server.base_url)
+        submissions = list(psaw.search_submissions(subreddit="heroin", limit=5))
+        self.assertEqual(len(submissions), 5)
+        self.assertTrue(all(s.subreddit == "heroin" for s in submissions))
+
+    def test_latency_and_rate_limit(self) -> None:
+        """Test that requests are delayed and answered with 429s beyond the rate limit."""
+        with FakePushshiftServer(FakePushshift(self.records), latency=0.05,
+                                 rate_limit_per_minute=60) as server:
+            url = f"{server.base_url}/reddit/comment/search"
+            start = time.perf_counter()
+            self.assertEqual(requests.get(url).status_code, 200)
+            self.assertGreaterEqual(time.perf_counter() - start, 0.05)
+            self.assertEqual(requests.get(url).status_code, 429)
+
+    def test_record_and_replay(self) -> None:
+        """Test that recorded responses replay the same search results."""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            fixture_fn = os.path.join(tmp_dir, "fixture.jsonl")
+            store = RecordingPushshift(self.server.base_url, fixture_fn)
+            with FakePushshiftServer(store) as recorder:
+                client = PushshiftClient(recorder.base_url, limiter=TokenBucket(1000))
+                recorded = [c.id for c in client.search_comments(author="fake_user1")]
+
+            with FakePushshiftServer(FakePushshift(load_fixtures([fixture_fn]))) as replayer:
+                client = PushshiftClient(replayer.base_url, limiter=TokenBucket(1000))
+                replayed = [c.id for c in client.search_comments(author="fake_user1")]
+
+        self.assertTrue(recorded)
+        self.assertEqual(replayed, recorded)
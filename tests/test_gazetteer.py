@@ -0,0 +1,62 @@
+"""Tests for the gazetteer place name matcher."""
+import unittest
+
+from src.gazetteer import ALIAS_MAP, AhoCorasick, GazetteerMatcher, load_matcher, place_names
+
+
+class TestAhoCorasick(unittest.TestCase):
+    """Tests for finding many patterns in one pass."""
+
+    def test_overlapping(self) -> None:
+        """Test that overlapping and nested occurrences are all found."""
+        automaton = AhoCorasick(["he", "she", "his", "hers"])
+        text = "ushers his"
+        found = sorted(text[start:end] for start, end in automaton.finditer(text))
+        self.assertEqual(found, ["he", "hers", "his", "she"])
+
+    def test_offsets(self) -> None:
+        """Test that every occurrence is found at its offsets."""
+        automaton = AhoCorasick(["aa", "a"])
+        self.assertEqual(sorted(automaton.finditer("aaa")),
+                         [(0, 1), (0, 2), (1, 2), (1, 3), (2, 3)])
+
+    def test_no_patterns(self) -> None:
+        """Test that an automaton without patterns finds nothing."""
+        self.assertEqual(list(AhoCorasick([""]).finditer("anything")), [])
+
+
+class TestGazetteerMatcher(unittest.TestCase):
+    """Tests for flagging texts that could name a place."""
+
+    def setUp(self):
+        self.matcher = GazetteerMatcher(["Boston", "new york city", "l.a."], ["MA", "OR"])
+
+    def test_names(self) -> None:
+        """Test that names match whole words in any case."""
+        self.assertTrue(self.matcher.matches("moving to boston next week"))
+        self.assertTrue(self.matcher.matches("NEW YORK CITY prices"))
+        self.assertTrue(self.matcher.matches("copping in L.A."))
+        self.assertFalse(self.matcher.matches("bostonian habits"))
+        self.assertFalse(self.matcher.matches("nothing to see"))
+
+    def test_codes(self) -> None:
+        """Test that state codes only match in upper case."""
+        self.assertTrue(self.matcher.matches("cheap in MA"))
+        self.assertFalse(self.matcher.matches("ma said no"))
+        self.assertFalse(self.matcher.matches("this or that"))
+        self.assertEqual(list(self.matcher.find("Boston, MA")), [(0, 6), (8, 10)])
+
+    def test_place_names(self) -> None:
+        """Test that the resources' names are loaded without stop words."""
+        names, codes = place_names()
+        self.assertLessEqual(set(ALIAS_MAP) | set(ALIAS_MAP.values()), names)
+        self.assertIn("boston", names)
+        self.assertIn("TX", codes)
+        self.assertNotIn("in", names)
+        matcher = load_matcher()
+        self.assertTrue(matcher.matches("anyone in Vegas?"))
+        self.assertFalse(matcher.matches("day three of withdrawal and I feel it"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+"""Tests for the history backfill queue."""
+import unittest
+from datetime import datetime, timedelta
+
+from mongoengine import connect, disconnect
+
+from src.history_queue import HistoryQueue
+from src.leases import DONE, EXPIRED_ERROR, FAILED, LEASED, PENDING
+from src.schema import HistoryTask
+from src.utils import UserResolver
+
+
+class TestHistoryQueue(unittest.TestCase):
+    """Tests for queueing, leasing and completing history tasks."""
+
+    @classmethod
+    def setUpClass(cls):
+        connect('mongoenginetest', host='mongomock://localhost')
+
+    @classmethod
+    def tearDownClass(cls):
+        disconnect()
+
+    def setUp(self):
+        HistoryTask.objects.delete()
+
+    def test_enqueue_dedupes(self) -> None:
+        """Test that each user is queued once, however often they are enqueued."""
+        queue = HistoryQueue()
+        self.assertEqual(queue.enqueue(["q_a", "q_b", "q_a", None]), 2)
+        self.assertEqual(queue.enqueue(["q_b", "q_c"]), 1)
+        self.assertEqual(queue.counts(), {PENDING: 3})
+
+    def test_lease_complete_and_expire(self) -> None:
+        """Test that leased tasks are hidden until their lease expires or they complete."""
+        queue = HistoryQueue()
+        queue.enqueue(["q_a"])
+        queue.enqueue(["q_b"])
+
+        self.assertEqual(list(queue.leases("a")), ["q_a", "q_b"])
+        self.assertIsNone(queue.lease("a"))
+        self.assertEqual(queue.counts(), {LEASED: 2})
+
+        self.assertTrue(queue.complete("q_a", "a"))
+        HistoryTask.objects(username="q_b").update_one(
+            set__lease_expires=datetime.utcnow() - timedelta(seconds=1)
+        )
+        self.assertEqual(queue.lease("b"), "q_b")
+        self.assertEqual(HistoryTask.objects(username="q_a").first().status, DONE)
+        self.assertEqual(HistoryTask.objects(username="q_b").first().attempts, 2)
+
+    def test_lost_lease(self) -> None:
+        """Test that a worker cannot complete or fail a task another worker has reclaimed."""
+        queue = HistoryQueue()
+        queue.enqueue(["q_slow"])
+        self.assertEqual(queue.lease("a"), "q_slow")
+        HistoryTask.objects(username="q_slow").update_one(
+            set__lease_expires=datetime.utcnow() - timedelta(seconds=1)
+        )
+        self.assertEqual(queue.lease("b"), "q_slow")
+
+        queue.fail("q_slow", "a", "timed out")
+        self.assertFalse(queue.complete("q_slow", "a"))
+        task = HistoryTask.objects(username="q_slow").first()
+        self.assertEqual((task.status, task.worker, task.error), (LEASED, "b", None))
+        self.assertTrue(queue.complete("q_slow", "b"))
+
+    def test_fail(self) -> None:
+        """Test that failed tasks are retried until they are out of attempts."""
+        queue = HistoryQueue(max_attempts=2)
+        queue.enqueue(["q_fail"])
+
+        self.assertEqual(queue.lease("a"), "q_fail")
+        queue.fail("q_fail", "a", "pushshift is down")
+        self.assertEqual(queue.lease("a"), "q_fail")
+        queue.fail("q_fail", "a", "pushshift is down")
+
+        self.assertIsNone(queue.lease("a"))
+        task = HistoryTask.objects(username="q_fail").first()
+        self.assertEqual((task.status, task.error), (FAILED, "pushshift is down"))
+
+    def test_expire_on_final_attempt(self) -> None:
+        """Test that a task whose worker died on its final attempt is parked as failed."""
+        queue = HistoryQueue(lease_seconds=0, max_attempts=1)
+        queue.enqueue(["q_dead"])
+        self.assertEqual(queue.lease("a"), "q_dead")
+
+        self.assertIsNone(queue.lease("b"))
+        task = HistoryTask.objects(username="q_dead").first()
+        self.assertEqual((task.status, task.error), (FAILED, EXPIRED_ERROR))
+        self.assertEqual(queue.counts(), {FAILED: 1})
+
+    def test_resolver_queues_new_users(self) -> None:
+        """Test that only the users a resolver creates are queued."""
+        UserResolver().resolve(["q_new_user"])
+        UserResolver().resolve(["q_new_user"])
+        UserResolver(queue_histories=False).resolve(["q_unqueued_user"])
+
+        self.assertEqual([t.username for t in HistoryTask.objects], ["q_new_user"])
@@ -0,0 +1,45 @@
+"""Tests for the append-only job journal."""
+import os
+import tempfile
+import unittest
+
+from src.journal import Journal
+
+
+class TestJournal(unittest.TestCase):
+    """Tests for recording and resuming completed work."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "journal.jsonl")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_resume(self) -> None:
+        """Test that records survive reopening and the latest record wins."""
+        with Journal(self.path) as journal:
+            journal.add("user1", n_posts=3)
+            journal.add("user2", n_posts=0)
+            journal.add("user1", n_posts=4)
+
+        journal = Journal(self.path)
+        self.assertIn("user1", journal)
+        self.assertNotIn("user3", journal)
+        self.assertEqual(len(journal), 2)
+        self.assertEqual(journal.get("user1"), {"n_posts": 4})
+        journal.close()
+
+    def test_torn_record(self) -> None:
+        """Test that a partially written final record is ignored and not corrupting."""
+        with Journal(self.path) as journal:
+            journal.add("user1")
+        with open(self.path, "a") as journal_file:
+            journal_file.write('{"key": "us')
+
+        with Journal(self.path) as journal:
+            self.assertEqual(list(journal), ["user1"])
+            journal.add("user2")
+
+        with Journal(self.path) as journal:
+            self.assertEqual(list(journal), ["user1", "user2"])
@@ -0,0 +1,92 @@
+"""Tests for the stores of spacy parses kept off their posts."""
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from mongoengine import connect, disconnect
+
+from src.parse_store import (DiskParseStore, MongoParseStore, ParseStore, is_reference,
+                             load_parse)
+from src.schema import SpacyBlob
+
+
+class TestParseStore(unittest.TestCase):
+    """Tests for putting parses in stores and following references to them."""
+
+    @classmethod
+    def setUpClass(cls):
+        connect('mongoenginetest', host='mongomock://localhost')
+
+    @classmethod
+    def tearDownClass(cls):
+        disconnect()
+
+    def test_disk(self) -> None:
+        """Test that parses are appended to indexed shards that roll over when full."""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            store = DiskParseStore(tmp_dir, shard_bytes=10, writer="node:1")
+            refs = [store.put(f"key{i}", bytes([i]) * 6) for i in range(3)]
+            store.flush()
+
+            self.assertTrue(all(is_reference(ref) for ref in refs))
+            self.assertEqual([store.get(ref) for ref in refs],
+                             [bytes([i]) * 6 for i in range(3)])
+            self.assertEqual(sorted(os.listdir(tmp_dir)),
+                             ["node-1-00000.bin", "node-1-00000.idx",
+                              "node-1-00001.bin", "node-1-00001.idx"])
+            with open(os.path.join(tmp_dir, "node-1-00000.idx")) as index_file:
+                self.assertEqual([json.loads(line) for line in index_file],
+                                 [{"key": "key0", "offset": 0, "length": 6},
+                                  {"key": "key1", "offset": 6, "length": 6}])
+            store.close()
+
+            # a new writer with the same name appends to its last shard that has room
+            store = DiskParseStore(tmp_dir, shard_bytes=10, writer="node:1")
+            self.assertTrue(store.put("key3", b"x").startswith(b"ParseShard:node-1-00001.bin:6:"))
+            store.close()
+
+            with patch("src.parse_store.PARSE_DIR", tmp_dir), \
+                    patch.dict("src.parse_store._readers", clear=True):
+                self.assertEqual(load_parse(refs[2]), bytes([2]) * 6)
+
+    def test_disk_flush_syncs(self) -> None:
+        """Test that flushing fsyncs the shard and its index before references are written."""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            store = DiskParseStore(tmp_dir, writer="test")
+            store.put("key0", b"012")
+            with patch("src.parse_store.os.fsync", wraps=os.fsync) as fsync:
+                store.flush()
+            self.assertEqual(sorted(call.args[0] for call in fsync.call_args_list),
+                             sorted([store.shard[1].fileno(), store.shard[2].fileno()]))
+            store.close()
+
+    def test_abstract(self) -> None:
+        """Test that stores must implement putting and getting parses."""
+        with self.assertRaises(TypeError):
+            ParseStore()
+
+    def test_mongo(self) -> None:
+        """Test that parses are split into parts and old versions kept until pruned."""
+        store = MongoParseStore()
+        key = "Post.CommentPost:ps_1"
+        # a part put before parses were versioned
+        SpacyBlob(key=key, part=0, data=b"old").save()
+        with patch.object(MongoParseStore, "part_bytes", 4):
+            ref = store.put(key, b"0123456789")
+            self.assertEqual(SpacyBlob.objects(post=key).count(), 3)
+            self.assertEqual(load_parse(ref), b"0123456789")
+
+            new_ref = store.put(key, b"012")
+            self.assertEqual(load_parse(ref), b"0123456789")
+            self.assertEqual(load_parse(new_ref), b"012")
+
+            self.assertEqual(store.prune([key], [new_ref]), 4)
+            self.assertEqual(load_parse(new_ref), b"012")
+            self.assertEqual(SpacyBlob.objects.count(), 1)
+            store.delete(new_ref)
+            self.assertEqual(SpacyBlob.objects.count(), 0)
+
+        self.assertFalse(is_reference(b"DocBin:..."))
+        self.assertEqual(load_parse(b"DocBin:..."), b"DocBin:...")
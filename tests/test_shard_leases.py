@@ -0,0 +1,103 @@
+"""Tests for the spacy shard leases."""
+import unittest
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+from mongoengine import connect, disconnect
+
+from src.leases import DONE, EXPIRED_ERROR, FAILED, LEASED, PENDING
+from src.schema import CommentPost, Post, SpacyShard
+from src.shard_leases import ShardLeases, worker_name
+
+
+class TestShardLeases(unittest.TestCase):
+    """Tests for planning, leasing and completing pid-range shards."""
+
+    @classmethod
+    def setUpClass(cls):
+        connect('mongoenginetest', host='mongomock://localhost')
+
+    @classmethod
+    def tearDownClass(cls):
+        disconnect()
+
+    def setUp(self):
+        SpacyShard.objects.delete()
+        Post.objects.delete()
+        for i in range(200):
+            CommentPost(pid=f"sl_{i:03d}", text="text").save()
+
+    def test_plan(self) -> None:
+        """Test that shards cover every pid once and are only planned between rounds."""
+        leases = ShardLeases()
+        self.assertEqual(leases.plan(4, {}), 4)
+        self.assertEqual(leases.plan(4, {}), 0)
+
+        shards = list(leases.collection.find().sort("shard", 1))
+        self.assertIsNone(shards[0].get("lo"))
+        self.assertIsNone(shards[-1].get("hi"))
+        for shard, next_shard in zip(shards, shards[1:]):
+            self.assertEqual(shard["hi"], next_shard["lo"])
+        counts = [Post.objects(pid__gte=s.get("lo") or "", pid__lt=s.get("hi") or "~").count()
+                  for s in shards]
+        self.assertEqual(sum(counts), 200)
+        self.assertTrue(all(counts))
+
+        leases.collection.update_many({}, {"$set": {"status": DONE}})
+        self.assertEqual(leases.plan(2, {}), 2)
+        self.assertEqual(leases.progress()["shards"], {PENDING: 2})
+
+    def test_lease_renew_and_expire(self) -> None:
+        """Test that a lapsed lease is reclaimed and its first worker can no longer renew it."""
+        leases = ShardLeases()
+        leases.plan(2, {})
+        self.assertEqual(leases.lease("a")["shard"], 0)
+        self.assertTrue(leases.renew(0, "a", 10))
+
+        leases.collection.update_one(
+            {"shard": 0}, {"$set": {"lease_expires": datetime.utcnow() - timedelta(seconds=1)}}
+        )
+        self.assertEqual(leases.lease("b")["shard"], 0)
+        self.assertFalse(leases.renew(0, "a", 20))
+        self.assertFalse(leases.complete(0, "a", 20, 1.0))
+        leases.fail(0, "a", "late")
+        self.assertEqual(leases.collection.find_one({"shard": 0})["status"], LEASED)
+        self.assertEqual(leases.lease("a")["shard"], 1)
+        self.assertIsNone(leases.lease("c"))
+
+        self.assertTrue(leases.complete(0, "b", 30, 1.0))
+        self.assertEqual(leases.progress(), {"shards": {DONE: 1, LEASED: 1}, "parsed": 30,
+                                             "workers": {"a": 0, "b": 30}})
+
+    def test_fail(self) -> None:
+        """Test that failed shards are retried until they are out of attempts."""
+        leases = ShardLeases(max_attempts=2)
+        leases.plan(1, {})
+        for _ in range(2):
+            self.assertEqual(leases.lease("a")["shard"], 0)
+            leases.fail(0, "a", "out of memory")
+        self.assertIsNone(leases.lease("a"))
+        self.assertEqual(leases.collection.find_one()["status"], FAILED)
+
+    def test_expire_on_final_attempt(self) -> None:
+        """Test that shards whose workers died on their final attempt fail and free the round."""
+        leases = ShardLeases(lease_seconds=0, max_attempts=1)
+        leases.plan(2, {})
+        self.assertEqual(leases.lease("a")["shard"], 0)
+        self.assertEqual(leases.lease("b")["shard"], 1)
+
+        self.assertIsNone(leases.lease("c"))
+        self.assertEqual(leases.progress()["shards"], {FAILED: 2})
+        self.assertEqual(leases.collection.find_one({"shard": 0})["error"], EXPIRED_ERROR)
+        self.assertEqual(leases.plan(2, {}), 2)
+
+    def test_worker_name_slurm(self) -> None:
+        """Test that Slurm tasks on different nodes with the same pid get different names."""
+        names = set()
+        for host, procid in [("node1", "0"), ("node2", "1")]:
+            env = {"SLURM_JOB_ID": "42", "SLURM_PROCID": procid}
+            with patch.dict("os.environ", env), \
+                    patch("socket.gethostname", return_value=host), \
+                    patch("os.getpid", return_value=1234):
+                names.add(worker_name())
+        self.assertEqual(names, {"node1:42:0:1234", "node2:42:1:1234"})
@@ -1,8 +1,11 @@
-from src.utils import last_date
-from src.schema import Post
+from src.utils import (UserResolver, bounded_map, build_post, bulk_posts_to_mongo, chunked,
+                       convert_posts, last_date)
+from src.schema import CommentPost, Post, SubmissionPost, User
 from mongoengine import connect, disconnect
 import unittest
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from types import SimpleNamespace
 
 
 class TestUtils(unittest.TestCase):
@@ -30,3 +33,87 @@ class TestUtils(unittest.TestCase):
         self.assertEqual(last_date(), datetime(2020, 7, 16))
         self.assertEqual(last_date(subreddit="subr"), datetime(2020, 7, 10))
         self.assertEqual(last_date(subreddit="subr_2"), datetime(2020, 6, 11))
+
+    def test_chunked(self) -> None:
+        """Test that iterables are split into bounded chunks."""
+        self.assertEqual(list(chunked(range(5), 2)), [[0, 1], [2, 3], [4]])
+        self.assertEqual(list(chunked([], 2)), [])
+
+    def test_bounded_map(self) -> None:
+        """Test that every item is mapped while only a bounded number are pulled at once."""
+        pulled = []
+
+        def items():
+            for i in range(10):
+                pulled.append(i)
+                yield i
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            results = bounded_map(lambda i: executor.submit(pow, i, 2), items(), 3)
+            first = next(results)
+            self.assertLessEqual(len(pulled), 3)
+            done = dict([first, *results])
+        self.assertEqual({i: f.result() for i, f in done.items()}, {i: i * i for i in range(10)})
+
+    def test_bulk_posts_to_mongo(self) -> None:
+        """Test that bulk writes insert new posts and count duplicates/invalid posts."""
+        SubmissionPost(pid="bulk1", text="already stored").save()
+        posts = [
+            SubmissionPost(pid="bulk1", text="duplicate"),
+            SubmissionPost(pid="bulk2", title="new submission"),
+            CommentPost(pid="bulk3", parent_id="t3_bulk2"),
+            CommentPost(pid="bulk3", parent_id="t3_bulk2"),
+            CommentPost(text="no pid"),
+        ]
+
+        report = bulk_posts_to_mongo(posts, batch_size=2)
+
+        self.assertEqual(report.inserted, 2)
+        self.assertEqual(report.duplicates, 2)
+        self.assertEqual(report.invalid, 1)
+        self.assertEqual(Post.objects(pid="bulk1").first().text, "already stored")
+        self.assertIsInstance(Post.objects(pid="bulk2").first(), SubmissionPost)
+        self.assertEqual(CommentPost.objects(pid="bulk3").count(), 1)
+
+    def test_user_resolver(self) -> None:
+        """Test that users are resolved in bulk, created if missing and cached."""
+        existing = User(username="resolver_existing")
+        existing.save()
+
+        resolver = UserResolver(max_size=2)
+        users = resolver.resolve(["resolver_existing", "resolver_new", "resolver_new", None])
+
+        self.assertEqual(set(users), {"resolver_existing", "resolver_new"})
+        self.assertEqual(users["resolver_existing"].id, existing.id)
+        self.assertEqual(User.objects(username="resolver_new").count(), 1)
+        self.assertEqual(users["resolver_new"].id, User.objects(username="resolver_new").first().id)
+
+        # cached users are returned without querying mongo
+        User.objects(username="resolver_new").delete()
+        self.assertEqual(resolver.get("resolver_new").id, users["resolver_new"].id)
+
+        # the least recently used user is evicted once the cache is full
+        resolver.get("resolver_third")
+        self.assertNotIn("resolver_existing", resolver.cache)
+        self.assertIsNone(resolver.get(None))
+
+    def test_convert_posts(self) -> None:
+        """Test that a batch of praw comments is converted with shared users."""
+        comments = [
+            SimpleNamespace(
+                id=f"conv{i}",
+                author=SimpleNamespace(name="conv_author"),
+                created_utc=1594339200,
+                subreddit=SimpleNamespace(display_name="opiates"),
+                body="text",
+                parent_id="t3_abc",
+            )
+            for i in range(3)
+        ]
+
+        posts = convert_posts(comments, False, build_post)
+
+        self.assertEqual([p.pid for p in posts], ["conv0", "conv1", "conv2"])
+        self.assertTrue(all(isinstance(p, CommentPost) for p in posts))
+        self.assertEqual(len({p.user.id for p in posts}), 1)
+        self.assertEqual(User.objects(username="conv_author").count(), 1)